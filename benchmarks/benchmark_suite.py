@@ -0,0 +1,125 @@
+"""
+This script times the tokenizer, the parser and end-to-end evaluation of representative XPATH expressions
+against synthetic HTML documents, and writes the results as JSON.
+
+usage: python benchmarks/benchmark_suite.py [--elements N] [--depth D] [--repeat R] [--output results.json]
+                                           [--compare previous_results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bs4 as bs
+
+from synthetic_html import generate_html
+from xpath_bs import XPATH
+from xpath_syntax_tree import XPATHSyntaxTree
+from xpath_tokenizer import XPATHTokenizer
+
+QUERIES = {
+    'tag': "//img",
+    'nested-tag': "//div//span",
+    'attribute-equal': "//span[@itemprop = 'price']",
+    'and': "//img[@src > 'https://images.example.com/1' and @src < 'https://images.example.com/2']",
+    'or': "//a[@href < 'https://example.com/c' or @title > 'link 9']",
+    'contains': "//a[contains(@href, 'shop')]",
+    'attribute': "//img/@src",
+    'text': "//span/text()",
+}
+
+
+def measure(function, repeat, number):
+    """
+    This function times a function, taking the best of a number of repetitions
+    :param function:    the function to be timed
+    :param repeat:      the number of repetitions
+    :param number:      the number of calls per repetition
+    :return:            the number of seconds per call
+    """
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def run(elements, depth, repeat):
+    """
+    This function runs the benchmark suite
+    :param elements:    the approximate number of elements in the synthetic document
+    :param depth:       the maximum nesting depth of the synthetic document
+    :param repeat:      the number of repetitions of each measurement
+    :return:            a dictionary, ready to be written as JSON
+    """
+    html = generate_html(elements=elements, depth=depth)
+    doc = bs.BeautifulSoup(html, 'html.parser')
+    results = []
+    for name, query in QUERIES.items():
+
+        # tokenizer
+        tokens = XPATHTokenizer().tokenize_expression(query)
+        seconds = measure(lambda: XPATHTokenizer().tokenize_expression(query), repeat, 200)
+        results.append({'name': name, 'stage': 'tokenize', 'query': query, 'seconds': seconds, 'size': len(tokens)})
+
+        # parser
+        nodes = XPATHSyntaxTree().xpath_to_syntax_tree(query)
+        seconds = measure(lambda: XPATHSyntaxTree().xpath_to_syntax_tree(query), repeat, 200)
+        results.append({'name': name, 'stage': 'parse', 'query': query, 'seconds': seconds, 'size': len(nodes)})
+
+        # end-to-end
+        size = len(XPATH.xpath(query, doc))
+        seconds = measure(lambda: XPATH.xpath(query, doc), repeat, 1)
+        results.append({'name': name, 'stage': 'evaluate', 'query': query, 'seconds': seconds, 'size': size})
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'bs4': bs.__version__,
+        'parameters': {'elements': elements, 'depth': depth, 'repeat': repeat, 'document_size': len(html)},
+        'results': results,
+    }
+
+
+def compare(report, previous_report):
+    """
+    This function compares two benchmark reports
+    :param report:          the current report
+    :param previous_report: the report it should be compared to
+    :return:                a list of tuples (name, stage, previous seconds, current seconds, ratio)
+    """
+    previous = {(r['name'], r['stage']): r['seconds'] for r in previous_report['results']}
+    out = []
+    for r in report['results']:
+        key = (r['name'], r['stage'])
+        if key in previous and previous[key] > 0:
+            out.append((r['name'], r['stage'], previous[key], r['seconds'], r['seconds'] / previous[key]))
+    return out
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmark the XPATH tokenizer, parser and evaluator')
+    parser.add_argument('--elements', type=int, default=2000, help='approximate number of elements in the document')
+    parser.add_argument('--depth', type=int, default=8, help='maximum nesting depth of the document')
+    parser.add_argument('--repeat', type=int, default=5, help='number of repetitions of each measurement')
+    parser.add_argument('--output', default=None, help='file to write the JSON results to (default: stdout)')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run, to compare against')
+    args = parser.parse_args()
+
+    report = run(args.elements, args.depth, args.repeat)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        for r in report['results']:
+            print('{:<16} {:<9} {:>12.6f} ms  (size {})'.format(r['name'], r['stage'], r['seconds'] * 1000, r['size']))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous_report = json.load(f)
+        for (name, stage, before, after, ratio) in compare(report, previous_report):
+            print('{:<16} {:<9} {:>12.6f} ms -> {:>12.6f} ms  {:>6.2f}x{}'.format(name, stage, before * 1000, after * 1000, ratio, '  REGRESSION' if ratio > 1.1 else ''))
@@ -0,0 +1,143 @@
+"""
+This script checks XPATH.axpath_pipeline against an in-process HTTP server (asyncio.start_server) that stands in for
+a crawler's sources: results must come back in the order of the payloads, match XPATH.xpath on the same pages,
+keep the event loop responsive, and stop cleanly when the caller stops early.
+
+usage: python benchmarks/check_pipeline.py [--pages N] [--elements N] [--workers W]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bs4 as bs
+
+from synthetic_html import generate_html
+from xpath_bs import XPATH
+
+QUERY = "//span[@itemprop = 'price']/text()"
+
+# the longest the event loop may be blocked while the pipeline runs
+MAX_LOOP_GAP = 0.25
+
+
+async def serve(pages):
+    """
+    This function starts an HTTP/1.0 server on a free local port, that serves each page under '/<index>'
+    :param pages:   a list of HTML strings
+    :return:        a tuple (server, port)
+    """
+
+    async def handle(reader, writer):
+        request = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        body = pages[int(request.split()[1][1:])].encode()
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return (server, server.sockets[0].getsockname()[1])
+
+
+async def fetch(port, path):
+    """
+    This function downloads a page from the local server
+    :param port:    the port of the server
+    :param path:    the path of the page
+    :return:        the body of the response (bytes)
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write('GET {} HTTP/1.0\r\n\r\n'.format(path).encode())
+    data = await reader.read()
+    writer.close()
+    return data.split(b'\r\n\r\n', 1)[1]
+
+
+async def check(pages, workers):
+    """
+    This function runs the pipeline on the pages served by the local server
+    :param pages:   a list of HTML strings
+    :param workers: the number of worker processes of the pipeline
+    :return:        a list of failure messages
+    """
+    failures = []
+    (server, port) = await serve(pages)
+    expected = [XPATH.xpath(QUERY, bs.BeautifulSoup(p, 'html.parser')) for p in pages]
+
+    # measure how long the event loop is blocked, while the pipeline runs
+    gaps = []
+
+    async def ticker():
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    async def payloads():
+        for i in range(len(pages)):
+            yield await fetch(port, '/{}'.format(i))
+
+    t = asyncio.ensure_future(ticker())
+    try:
+
+        # worker processes
+        results = [r async for r in XPATH.axpath_pipeline(QUERY, payloads(), workers=workers, max_pending=2)]
+        if [r.index for r in results] != list(range(len(pages))):
+            failures.append('results out of order: {}'.format([r.index for r in results]))
+        if [r.value if r.ok else None for r in results] != expected:
+            failures.append('results differ from XPATH.xpath')
+        if len(gaps) > 0 and max(gaps) > MAX_LOOP_GAP:
+            failures.append('event loop blocked for {:.1f} ms'.format(max(gaps) * 1000))
+
+        # threads, one document at a time
+        with ThreadPoolExecutor(workers) as executor:
+            results = [r async for r in XPATH.axpath_pipeline(QUERY, pages, executor=executor, max_pending=1)]
+        if [r.value if r.ok else None for r in results] != expected:
+            failures.append('results differ from XPATH.xpath (threads)')
+
+        # early stop
+        pipeline = XPATH.axpath_pipeline(QUERY, payloads(), workers=workers, max_pending=2)
+        first = await pipeline.__anext__()
+        await pipeline.aclose()
+        if first.index != 0:
+            failures.append('first result has index {}'.format(first.index))
+
+        # invalid arguments
+        for (expression, kwargs) in [(QUERY, {'max_pending': 0}), (QUERY, {'workers': 0}), ('//[[', {})]:
+            try:
+                XPATH.axpath_pipeline(expression, pages, **kwargs)
+                failures.append('{} {} accepted'.format(expression, kwargs))
+            except (ValueError, SyntaxError):
+                pass
+    finally:
+        t.cancel()
+        server.close()
+        await server.wait_closed()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--pages', type=int, default=12)
+    parser.add_argument('--elements', type=int, default=3000)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    pages = [generate_html(elements=args.elements, seed=i) for i in range(args.pages)]
+    failures = asyncio.run(check(pages, args.workers))
+    for f in failures:
+        print('FAIL {}'.format(f))
+    print('{} pages, {} failures'.format(len(pages), len(failures)))
+    return 1 if len(failures) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
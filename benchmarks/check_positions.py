@@ -0,0 +1,70 @@
+"""
+This script checks positional predicates ('[1]', '[last()]', '[position() < n]') against the results XPATH prescribes,
+with positions counted for each context node. Every expression is evaluated eagerly and lazily,
+on BeautifulSoup, DocumentSnapshot, IndexedDocument and ElementTree.
+
+usage: python benchmarks/check_positions.py
+"""
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bs4 as bs
+
+from xpath_bs import XPATH
+from xpath_index import IndexedDocument
+from xpath_snapshot import DocumentSnapshot
+
+DOCUMENT = '<html><body>' \
+           '<div><table><tr><td>a</td><td>b</td></tr><tr><td>c</td><td>d</td></tr></table></div>' \
+           '<div><table><tr><td>e</td></tr></table></div>' \
+           '</body></html>'
+
+# expression -> expected result (text, or the tag names of the selected elements)
+EXPECTED = {
+    "//tr/td[1]/text()": ['a', 'c', 'e'],
+    "//tr/td[last()]/text()": ['b', 'd', 'e'],
+    "//tr[1]/td/text()": ['a', 'b', 'e'],
+    "/html/body/div/table[1]": ['table', 'table'],
+    "//td[1]/text()": ['a', 'c', 'e'],
+    "//td[2]/text()": ['b', 'd'],
+    "//td[position() > 1]/text()": ['b', 'd'],
+    "//tr[last()]/td[last()]/text()": ['d', 'e'],
+    "//div[2]//td/text()": ['e'],
+    "//td/ancestor::*[1]": ['tr', 'tr', 'tr'],
+    "//td/ancestor::*[3]": ['div', 'div'],
+    "//td[1]/following-sibling::td[1]/text()": ['b', 'd'],
+    "//td[last()]/preceding-sibling::td[1]/text()": ['a', 'c'],
+    "//table/descendant::td[1]/text()": ['a', 'e'],
+    "//table/descendant::td[last()]/text()": ['d', 'e'],
+    "//td/..[1]": ['tr', 'tr', 'tr'],
+}
+
+
+def names(result, tag):
+    return [x if isinstance(x, str) else tag(x) for x in result]
+
+
+def main():
+    soup = bs.BeautifulSoup(DOCUMENT, 'html.parser')
+    snapshot = DocumentSnapshot(soup)
+    documents = [('bs4', soup, lambda x: x.name),
+                 ('snapshot', snapshot, snapshot.adapter.tag),
+                 ('index', IndexedDocument(soup), lambda x: x.name),
+                 ('etree', ET.fromstring(DOCUMENT), lambda x: x.tag)]
+    failures = 0
+    for (expression, expected) in EXPECTED.items():
+        for (name, doc, tag) in documents:
+            for (mode, result) in [('xpath', XPATH.xpath(expression, doc)), ('iterxpath', list(XPATH.iterxpath(expression, doc)))]:
+                found = names(result, tag)
+                if found != expected:
+                    failures += 1
+                    print('FAIL {:45} {:9} {:9} expected {} found {}'.format(expression, name, mode, expected, found))
+    print('{} expressions, {} failures'.format(len(EXPECTED), failures))
+    return 1 if failures > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+This module generates synthetic HTML documents, so that benchmarks do not depend on the network.
+"""
+import random
+
+
+def generate_html(elements=2000, depth=8, seed=0):
+    """
+    This function generates a (deterministic) HTML document
+    :param elements:    the approximate number of elements in the body
+    :param depth:       the maximum nesting depth of the body
+    :param seed:        the seed of the random number generator
+    :return:            an HTML string
+    """
+    rnd = random.Random(seed)
+    out = ['<html><head><title>synthetic document</title></head><body>']
+    remaining = [elements]
+
+    def element(level):
+        remaining[0] -= 1
+        i = remaining[0]
+        if level < depth and rnd.random() < 0.6:
+            out.append('<div class="{}" id="d{}">'.format(rnd.choice(['item', 'row', 'col', 'item active']), i))
+            for _ in range(rnd.randint(1, 4)):
+                if remaining[0] <= 0:
+                    break
+                element(level + 1)
+            out.append('</div>')
+            return
+        kind = rnd.choice(['a', 'img', 'span', 'p'])
+        if kind == 'a':
+            out.append('<a href="https://example.com/{}/{}" title="link {}">link {}</a>'.format(rnd.choice(['news', 'shop', 'blog']), i, i, i))
+        elif kind == 'img':
+            out.append('<img src="https://images.example.com/{}.jpg" alt="image {}"/>'.format(i, i))
+        elif kind == 'span':
+            out.append('<span itemprop="{}">text {}</span>'.format(rnd.choice(['label', 'price', 'name']), i))
+        else:
+            out.append('<p>paragraph {} <b>bold</b> <i>italic</i></p>'.format(i))
+
+    while remaining[0] > 0:
+        element(0)
+    out.append('</body></html>')
+    return ''.join(out)
@@ -0,0 +1,86 @@
+"""
+This script compares the throughput (tokens per second) of the greedy candidate-scan tokenizer
+that XPATHTokenizer used to implement, with the single-pass tokenizer it implements now.
+
+usage: python benchmarks/tokenizer_benchmark.py [repeat]
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from xpath_tokenizer import XPATHTokenizer
+
+
+class GreedyXPATHTokenizer(XPATHTokenizer):
+    """
+    This class implements the original (greedy) candidate-scan tokenizer, as a reference.
+    """
+
+    def tokenize_expression(self, xpath_expression):
+
+        # check brackets
+        self._check_brackets(xpath_expression)
+
+        # greedy tokenization strategy
+        tokens = []
+
+        while xpath_expression != '':
+            token_candidates = [
+                ',' if xpath_expression.startswith(',') else '',
+                max([x for x in (self.right_brackets + self.left_brackets) if xpath_expression.startswith(x)] + [''], key=len),
+                max([x for x in self.operators if xpath_expression.startswith(x)] + [''], key=len),
+                max([x for x in self.html_tags if xpath_expression.startswith(x)] + [''], key=len),
+                re.compile('^@[a-zA-Z0-9-]+').match(xpath_expression).group(0) if re.compile('^@[a-zA-Z0-9-]+').match(xpath_expression) else '',
+                re.compile('^\'[^\']+\'').match(xpath_expression).group(0) if re.compile('^\'[^\']+\'').match(xpath_expression) else '',
+                re.compile('^[0-9]+').match(xpath_expression).group(0) if re.compile('^[0-9]+').match(xpath_expression) else '',
+                ' ' if re.compile('^ +').match(xpath_expression) else '',
+            ]
+            token = max(token_candidates, key=len)
+            if token == '':
+                raise SyntaxError('Unable to process XPATH expression. Invalid/unknown token for sub-string {}'.format(xpath_expression))
+            tokens.append(token)
+            xpath_expression = xpath_expression[len(token):]
+
+        # output
+        return tokens
+
+
+EXPRESSIONS = [
+    "//img/@src",
+    "//div//span/text()",
+    "//img[@src > 'https://images.unsplash' and @src < 'https://j']/@src",
+    "//a[contains(@href, 'example') or starts-with(@title, 'x')]/@href",
+    "//table//tr//td[@colspan >= 2 and @rowspan != 3]/text()",
+    # a long expression, to show the difference in scaling
+    "//div" + "[@class = 'item' and contains(@id, 'x')]//span" * 40 + "/text()",
+]
+
+
+def benchmark(tokenizer, repeat):
+    """
+    This function measures the throughput of a tokenizer over EXPRESSIONS
+    :param tokenizer:   the tokenizer to be measured
+    :param repeat:      the number of times each expression is tokenized
+    :return:            the number of tokens per second
+    """
+    number_of_tokens = sum(len(tokenizer.tokenize_expression(e)) for e in EXPRESSIONS) * repeat
+    seconds = timeit.timeit(lambda: [tokenizer.tokenize_expression(e) for e in EXPRESSIONS], number=repeat)
+    return number_of_tokens / seconds
+
+
+if __name__ == '__main__':
+
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    # both tokenizers must produce the same token stream
+    for e in EXPRESSIONS:
+        assert GreedyXPATHTokenizer().tokenize_expression(e) == XPATHTokenizer().tokenize_expression(e), e
+
+    before = benchmark(GreedyXPATHTokenizer(), repeat)
+    after = benchmark(XPATHTokenizer(), repeat)
+    print('greedy tokenizer      : {:>12.0f} tokens/s'.format(before))
+    print('single-pass tokenizer : {:>12.0f} tokens/s'.format(after))
+    print('speedup               : {:>12.1f}x'.format(after / before))
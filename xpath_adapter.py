@@ -0,0 +1,381 @@
+import operator
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+import bs4 as bs
+
+
+class TreeAdapter:
+    """
+    This class defines how the evaluator navigates a document tree.
+    Every Select* step and every predicate accesses nodes through an adapter, so that the same XPATH expressions
+    can be evaluated on different tree representations.
+    """
+
+    def document(self, doc):
+        """
+        This method returns the node from which evaluation starts
+        :param doc: the document, as passed by the caller
+        :return:    the document node
+        """
+        return doc
+
+    def identity(self, node):
+        """
+        This method returns a key that identifies a node (two nodes are the same node if their keys are equal)
+        :param node:    the node
+        :return:        a hashable key
+        """
+        return id(node)
+
+    def children(self, node):
+        """
+        This method returns the child elements of a node
+        :param node:    the node
+        :return:        a list of elements, in document order
+        """
+        raise NotImplementedError()
+
+    def descendants(self, node):
+        """
+        This method returns the descendant elements of a node
+        :param node:    the node
+        :return:        a list of elements, in document order
+        """
+        return list(self.iter_descendants(node))
+
+    def iter_descendants(self, node):
+        """
+        This method returns the descendant elements of a node, lazily
+        :param node:    the node
+        :return:        a generator of elements, in document order
+        """
+        for c in self.children(node):
+            yield c
+            yield from self.iter_descendants(c)
+
+    def find_descendants(self, node, tag_name=None, attribute_names=()):
+        """
+        This method returns the descendant elements of a node that have a given tag name and given attributes
+        :param node:            the node
+        :param tag_name:        the tag name, or None for any tag name
+        :param attribute_names: the names of the attributes the elements must have
+        :return:                a list of elements, in document order
+        """
+        tag = self.tag
+        attrs = self.attributes
+        out = self.descendants(node) if tag_name is None else [x for x in self.iter_descendants(node) if tag(x) == tag_name]
+        for a in attribute_names:
+            out = [x for x in out if a in attrs(x)]
+        return list(out)
+
+    def group_descendants(self, node, tag_names):
+        """
+        This method selects the descendant elements of a node that have any of several tag names, in one walk
+        :param node:        the node
+        :param tag_names:   a set of tag names, None selects the descendants with any tag name
+        :return:            a dictionary mapping each of the tag names to a list of elements, in document order
+        """
+        groups = {t: [] for t in tag_names}
+        everything = groups.get(None)
+        tag = self.tag
+        for x in self.iter_descendants(node):
+            g = groups.get(tag(x))
+            if g is not None:
+                g.append(x)
+            if everything is not None:
+                everything.append(x)
+        return groups
+
+    def parent(self, node):
+        """
+        This method returns the parent of a node
+        :param node:    the node
+        :return:        the parent node, or None for the document node
+        """
+        raise NotImplementedError()
+
+    def following_siblings(self, node):
+        """
+        This method returns the sibling elements that follow a node
+        :param node:    the node
+        :return:        a list of elements, in document order
+        """
+        p = self.parent(node)
+        if p is None:
+            return []
+        siblings = self.children(p)
+        k = self.identity(node)
+        for i, x in enumerate(siblings):
+            if self.identity(x) == k:
+                return siblings[i + 1:]
+        return []
+
+    def preceding_siblings(self, node):
+        """
+        This method returns the sibling elements that precede a node
+        :param node:    the node
+        :return:        a list of elements, in document order
+        """
+        p = self.parent(node)
+        if p is None:
+            return []
+        siblings = self.children(p)
+        k = self.identity(node)
+        for i, x in enumerate(siblings):
+            if self.identity(x) == k:
+                return siblings[:i]
+        return []
+
+    def sort(self, nodes):
+        """
+        This method puts nodes in document order, by comparing the paths (of child indices) from the document node
+        :param nodes:   the nodes
+        :return:        a list of nodes, in document order, without duplicates
+        """
+        keys = {}
+        positions = {}
+
+        def key(x):
+            k = self.identity(x)
+            if k not in keys:
+                p = self.parent(x)
+                if p is None:
+                    keys[k] = ()
+                else:
+                    pk = self.identity(p)
+                    if pk not in positions:
+                        positions[pk] = {self.identity(c): i for i, c in enumerate(self.children(p))}
+                    keys[k] = key(p) + (positions[pk][k],)
+            return keys[k]
+
+        unique = {}
+        for x in nodes:
+            unique.setdefault(self.identity(x), x)
+        return sorted(unique.values(), key=key)
+
+    def tag(self, node):
+        """
+        This method returns the tag name of a node
+        :param node:    the node
+        :return:        a string
+        """
+        raise NotImplementedError()
+
+    def attributes(self, node):
+        """
+        This method returns the attributes of a node
+        :param node:    the node
+        :return:        a dictionary mapping attribute names to values
+        """
+        raise NotImplementedError()
+
+    def text(self, node):
+        """
+        This method returns the text of a node, i.e. the concatenation of all text it contains
+        :param node:    the node
+        :return:        a string
+        """
+        raise NotImplementedError()
+
+    def text_contains(self, node, s):
+        """
+        This method checks whether the text of a node contains a string
+        :param node:    the node
+        :param s:       the string
+        :return:        True if the text of the node contains the string, False otherwise
+        """
+        return s in self.text(node)
+
+    def text_startswith(self, node, s):
+        """
+        This method checks whether the text of a node starts with a string
+        :param node:    the node
+        :param s:       the string
+        :return:        True if the text of the node starts with the string, False otherwise
+        """
+        return self.text(node).startswith(s)
+
+    def text_endswith(self, node, s):
+        """
+        This method checks whether the text of a node ends with a string
+        :param node:    the node
+        :param s:       the string
+        :return:        True if the text of the node ends with the string, False otherwise
+        """
+        return self.text(node).endswith(s)
+
+    def column(self, name):
+        """
+        This method returns the values of an attribute for all nodes of the document, if this adapter holds them
+        :param name:    the attribute name
+        :return:        an AttributeColumn, or None if attribute columns are not available
+        """
+        return None
+
+    def test(self, predicate):
+        """
+        This method returns the per-node test of a predicate, for the nodes accessed through this adapter.
+        Adapters that wrap another adapter may reuse the tests compiled for the wrapped adapter.
+        :param predicate:   the Predicate
+        :return:            a function that takes a node and returns True if the node is selected by the predicate
+        """
+        return predicate.compiled_test(self)
+
+    @staticmethod
+    def for_document(doc):
+        """
+        This function returns the adapter for a document
+        :param doc: a BeautifulSoup document, an ElementTree (Element), or a document that holds its own adapter
+        :return:    a TreeAdapter
+        """
+
+        # checked first, since BeautifulSoup looks up unknown attributes as tags (a search of the entire document)
+        if isinstance(doc, bs.Tag):
+            return BEAUTIFUL_SOUP
+        if isinstance(doc, (ET.ElementTree, ET.Element)):
+            return ElementTreeAdapter.for_tree(doc)
+        if isinstance(getattr(doc, 'adapter', None), TreeAdapter):
+            return doc.adapter
+        return BEAUTIFUL_SOUP
+
+
+class BeautifulSoupAdapter(TreeAdapter):
+    """
+    This class implements the TreeAdapter for BeautifulSoup documents.
+    """
+
+    # called once per node by the predicates, so these are C-level accessors
+    tag = operator.attrgetter('name')
+    attributes = operator.attrgetter('attrs')
+    text = operator.attrgetter('text')
+
+    def children(self, node):
+        return [c for c in node.contents if c.name is not None]
+
+    def descendants(self, node):
+        return node.find_all()
+
+    def iter_descendants(self, node):
+        return (c for c in node.descendants if c.name is not None)
+
+    def find_descendants(self, node, tag_name=None, attribute_names=()):
+
+        # the tag name is searched for by find_all, attributes are checked here
+        # (matching attributes in find_all is slower than testing them on the elements it found)
+        out = node.find_all() if tag_name is None else node.find_all(tag_name)
+        for a in attribute_names:
+            out = [x for x in out if a in x.attrs]
+        return out
+
+    def group_descendants(self, node, tag_names):
+        if None in tag_names:
+            return super().group_descendants(node, tag_names)
+
+        # find_all walks the tree once for a list of tag names
+        groups = {t: [] for t in tag_names}
+        for x in node.find_all(list(tag_names)):
+            groups[x.name].append(x)
+        return groups
+
+    def parent(self, node):
+        return node.parent
+
+    def following_siblings(self, node):
+        return [x for x in node.next_siblings if x.name is not None]
+
+    def preceding_siblings(self, node):
+        out = [x for x in node.previous_siblings if x.name is not None]
+        out.reverse()
+        return out
+
+
+class ElementTreeAdapter(TreeAdapter):
+    """
+    This class implements the TreeAdapter for xml.etree.ElementTree documents.
+    The ElementTree object acts as the document node, its root element is the only child of the document node.
+    Since elements do not know their parent, a parent map is built the first time a parent is needed
+    during an evaluation.
+    """
+
+    # the adapters of the most recently queried trees, keyed on the id of their root element, so that querying
+    # the same tree again reuses the predicates compiled for its adapter (these trees are kept alive by the cache)
+    RECENT = 8
+    _recent = OrderedDict()
+    _recent_lock = threading.Lock()
+
+    def __init__(self, doc):
+        self.tree = doc if isinstance(doc, ET.ElementTree) else ET.ElementTree(doc)
+        self._parents = None
+
+    @staticmethod
+    def for_tree(doc):
+        """
+        This function returns the adapter for an ElementTree (or an Element), reusing the adapter of a tree
+        that was queried recently. The adapter holds the tree, so that its root element can not be replaced by
+        another one with the same id while it is cached.
+        :param doc: an ElementTree, or the root Element of a tree
+        :return:    an ElementTreeAdapter
+        """
+        root = doc.getroot() if isinstance(doc, ET.ElementTree) else doc
+        with ElementTreeAdapter._recent_lock:
+            adapter = ElementTreeAdapter._recent.get(id(root))
+            if adapter is not None and adapter.tree.getroot() is root:
+                ElementTreeAdapter._recent.move_to_end(id(root))
+                return adapter
+            adapter = ElementTreeAdapter(doc)
+            ElementTreeAdapter._recent[id(root)] = adapter
+            while len(ElementTreeAdapter._recent) > ElementTreeAdapter.RECENT:
+                ElementTreeAdapter._recent.popitem(last=False)
+        return adapter
+
+    def document(self, doc):
+
+        # evaluation starts here, the tree may have been edited since the parent map was built
+        self._parents = None
+        return self.tree
+
+    def children(self, node):
+        if node is self.tree:
+            return [self.tree.getroot()]
+        return [c for c in node if isinstance(c.tag, str)]
+
+    def descendants(self, node):
+        if node is self.tree:
+            return [e for e in self.tree.iter() if isinstance(e.tag, str)]
+        return [e for e in node.iter() if e is not node and isinstance(e.tag, str)]
+
+    def iter_descendants(self, node):
+        if node is self.tree:
+            return (e for e in self.tree.iter() if isinstance(e.tag, str))
+        return (e for e in node.iter() if e is not node and isinstance(e.tag, str))
+
+    def find_descendants(self, node, tag_name=None, attribute_names=()):
+        if tag_name is None:
+            return super().find_descendants(node, tag_name, attribute_names)
+        out = list(self.tree.iter(tag_name)) if node is self.tree else [e for e in node.iter(tag_name) if e is not node]
+        for a in attribute_names:
+            out = [e for e in out if a in e.attrib]
+        return out
+
+    def parent(self, node):
+        if node is self.tree:
+            return None
+        if self._parents is None:
+            self._parents = {id(c): p for p in self.tree.iter() for c in p}
+        return self._parents.get(id(node), self.tree)
+
+    def tag(self, node):
+        return None if node is self.tree else node.tag
+
+    def attributes(self, node):
+        return {} if node is self.tree else node.attrib
+
+    def text(self, node):
+        if node is self.tree:
+            node = self.tree.getroot()
+        return ''.join(node.itertext())
+
+
+BEAUTIFUL_SOUP = BeautifulSoupAdapter()
@@ -0,0 +1,102 @@
+import asyncio
+import functools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from xpath_parallel import _evaluate_chunk
+
+
+async def axpath(xpath_expression, bs_doc, executor=None, adapter=None):
+    """
+    This function applies an XPATH expression to a document in an executor, so that the event loop is not blocked
+    :param xpath_expression:    the XPATH expression to be applied
+    :param bs_doc:              the document to be queried (BeautifulSoup, ElementTree, DocumentSnapshot),
+                                or an IndexedDocument
+    :param executor:            a concurrent.futures.ThreadPoolExecutor, defaults to the executor of the event loop
+    :param adapter:             the TreeAdapter through which the document is accessed (optional)
+    :return:                    a list of nodes, or a list of strings if the expression ends in text() or an attribute
+    """
+    from xpath_bs import XPATH
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(XPATH.xpath, xpath_expression, bs_doc, adapter=adapter))
+
+
+def axpath_pipeline(xpath_expression, payloads, parser='html.parser', executor=None, workers=None, max_pending=None):
+    """
+    This function parses a stream of HTML payloads and applies an XPATH expression to each of them, in an executor.
+    Payloads are only taken from the stream while fewer than max_pending documents are being processed,
+    so that a fast producer (such as a crawler) is slowed down to the pace of the executor.
+    The expression and the arguments are checked when this function is called, before any payload is taken.
+    :param xpath_expression:    the XPATH expression to be applied
+    :param payloads:            an async iterable (or a regular iterable) of HTML strings (or bytes)
+    :param parser:              the name of the BeautifulSoup parser to be used
+    :param executor:            a concurrent.futures executor, defaults to a pool of worker processes
+                                that is shut down when the pipeline ends
+    :param workers:             the number of worker processes of the default executor (at least 1), defaults to
+                                the number of CPUs
+    :param max_pending:         the maximum number of documents being processed at once, defaults to twice the number
+                                of workers
+    :return:                    an async generator of XPATHDocumentResult objects, in the order of the payloads
+    """
+
+    # check the arguments before the defaults replace them
+    if workers is not None and workers < 1:
+        raise ValueError('workers must be a positive integer')
+    if max_pending is not None and max_pending < 1:
+        raise ValueError('max_pending must be a positive integer')
+
+    # check the expression when this function is called, rather than on the first iteration of the pipeline
+    from xpath_bs import XPATH
+    XPATH.compile(xpath_expression)
+    workers = workers or os.cpu_count() or 1
+    return _pipeline(xpath_expression, payloads, parser, executor, workers, max_pending or 2 * workers)
+
+
+async def _pipeline(xpath_expression, payloads, parser, executor, workers, max_pending):
+    """
+    This function runs the pipeline of axpath_pipeline, once its arguments have been checked
+    :param xpath_expression:    the XPATH expression to be applied
+    :param payloads:            an async iterable (or a regular iterable) of HTML strings (or bytes)
+    :param parser:              the name of the BeautifulSoup parser to be used
+    :param executor:            a concurrent.futures executor, or None for a pool of worker processes
+    :param workers:             the number of worker processes of the default executor
+    :param max_pending:         the maximum number of documents being processed at once
+    :return:                    an async generator of XPATHDocumentResult objects, in the order of the payloads
+    """
+    shutdown = executor is None
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    try:
+        i = 0
+        async for html in _aiter(payloads):
+            pending.append(loop.run_in_executor(executor, _evaluate_chunk, xpath_expression, parser, [(i, html)]))
+            i += 1
+
+            # backpressure, wait for the oldest document before taking more payloads
+            while len(pending) >= max_pending or (len(pending) > 0 and pending[0].done()):
+                yield (await pending.popleft())[0]
+        while len(pending) > 0:
+            yield (await pending.popleft())[0]
+    finally:
+        for f in pending:
+            f.cancel()
+        if shutdown:
+            executor.shutdown(wait=False)
+
+
+async def _aiter(payloads):
+    """
+    This function iterates over a regular or an async iterable
+    :param payloads:    an iterable or an async iterable
+    :return:            an async generator
+    """
+    if hasattr(payloads, '__aiter__'):
+        async for x in payloads:
+            yield x
+    else:
+        for x in payloads:
+            yield x
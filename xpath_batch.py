@@ -0,0 +1,108 @@
+from xpath_adapter import TreeAdapter
+from xpath_compiled import CompiledXPATH
+from xpath_index import IndexedDocument
+from xpath_syntax_tree import SelectDescendants
+
+
+class XPATHBatch:
+    """
+    This class evaluates a set of named XPATH expressions against a document in one go.
+    The expressions are merged into a prefix tree of syntax tree nodes, so that steps shared by several
+    expressions are evaluated only once, and the leading '//tag' steps of different expressions select their
+    elements from a single walk over the document.
+    """
+
+    def __init__(self, compiled_expressions):
+        """
+        This function builds the prefix tree
+        :param compiled_expressions:    a dictionary mapping names to CompiledXPATH objects
+        """
+        self.expressions = dict(compiled_expressions)
+        self._root = XPATHBatch._TrieNode()
+        for name, compiled in self.expressions.items():
+            t = self._root
+            for n in compiled.steps:
+                t = t.child(n)
+            t.names.append(name)
+
+    class _TrieNode:
+
+        def __init__(self, step=None):
+            self.step = step
+            self.names = []
+            self.children = {}
+
+        def child(self, step):
+            key = step.signature()
+            if key not in self.children:
+                self.children[key] = XPATHBatch._TrieNode(step)
+            return self.children[key]
+
+        def shared_steps(self):
+            """
+            This function returns the steps shared by every expression below this node, starting with its own step
+            :return:    a list of syntax tree nodes
+            """
+            steps = [self.step]
+            t = self
+            while len(t.names) == 0 and len(t.children) == 1:
+                t = next(iter(t.children.values()))
+                steps.append(t.step)
+            return steps
+
+    def evaluate(self, bs_doc, adapter=None):
+        """
+        This function evaluates all expressions of this batch against a document.
+        The leading '//tag' steps of all expressions (fused by the planner) are answered by one shared walk over the
+        document, or from the indexes of an IndexedDocument.
+        Positional predicates are evaluated eagerly here, as part of the shared evaluation, rather than lazily as
+        CompiledXPATH.evaluate does.
+        :param bs_doc:  the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param adapter: the TreeAdapter through which the document is accessed, derived from the document by default
+        :return:        a dictionary mapping the name of each expression to its result
+        """
+        out = {}
+        if isinstance(bs_doc, IndexedDocument):
+            adapter = adapter or bs_doc.adapter
+            root = adapter.document(bs_doc.document)
+
+            # a leading '//' step is answered from the index, narrowed down by the steps that follow it
+            # in every expression below it
+            for t in self._root.children.values():
+                nodes = bs_doc.select(t.shared_steps())
+                if nodes is not None:
+                    self._evaluate(t, (nodes, []), out, adapter)
+                else:
+                    self._evaluate(t, t.step.evaluate([root], [], adapter), out, adapter)
+        else:
+            adapter = adapter or TreeAdapter.for_document(bs_doc)
+            root = adapter.document(bs_doc)
+            for name in self._root.names:
+                out[name] = CompiledXPATH._to_result(([root], []))
+
+            # the leading '//tag[@attr]' steps select their elements from one walk over the document
+            walked = [t for t in self._root.children.values() if t.step.__class__ == SelectDescendants]
+            if len(walked) < 2:
+                walked = []
+            groups = adapter.group_descendants(root, set(t.step.tag_name for t in walked))
+            for t in self._root.children.values():
+                if t in walked:
+                    match = t.step.matches(adapter)
+                    self._evaluate(t, ([x for x in groups[t.step.tag_name] if match(x)], []), out, adapter)
+                else:
+                    self._evaluate(t, t.step.evaluate([root], [], adapter), out, adapter)
+        return out
+
+    def _evaluate(self, trie_node, inp, out, adapter):
+        """
+        This function evaluates the prefix tree below a node, depth-first
+        :param trie_node:   the prefix tree node, whose step has already been evaluated
+        :param inp:         the output of that step
+        :param out:         the dictionary in which results are stored
+        :param adapter:     the TreeAdapter through which the nodes are accessed
+        :return:            None
+        """
+        for name in trie_node.names:
+            out[name] = CompiledXPATH._to_result(inp)
+        for t in trie_node.children.values():
+            self._evaluate(t, t.step.evaluate(inp[0], inp[1], adapter), out, adapter)
@@ -1,29 +1,279 @@
-from xpath_syntax_tree import XPATHSyntaxTree
+from xpath_async import axpath, axpath_pipeline
+from xpath_batch import XPATHBatch
+from xpath_cache import XPATHResultCache
+from xpath_catalogue import XPATHCatalogue
+from xpath_compiled import XPATHCompileCache
+from xpath_live import LiveXPATH
+from xpath_parallel import xpath_parallel
 
 
 class XPATH:
 
+    # compiled expressions, shared by all calls to XPATH.xpath and XPATH.compile
+    _compile_cache = XPATHCompileCache()
+
+    # query results, only cached once enabled with XPATH.enable_result_cache
+    _result_cache = None
+
+    # the resource limits of every evaluation that does not pass its own, set with XPATH.set_limits
+    _limits = None
+
+    @staticmethod
+    def compile(xpath_expression):
+        """
+        This function compiles an XPATH expression into a reusable, immutable query object
+        :param xpath_expression:    the XPATH expression to be compiled
+        :return:                    a CompiledXPATH object
+        """
+        return XPATH._compile_cache.get(xpath_expression)
+
+    @staticmethod
+    def xpath(xpath_expression, bs_doc, hook=None, adapter=None, limits=None):
+        compiled = XPATH.compile(xpath_expression)
+        limits = limits or XPATH._limits
+        result_cache = XPATH._result_cache
+        if hook is None and limits is None and result_cache is not None:
+            return result_cache.evaluate(compiled, bs_doc, adapter=adapter)
+        return compiled.evaluate(bs_doc, hook=hook, adapter=adapter, limits=limits)
+
+    @staticmethod
+    def explain(xpath_expression, bs_doc, hook=None, adapter=None, limits=None):
+        """
+        This function applies an XPATH expression to a document, and records how long each step took
+        :param xpath_expression:    the XPATH expression to be applied
+        :param bs_doc:              the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param hook:                a function that is called with an XPATHStepRecord after each step (optional)
+        :param adapter:             the TreeAdapter through which the document is accessed (optional)
+        :param limits:              the XPATHLimits of the evaluation (optional)
+        :return:                    a tuple (result, XPATHTrace)
+        """
+        return XPATH.compile(xpath_expression).explain(bs_doc, hook=hook, adapter=adapter, limits=limits)
+
+    @staticmethod
+    def plan(xpath_expression):
+        """
+        This function returns the plan of an XPATH expression, i.e. the steps that are evaluated after rewriting
+        :param xpath_expression:    the XPATH expression
+        :return:                    an XPATHPlan (see XPATHPlan.explain for a human-readable rendering)
+        """
+        return XPATH.compile(xpath_expression).plan
+
+    @staticmethod
+    def iterxpath(xpath_expression, bs_doc, adapter=None, limits=None):
+        """
+        This function applies an XPATH expression lazily, yielding results as soon as they are found
+        :param xpath_expression:    the XPATH expression to be applied
+        :param bs_doc:              the document to be queried (BeautifulSoup, ElementTree)
+        :param adapter:             the TreeAdapter through which the document is accessed (optional)
+        :param limits:              the XPATHLimits of the evaluation (optional)
+        :return:                    an XPATHResultIterator, which also supports first() and limit(n)
+        """
+        return XPATH.compile(xpath_expression).iterate(bs_doc, adapter=adapter, limits=limits or XPATH._limits)
+
+    @staticmethod
+    def count(xpath_expression, bs_doc, adapter=None, limits=None):
+        """
+        This function counts the results of an XPATH expression, without building the list of results
+        :param xpath_expression:    the XPATH expression to be applied
+        :param bs_doc:              the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param adapter:             the TreeAdapter through which the document is accessed (optional)
+        :param limits:              the XPATHLimits of the evaluation (optional)
+        :return:                    the number of results
+        """
+        return XPATH.compile(xpath_expression).count(bs_doc, adapter=adapter, limits=limits or XPATH._limits)
+
+    @staticmethod
+    def set_limits(limits):
+        """
+        This function sets the resource limits of every evaluation (by xpath, iterxpath and count)
+        that does not pass its own limits
+        :param limits:  an XPATHLimits object, or None to remove the limits
+        :return:        None
+        """
+        XPATH._limits = limits
+
+    @staticmethod
+    def live(xpath_expression, document):
+        """
+        This function applies an XPATH expression to a document that is edited in place, and keeps its result up to date
+        :param xpath_expression:    the XPATH expression to be applied
+        :param document:            a MutableDocument, through which the document is edited
+        :return:                    a LiveXPATH object, whose result property holds the current result
+        """
+        return LiveXPATH(XPATH.compile(xpath_expression), document)
+
+    @staticmethod
+    def compile_many(xpath_expressions):
+        """
+        This function compiles a set of named XPATH expressions into a batch that shares common prefixes
+        :param xpath_expressions:   a dictionary mapping names to XPATH expressions
+        :return:                    an XPATHBatch object
+        """
+        return XPATHBatch({k: XPATH.compile(v) for k, v in xpath_expressions.items()})
+
     @staticmethod
-    def xpath(xpath_expression, bs_doc):
+    def xpath_many(xpath_expressions, bs_doc, adapter=None):
+        """
+        This function applies a set of named XPATH expressions to a document,
+        evaluating the steps they have in common only once
+        :param xpath_expressions:   a dictionary mapping names to XPATH expressions
+        :param bs_doc:              the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param adapter:             the TreeAdapter through which the document is accessed (optional)
+        :return:                    a dictionary mapping each name to the result of its expression
+        """
+        return XPATH.compile_many(xpath_expressions).evaluate(bs_doc, adapter=adapter)
 
-        # convert to nodes
-        nodes = XPATHSyntaxTree().xpath_to_syntax_tree(xpath_expression)
+    @staticmethod
+    def xpath_parallel(xpath_expression, documents, workers=None, chunk_size=16, parser='html.parser'):
+        """
+        This function parses HTML documents and applies an XPATH expression to them in a pool of worker processes
+        :param xpath_expression:    the XPATH expression to be applied
+        :param documents:           an iterable of HTML strings (or bytes)
+        :param workers:             the number of worker processes (at least 1), defaults to the number of CPUs,
+                                    and never more than the number of chunks
+        :param chunk_size:          the number of documents sent to a worker at once
+        :param parser:              the name of the BeautifulSoup parser to be used
+        :return:                    a list of XPATHDocumentResult objects, in the order of the input documents
+        """
+        return xpath_parallel(xpath_expression, documents, workers=workers, chunk_size=chunk_size, parser=parser)
+
+    @staticmethod
+    def axpath(xpath_expression, bs_doc, executor=None, adapter=None):
+        """
+        This function applies an XPATH expression to a document in an executor, it must be awaited
+        :param xpath_expression:    the XPATH expression to be applied
+        :param bs_doc:              the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param executor:            a concurrent.futures.ThreadPoolExecutor, defaults to the executor of the event loop
+        :param adapter:             the TreeAdapter through which the document is accessed (optional)
+        :return:                    a coroutine, that returns a list of nodes or strings
+        """
+        return axpath(xpath_expression, bs_doc, executor=executor, adapter=adapter)
 
-        # iteratively go through each node in the XPATH chain
-        inp = ([bs_doc], [])
-        for n in nodes:
-            inp = n.evaluate(inp[0], inp[1])
+    @staticmethod
+    def axpath_pipeline(xpath_expression, payloads, parser='html.parser', executor=None, workers=None, max_pending=None):
+        """
+        This function parses a stream of HTML payloads and applies an XPATH expression to each of them in an executor,
+        taking new payloads only while fewer than max_pending documents are being processed
+        :param xpath_expression:    the XPATH expression to be applied
+        :param payloads:            an async iterable (or a regular iterable) of HTML strings (or bytes)
+        :param parser:              the name of the BeautifulSoup parser to be used
+        :param executor:            a concurrent.futures executor, defaults to a pool of worker processes
+        :param workers:             the number of worker processes of the default executor (at least 1),
+                                    defaults to the number of CPUs
+        :param max_pending:         the maximum number of documents being processed at once
+        :return:                    an async generator of XPATHDocumentResult objects, in the order of the payloads
+        """
+        return axpath_pipeline(xpath_expression, payloads, parser=parser, executor=executor, workers=workers, max_pending=max_pending)
 
-        # empty list
-        if len(inp) == 0:
-            return []
+    @staticmethod
+    def stream(xpath_expression, source, parser='html', encoding='utf-8', chunk_size=65536):
+        """
+        This function applies an XPATH expression while parsing a document, without building a BeautifulSoup tree.
+        Only chains of '//tag[predicate]' steps, optionally followed by '/@attr' or '/text()', can be streamed.
+        Other expressions raise a ValueError when this function is called, before any input is read.
+        With the HTML parser, multi-valued attributes (such as class or rel) are lists of values, as in a BeautifulSoup
+        tree, so results match XPATH.xpath. With the XML parser, every attribute value is a string.
+        :param xpath_expression:    the XPATH expression to be applied
+        :param source:              a str, bytes, a memory-mapped file, or a file object (text or binary)
+        :param parser:              'html' (html.parser) or 'xml' (xml.sax)
+        :param encoding:            the encoding of byte input (HTML only)
+        :param chunk_size:          the number of characters (or bytes) parsed at once
+        :return:                    a generator of results, in document order
+        """
+        return XPATH.compile(xpath_expression).stream(source, parser=parser, encoding=encoding, chunk_size=chunk_size)
 
-        # if the first element is a list, we terminated at a non-leaf node
-        # throw away the negative nodes and return only the first part of the
-        # tuple
-        if inp[0].__class__.__name__ == 'list':
-            return inp[0]
+    @staticmethod
+    def save_catalogue(xpath_expressions, target):
+        """
+        This function compiles XPATH expressions, and writes them to a catalogue that can be loaded without parsing them
+        :param xpath_expressions:   an iterable of XPATH expressions
+        :param target:              a path, or a file object (binary or text)
+        :return:                    the XPATHCatalogue
+        """
+        catalogue = XPATHCatalogue(XPATH.compile(x) for x in xpath_expressions)
+        catalogue.dump(target)
+        return catalogue
 
-        # else return the entire list
-        else:
-            return inp
\ No newline at end of file
+    @staticmethod
+    def load_catalogue(source):
+        """
+        This function loads a catalogue of compiled expressions into the compile cache,
+        which is enlarged if needed to hold the entire catalogue (also when caching was disabled with a size of 0).
+        The catalogue is trusted: every expression it holds is evaluated with its stored plan from then on, which is
+        not checked against the expression, so only catalogues written by save_catalogue from a trusted source
+        should be loaded.
+        :param source:  a path, a file object (binary or text), or a memory-mapped file
+        :return:        the XPATHCatalogue
+        """
+        catalogue = XPATHCatalogue.load(source)
+        cache = XPATH._compile_cache
+        if cache.maxsize < len(catalogue):
+            cache.resize(len(catalogue))
+        for c in catalogue:
+            cache.add(c)
+        return catalogue
+
+    @staticmethod
+    def set_cache_size(maxsize):
+        """
+        This function sets the maximum number of compiled expressions kept in memory
+        :param maxsize: the maximum number of compiled expressions, 0 disables caching
+        :return:        None
+        """
+        XPATH._compile_cache.resize(maxsize)
+
+    @staticmethod
+    def cache_info():
+        """
+        This function returns the statistics of the compile cache
+        :return:    a dictionary with keys 'hits', 'misses', 'size' and 'maxsize'
+        """
+        return XPATH._compile_cache.info()
+
+    @staticmethod
+    def clear_cache():
+        """
+        This function removes all compiled expressions from the compile cache
+        :return:    None
+        """
+        XPATH._compile_cache.clear()
+
+    @staticmethod
+    def enable_result_cache(max_bytes=64 * 1024 * 1024):
+        """
+        This function enables caching of query results (and of the node sets after each step) in XPATH.xpath.
+        Documents that are modified after they have been queried must be passed to XPATH.invalidate.
+        :param max_bytes:   the (estimated) maximum number of bytes held by the cached results
+        :return:            the XPATHResultCache
+        """
+        XPATH._result_cache = XPATHResultCache(max_bytes)
+        return XPATH._result_cache
+
+    @staticmethod
+    def disable_result_cache():
+        """
+        This function disables caching of query results, and drops all cached results
+        :return:    None
+        """
+        if XPATH._result_cache is not None:
+            XPATH._result_cache.clear()
+        XPATH._result_cache = None
+
+    @staticmethod
+    def invalidate(bs_doc):
+        """
+        This function removes all cached query results for a document, it must be called after the document is modified
+        :param bs_doc:  the document
+        :return:        None
+        """
+        if XPATH._result_cache is not None:
+            XPATH._result_cache.invalidate(bs_doc)
+
+    @staticmethod
+    def result_cache_info():
+        """
+        This function returns the statistics of the result cache
+        :return:    a dictionary with keys 'hits', 'prefix_hits', 'misses', 'size', 'documents', 'bytes' and 'max_bytes',
+                    or None if the result cache is not enabled
+        """
+        return XPATH._result_cache.info() if XPATH._result_cache is not None else None
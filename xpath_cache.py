@@ -0,0 +1,204 @@
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+from xpath_compiled import CompiledXPATH
+
+
+class XPATHResultCache:
+    """
+    This class implements an opt-in, memory-bounded, least-recently-used cache of query results,
+    keyed on (document, step prefix). Not only the result of each expression is kept, but also the node set
+    after each of its steps, so that expressions sharing a prefix (such as '//div[@class='item']') continue from
+    the longest prefix that has already been evaluated on the document.
+    Documents are not inspected for changes, a document that is mutated must be invalidated explicitly.
+    The entries of a document are dropped when it is garbage collected. Note that cached BeautifulSoup nodes refer
+    to their document, so a BeautifulSoup document stays alive until its entries are evicted or invalidated.
+    """
+
+    # the estimated size of a cache entry, besides the result itself
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        :param max_bytes:   the (estimated) maximum number of bytes held by the cached results
+        """
+        if max_bytes < 0:
+            raise ValueError('max_bytes must be a non-negative integer')
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._documents = {}
+        self._prefixes = {}
+        self._collected = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def evaluate(self, compiled, bs_doc, adapter=None):
+        """
+        This function evaluates a compiled XPATH expression against a document, reusing cached results
+        :param compiled:    a CompiledXPATH object
+        :param bs_doc:      the document to be queried (BeautifulSoup, ElementTree, DocumentSnapshot),
+                            or an IndexedDocument
+        :param adapter:     the TreeAdapter through which the document is accessed (optional)
+        :return:            a list of nodes, or a list of strings if the expression ends in text() or an attribute
+        """
+        steps = compiled.steps
+        prefixes = self._prefix_keys(compiled)
+        (nodes, remaining, adapter) = compiled._start(bs_doc, adapter)
+        offset = len(steps) - len(remaining)
+        document = id(bs_doc)
+
+        # find the longest prefix that has already been evaluated
+        inp = (nodes, [])
+        entry = None
+        with self._lock:
+            self._purge()
+            for k in range(len(steps), offset, -1):
+                entry = self._entries.get((document, prefixes[k - 1]))
+                if entry is not None:
+                    self._entries.move_to_end((document, prefixes[k - 1]))
+                    inp = entry[0]
+                    break
+            if entry is not None and k == len(steps):
+                self.hits += 1
+                return list(CompiledXPATH._to_result(inp))
+            if entry is not None:
+                self.prefix_hits += 1
+                offset = k
+            self.misses += 1
+
+        # evaluate the remaining steps, storing the output of each step
+        for i in range(offset, len(steps)):
+            out = steps[i].evaluate(inp[0], [], adapter)
+            if not isinstance(out, tuple):
+                out = (out, [])
+            if out[0] is not inp[0] or i + 1 == len(steps):
+                self._put(bs_doc, document, prefixes[i], (out[0], []))
+            inp = out
+        return list(CompiledXPATH._to_result(inp))
+
+    def invalidate(self, bs_doc):
+        """
+        This function removes all cached results for a document, e.g. after it has been modified
+        :param bs_doc:  the document
+        :return:        the number of cache entries that were removed
+        """
+        with self._lock:
+            self._purge()
+            return self._forget(id(bs_doc))
+
+    def clear(self):
+        """
+        This function removes all cached results, and resets the statistics
+        :return:    self
+        """
+        with self._lock:
+            for (_, finalizer, _) in self._documents.values():
+                if finalizer is not None:
+                    finalizer.detach()
+            self._entries.clear()
+            self._documents.clear()
+            self._prefixes.clear()
+            del self._collected[:]
+            self.bytes = 0
+            self.hits = 0
+            self.prefix_hits = 0
+            self.misses = 0
+        return self
+
+    def info(self):
+        """
+        This function returns the statistics of this cache
+        :return:    a dictionary with keys 'hits', 'prefix_hits', 'misses', 'size', 'documents', 'bytes' and 'max_bytes'
+        """
+        with self._lock:
+            return {'hits': self.hits, 'prefix_hits': self.prefix_hits, 'misses': self.misses,
+                    'size': len(self._entries), 'documents': len(self._documents),
+                    'bytes': self.bytes, 'max_bytes': self.max_bytes}
+
+    def _prefix_keys(self, compiled):
+        """
+        This function returns the keys of the step prefixes of a compiled XPATH expression
+        :param compiled:    a CompiledXPATH object
+        :return:            a list of keys, the i-th key identifies the output of the first i+1 steps
+        """
+        keys = self._prefixes.get(compiled.expression)
+        if keys is None:
+            keys = []
+            for n in compiled.steps:
+                keys.append(n.signature() if len(keys) == 0 else (keys[-1], n.signature()))
+            if len(self._prefixes) >= 1024:
+                self._prefixes.clear()
+            self._prefixes[compiled.expression] = keys
+        return keys
+
+    def _put(self, bs_doc, document, prefix, value):
+        """
+        This function stores the output of a step prefix, evicting the least recently used entries if needed
+        :param bs_doc:      the document
+        :param document:    the identity of the document
+        :param prefix:      the key of the step prefix
+        :param value:       the output of the step prefix, a tuple (selected, rejected)
+        :return:            None
+        """
+        size = XPATHResultCache.ENTRY_OVERHEAD + sys.getsizeof(value[0]) + \
+            sum(sys.getsizeof(x) for x in value[0] if isinstance(x, str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._purge()
+            if document not in self._documents:
+
+                # a document that can not be weakly referenced is kept alive while it has entries,
+                # so that its id can not be reused by another document
+                try:
+                    finalizer = weakref.finalize(bs_doc, self._collected.append, document)
+                    self._documents[document] = (None, finalizer, set())
+                except TypeError:
+                    self._documents[document] = (bs_doc, None, set())
+            key = (document, prefix)
+            if key in self._entries:
+                return
+            self._entries[key] = (value, size)
+            self._documents[document][2].add(prefix)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                ((d, p), (_, s)) = self._entries.popitem(last=False)
+                self.bytes -= s
+                self._documents[d][2].discard(p)
+                if len(self._documents[d][2]) == 0:
+                    self._forget(d)
+
+    def _purge(self):
+        """
+        This function removes the entries of the documents that have been garbage collected,
+        the lock must be held by the caller. Finalizers only record the document (they may run at any time,
+        even while the lock is held), so that its entries are removed before its id can be looked up again.
+        :return:    None
+        """
+        while len(self._collected) > 0:
+            self._forget(self._collected.pop())
+
+    def _forget(self, document):
+        """
+        This function removes all entries of a document, the lock must be held by the caller
+        :param document:    the identity of the document
+        :return:            the number of entries that were removed
+        """
+        record = self._documents.pop(document, None)
+        if record is None:
+            return 0
+        (_, finalizer, prefixes) = record
+        if finalizer is not None:
+            finalizer.detach()
+        for p in prefixes:
+            (_, s) = self._entries.pop((document, p))
+            self.bytes -= s
+        return len(prefixes)
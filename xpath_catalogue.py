@@ -0,0 +1,264 @@
+import json
+import mmap
+from collections import OrderedDict
+
+import xpath_syntax_tree
+from xpath_compiled import CompiledXPATH
+from xpath_planner import XPATHPlan
+from xpath_syntax_tree import Expression, Position
+
+
+def _is_string(v):
+    return isinstance(v, str)
+
+
+def _is_int(v):
+    return isinstance(v, int) and not isinstance(v, bool)
+
+
+# the syntax tree nodes a catalogue may contain: the minimum and maximum number of children (None if unbounded),
+# and a check of each of their attributes. Nothing else is ever instantiated when a catalogue is loaded.
+_SCHEMA = {
+    'AttributeName': (0, 0, {'value': _is_string}),
+    'StringLiteral': (0, 0, {'value': _is_string}),
+    'NumberLiteral': (0, 0, {'value': _is_int}),
+    'TextValue': (0, 0, {}),
+    'FunctionPosition': (0, 0, {}),
+    'FunctionLast': (0, 0, {}),
+    'SelectFromRootNode': (0, 0, {}),
+    'SelectAll': (0, 0, {}),
+    'SelectDescendants': (0, 0, {'tag_name': lambda v: v is None or _is_string(v),
+                                 'attribute_names': lambda v: isinstance(v, tuple) and all(_is_string(x) for x in v)}),
+    'SelectChildren': (0, 0, {}),
+    'SelectParent': (0, 0, {}),
+    'SelectSelf': (0, 0, {}),
+    'SelectAncestors': (0, 0, {}),
+    'SelectFollowingSiblings': (0, 0, {}),
+    'SelectPrecedingSiblings': (0, 0, {}),
+    'SelectStar': (0, 0, {}),
+    'SelectHTMLTag': (0, 0, {'tag_name': _is_string}),
+    'SelectText': (0, 0, {}),
+    'SelectAttribute': (0, 0, {'attribute_name': _is_string}),
+    'LocationStep': (1, None, {}),
+    'GreaterThan': (2, 2, {}),
+    'GreaterThanOrEqual': (2, 2, {}),
+    'SmallerThan': (2, 2, {}),
+    'SmallerThanOrEqual': (2, 2, {}),
+    'Equal': (2, 2, {}),
+    'NotEqual': (2, 2, {}),
+    'LogicalAnd': (2, 2, {}),
+    'LogicalOr': (2, 2, {}),
+    'LogicalNot': (1, 1, {}),
+    'BooleanConstant': (0, 0, {'value': lambda v: isinstance(v, bool)}),
+    'Position': (0, 0, {'comparator': lambda v: v in Position.comparators,
+                        'value': lambda v: _is_int(v) or v == 'last',
+                        'per_parent': lambda v: isinstance(v, bool)}),
+    'TextContains': (2, 2, {}),
+    'TextStartsWith': (2, 2, {}),
+    'TextEndsWith': (2, 2, {}),
+    'TextLength': (1, 1, {}),
+}
+_CLASSES = {name: getattr(xpath_syntax_tree, name) for name in _SCHEMA}
+
+# the attributes every syntax tree node has, which are not stored
+_RESERVED = ('token', 'children', 'parent')
+
+
+class XPATHCatalogue:
+    """
+    This class holds a set of compiled XPATH expressions, and stores them in a compact, versioned JSON format.
+    Each expression is stored with its plan (the parsed steps, the planned steps and the rewrites), so that loading
+    a catalogue rebuilds the syntax trees directly, without tokenizing, parsing or planning the expressions again.
+    The version must be incremented whenever the attributes of the syntax tree nodes change, catalogues written
+    with another version are rejected.
+    A catalogue is trusted to hold the plans of its expressions: the syntax trees are checked to be well-formed, but
+    not to be the plan of the expression they are stored with (that would mean parsing it again). Only load catalogues
+    written by dump from a trusted source.
+    """
+
+    FORMAT = 'xpath-catalogue'
+    VERSION = 2
+
+    def __init__(self, compiled=()):
+        """
+        :param compiled:    the CompiledXPATH objects held by this catalogue
+        """
+        self._entries = OrderedDict()
+        for c in compiled:
+            self.add(c)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def __contains__(self, xpath_expression):
+        return xpath_expression in self._entries
+
+    def add(self, compiled):
+        """
+        This function adds a compiled expression to this catalogue
+        :param compiled:    a CompiledXPATH object
+        :return:            self
+        """
+        self._entries[compiled.expression] = compiled
+        return self
+
+    def get(self, xpath_expression):
+        """
+        This function returns a compiled expression of this catalogue
+        :param xpath_expression:    the XPATH expression
+        :return:                    a CompiledXPATH object, or None if the expression is not in this catalogue
+        """
+        return self._entries.get(xpath_expression)
+
+    def dumps(self):
+        """
+        This function serializes this catalogue
+        :return:    bytes (UTF-8 encoded JSON)
+        """
+        queries = []
+        for c in self._entries.values():
+            plan = c.plan
+            positions = {id(n): i for i, n in enumerate(plan.original)}
+
+            # planned steps that were not rewritten are stored as the position of the parsed step
+            steps = [positions[id(n)] if id(n) in positions else XPATHCatalogue._encode(n) for n in plan.steps]
+            queries.append({'expression': c.expression,
+                            'original': [XPATHCatalogue._encode(n) for n in plan.original],
+                            'steps': steps,
+                            'rewrites': plan.rewrites})
+        data = {'format': XPATHCatalogue.FORMAT, 'version': XPATHCatalogue.VERSION, 'queries': queries}
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def dump(self, target):
+        """
+        This function writes this catalogue to a file
+        :param target:  a path, or a file object (binary or text)
+        :return:        None
+        """
+        data = self.dumps()
+        if isinstance(target, str):
+            with open(target, 'wb') as f:
+                f.write(data)
+            return
+        try:
+            target.write(data)
+        except TypeError:
+            target.write(data.decode('utf-8'))
+
+    @staticmethod
+    def loads(data):
+        """
+        This function rebuilds a catalogue from its serialized form
+        :param data:    str, bytes, or a buffer such as a memory-mapped file
+        :return:        an XPATHCatalogue
+        """
+        if not isinstance(data, (str, bytes)):
+            data = bytes(data[:])
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        try:
+            data = json.loads(data)
+        except ValueError as e:
+            raise ValueError('Invalid XPATH catalogue: {}'.format(e))
+        if not isinstance(data, dict) or data.get('format') != XPATHCatalogue.FORMAT:
+            raise ValueError('Invalid XPATH catalogue: unknown format')
+        if data.get('version') != XPATHCatalogue.VERSION:
+            raise ValueError('Unsupported XPATH catalogue version {} (expected {})'.format(data.get('version'), XPATHCatalogue.VERSION))
+        out = XPATHCatalogue()
+        for q in XPATHCatalogue._check(data.get('queries'), list):
+            q = XPATHCatalogue._check(q, dict)
+            expression = XPATHCatalogue._check(q.get('expression'), str)
+            original = [XPATHCatalogue._decode(n) for n in XPATHCatalogue._check(q.get('original'), list)]
+            steps = []
+            for n in XPATHCatalogue._check(q.get('steps'), list):
+                if isinstance(n, int) and not isinstance(n, bool):
+                    if not 0 <= n < len(original):
+                        raise ValueError('Invalid XPATH catalogue: step {} out of range'.format(n))
+                    steps.append(original[n])
+                else:
+                    steps.append(XPATHCatalogue._decode(n))
+            rewrites = [XPATHCatalogue._check(r, str) for r in XPATHCatalogue._check(q.get('rewrites'), list)]
+
+            # predicates are type-checked and compiled, as for an expression that is parsed
+            try:
+                out.add(CompiledXPATH(expression, XPATHPlan(expression, original, steps, rewrites)))
+            except SyntaxError as e:
+                raise ValueError('Invalid XPATH catalogue: {}'.format(e))
+        return out
+
+    @staticmethod
+    def load(source):
+        """
+        This function reads a catalogue
+        :param source:  a path, a file object (binary or text), or a memory-mapped file
+        :return:        an XPATHCatalogue
+        """
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                return XPATHCatalogue.loads(f.read())
+        if isinstance(source, mmap.mmap):
+            return XPATHCatalogue.loads(source[:])
+        return XPATHCatalogue.loads(source.read())
+
+    @staticmethod
+    def _encode(n):
+        """
+        This function converts a syntax tree node (and its children) into plain Python data
+        :param n:   the syntax tree node
+        :return:    a list [class name, attributes, children]
+        """
+        attributes = {}
+        for k, v in vars(n).items():
+            if k in _RESERVED or k.startswith('_'):
+                continue
+            attributes[k] = list(v) if isinstance(v, tuple) else v
+        return [n.__class__.__name__, attributes, [XPATHCatalogue._encode(c) for c in n.children]]
+
+    @staticmethod
+    def _decode(data):
+        """
+        This function rebuilds a syntax tree node (and its children), without calling its constructor
+        :param data:    a list [class name, attributes, children]
+        :return:        the syntax tree node
+        """
+        if not isinstance(data, list) or len(data) != 3:
+            raise ValueError('Invalid XPATH catalogue: malformed syntax tree node')
+        (name, attributes, children) = data
+        cls = _CLASSES.get(name)
+        if cls is None:
+            raise ValueError('Invalid XPATH catalogue: unknown syntax tree node {!r}'.format(name))
+        (minimum, maximum, checks) = _SCHEMA[name]
+        n = cls.__new__(cls)
+        Expression.__init__(n)
+
+        # every attribute of the class must be present, and nothing else
+        attributes = XPATHCatalogue._check(attributes, dict)
+        if set(attributes) != set(checks):
+            raise ValueError('Invalid XPATH catalogue: {} has attributes {}, expected {}'.format(name, sorted(attributes), sorted(checks)))
+        for k, v in attributes.items():
+            if isinstance(v, list):
+                v = tuple(XPATHCatalogue._check_value(x) for x in v)
+            if not checks[k](XPATHCatalogue._check_value(v)):
+                raise ValueError('Invalid XPATH catalogue: attribute {} of {} has an invalid value {!r}'.format(k, name, v))
+            setattr(n, k, v)
+        children = XPATHCatalogue._check(children, list)
+        if len(children) < minimum or (maximum is not None and len(children) > maximum):
+            raise ValueError('Invalid XPATH catalogue: {} with {} children'.format(name, len(children)))
+        for c in children:
+            n.add_child(XPATHCatalogue._decode(c))
+        return n
+
+    @staticmethod
+    def _check(value, expected):
+        if not isinstance(value, expected):
+            raise ValueError('Invalid XPATH catalogue: expected {}, found {}'.format(expected.__name__, type(value).__name__))
+        return value
+
+    @staticmethod
+    def _check_value(value):
+        if value is not None and not isinstance(value, (str, int, float, bool, tuple)):
+            raise ValueError('Invalid XPATH catalogue: unexpected value {!r}'.format(value))
+        return value
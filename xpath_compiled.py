@@ -0,0 +1,397 @@
+import threading
+from collections import OrderedDict
+
+from xpath_adapter import TreeAdapter
+from xpath_index import IndexedDocument
+from xpath_planner import XPATHPlanner
+from xpath_profile import XPATHTrace, profile
+from xpath_stream import stream
+from xpath_syntax_tree import AttributeName, LocationStep, Position, Predicate, SelectAttribute, SelectFromRootNode, \
+    SelectText, XPATHSyntaxTree
+
+
+class CompiledXPATH:
+    """
+    This class represents an XPATH expression that has been tokenized, parsed and planned once.
+    Instances are immutable, and can be evaluated against any number of documents, from any number of threads.
+    The only state written during evaluation is the cache of compiled predicate tests held by the syntax tree nodes,
+    one entry per adapter (see Predicate.test), which never changes the results.
+    """
+
+    __slots__ = ('expression', '_plan', '_steps', '_lazy')
+
+    # the planner that rewrites the parsed steps into the steps that are evaluated
+    planner = XPATHPlanner()
+
+    def __init__(self, xpath_expression, plan=None):
+        """
+        :param xpath_expression:    the XPATH expression
+        :param plan:                the XPATHPlan of the expression, if it was planned before (e.g. loaded from an
+                                    XPATHCatalogue), in which case the expression is not parsed again
+        """
+        object.__setattr__(self, 'expression', xpath_expression)
+        if plan is None:
+            nodes = XPATHSyntaxTree().xpath_to_syntax_tree(xpath_expression)
+            plan = CompiledXPATH.planner.plan(xpath_expression, nodes)
+
+        # type-check every predicate as parsed, before the planner folds some of them away
+        for n in _predicates(plan.original):
+            if not isinstance(n, Position):
+                n.test()
+        object.__setattr__(self, '_plan', plan)
+        object.__setattr__(self, '_steps', self._plan.steps)
+
+        # compile every predicate that is evaluated up front
+        for n in _predicates(self._steps):
+            if not isinstance(n, Position):
+                n.test()
+
+        # positional predicates are evaluated lazily, so that the context nodes of a LocationStep are only walked up to
+        # the last position needed (positions counted per parent never end the walk, see Position)
+        object.__setattr__(self, '_lazy', any(isinstance(n, Position) for n in _predicates(self._steps)))
+
+    def __setattr__(self, key, value):
+        raise AttributeError('CompiledXPATH objects are immutable')
+
+    def __delattr__(self, key):
+        raise AttributeError('CompiledXPATH objects are immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, CompiledXPATH) and other.expression == self.expression
+
+    def __hash__(self):
+        return hash(self.expression)
+
+    def __repr__(self):
+        return 'CompiledXPATH({!r})'.format(self.expression)
+
+    @property
+    def steps(self):
+        """
+        This property returns the syntax tree nodes of this expression, in evaluation order (as planned)
+        :return:    a tuple of Expression objects
+        """
+        return self._steps
+
+    @property
+    def plan(self):
+        """
+        This property returns the plan of this expression: the parsed steps, the steps that are evaluated,
+        and the rewrites applied by the planner
+        :return:    an XPATHPlan
+        """
+        return self._plan
+
+    def evaluate(self, bs_doc, hook=None, adapter=None, limits=None):
+        """
+        This function evaluates this compiled XPATH expression against a document.
+        Every result is returned, so a '//' step with a positional predicate (such as '//table[1]') still walks the
+        entire document: any element may be the first of its parent. Use iterate(...).first() or limit(n) to stop
+        the walk as soon as enough results were found.
+        :param bs_doc:  the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param hook:    a function that is called with an XPATHStepRecord after each step (optional)
+        :param adapter: the TreeAdapter through which the document is accessed, derived from the document by default
+        :param limits:  the XPATHLimits of the evaluation (optional), an XPATHLimitError is raised when one is exceeded
+        :return:        a list of nodes, or a list of strings if the expression ends in text() or an attribute
+        """
+        if hook is not None:
+            return self.explain(bs_doc, hook, adapter, limits)[0]
+        if self._lazy:
+            return list(self.iterate(bs_doc, adapter, limits))
+        if limits is not None:
+            return self._evaluate_limited(bs_doc, adapter, limits)
+        (nodes, steps, adapter) = self._start(bs_doc, adapter)
+
+        # iteratively go through each node in the XPATH chain
+        inp = (nodes, [])
+        for n in steps:
+            inp = n.evaluate(inp[0], inp[1], adapter)
+        return CompiledXPATH._to_result(inp)
+
+    def _evaluate_limited(self, bs_doc, adapter, limits):
+        """
+        This function evaluates this compiled XPATH expression against a document, enforcing resource limits
+        :param bs_doc:  the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param adapter: the TreeAdapter through which the document is accessed, or None
+        :param limits:  the XPATHLimits of the evaluation
+        :return:        a list of nodes, or a list of strings
+        """
+        limits.check_steps(self._steps)
+        (nodes, steps, adapter) = self._start(bs_doc, adapter)
+        adapter = limits.start(adapter)
+        inp = (nodes, [])
+        adapter.end_step(inp)
+        for n in steps:
+            adapter.begin_step()
+            inp = n.evaluate(inp[0], inp[1], adapter)
+            adapter.end_step(inp)
+        return CompiledXPATH._to_result(inp)
+
+    def explain(self, bs_doc, hook=None, adapter=None, limits=None):
+        """
+        This function evaluates this compiled XPATH expression against a document,
+        recording wall time, input size and output size of each step and predicate sub-tree
+        :param bs_doc:  the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param hook:    a function that is called with an XPATHStepRecord after each step (optional)
+        :param adapter: the TreeAdapter through which the document is accessed, derived from the document by default
+        :param limits:  the XPATHLimits of the evaluation (optional), an XPATHLimitError is raised when one is exceeded
+        :return:        a tuple (result, XPATHTrace)
+        """
+        if limits is not None:
+            limits.check_steps(self._steps)
+        (nodes, steps, adapter) = self._start(bs_doc, adapter)
+        if limits is not None:
+            adapter = limits.start(adapter)
+            adapter.end_step((nodes, []))
+        trace = XPATHTrace(self.expression)
+        inp = profile(steps, (nodes, []), trace, hook=hook, offset=len(self._steps) - len(steps), adapter=adapter)
+        return (CompiledXPATH._to_result(inp), trace)
+
+    @staticmethod
+    def _to_result(inp):
+        """
+        This function converts the output of the last step of an XPATH expression into its result
+        :param inp: the output of the last step
+        :return:    a list of nodes, or a list of strings
+        """
+
+        # empty list
+        if len(inp) == 0:
+            return []
+
+        # if the output is a tuple, we terminated at a non-leaf node
+        # throw away the negative nodes and return only the first part of the
+        # tuple (as a list, a DocumentSnapshot selects the descendants of a node as a range)
+        if isinstance(inp, tuple):
+            return inp[0] if isinstance(inp[0], list) else list(inp[0])
+
+        # else return the entire list
+        else:
+            return inp
+
+    def iterate(self, bs_doc, adapter=None, limits=None):
+        """
+        This function evaluates this compiled XPATH expression lazily, chaining each step as a generator
+        :param bs_doc:  the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param adapter: the TreeAdapter through which the document is accessed, derived from the document by default
+        :param limits:  the XPATHLimits of the evaluation (optional), the output of every step is limited as it is
+                        produced
+        :return:        an XPATHResultIterator
+        """
+        return XPATHResultIterator(self._chain(bs_doc, self._steps, adapter, limits))
+
+    def count(self, bs_doc, adapter=None, limits=None):
+        """
+        This function counts the results of this compiled XPATH expression, without building the list of results.
+        Steps are chained lazily, and a trailing text() or attribute step is not evaluated at all.
+        :param bs_doc:  the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param adapter: the TreeAdapter through which the document is accessed, derived from the document by default
+        :param limits:  the XPATHLimits of the evaluation (optional)
+        :return:        the number of results
+        """
+        steps = self._steps
+        while len(steps) > 0 and isinstance(steps[-1], (SelectText, SelectAttribute, SelectFromRootNode)):
+            steps = steps[:-1]
+        n = 0
+        for _ in self._chain(bs_doc, steps, adapter, limits):
+            n += 1
+        return n
+
+    def _chain(self, bs_doc, steps, adapter, limits):
+        """
+        This function chains the lazy evaluation of steps
+        :param bs_doc:  the document to be queried
+        :param steps:   the steps to be evaluated (a prefix of the steps of this expression)
+        :param adapter: the TreeAdapter through which the document is accessed, or None
+        :param limits:  the XPATHLimits of the evaluation, or None
+        :return:        a generator of results
+        """
+        if limits is not None:
+            limits.check_steps(self._steps)
+        (nodes, remaining, adapter) = self._start(bs_doc, adapter)
+        remaining = remaining[:len(remaining) - (len(self._steps) - len(steps))]
+        if limits is not None:
+            adapter = limits.start(adapter)
+            adapter.end_step((nodes, []))
+        out = iter(nodes)
+        for n in remaining:
+            out = n.iterate(out, adapter)
+            if limits is not None:
+                out = adapter.limit(out)
+        return out
+
+    def stream(self, source, parser='html', encoding='utf-8', chunk_size=65536):
+        """
+        This function evaluates this compiled XPATH expression while parsing a document, without building a tree.
+        Only chains of '//tag[predicate]' steps, optionally followed by '/@attr' or '/text()', can be streamed.
+        Other expressions raise a ValueError when this function is called, before any input is read.
+        :param source:      a str, bytes, a memory-mapped file, or a file object (text or binary)
+        :param parser:      'html' (html.parser) or 'xml' (xml.sax)
+        :param encoding:    the encoding of byte input (HTML only)
+        :param chunk_size:  the number of characters (or bytes) parsed at once
+        :return:            a generator of results (StreamElement objects, attribute values or text), in document order
+        """
+        return stream(self._steps, source, parser=parser, encoding=encoding, chunk_size=chunk_size)
+
+    def _start(self, bs_doc, adapter=None):
+        """
+        This function determines the initial node set, the steps that remain to be evaluated and the adapter
+        :param bs_doc:  the document to be queried (BeautifulSoup, ElementTree), or an IndexedDocument
+        :param adapter: the TreeAdapter through which the document is accessed, or None
+        :return:        a tuple (initial nodes, remaining steps, adapter)
+        """
+        if isinstance(bs_doc, IndexedDocument):
+            adapter = adapter or bs_doc.adapter
+            nodes = bs_doc.select(self._steps)
+            if nodes is not None:
+                return (nodes, self._steps[1:], adapter)
+            return ([adapter.document(bs_doc.document)], self._steps, adapter)
+        adapter = adapter or TreeAdapter.for_document(bs_doc)
+        return ([adapter.document(bs_doc)], self._steps, adapter)
+
+
+def _predicates(steps):
+    """
+    This function returns the predicates of an XPATH expression, including those grouped into a LocationStep
+    :param steps:   the syntax tree nodes of the expression
+    :return:        a generator of Predicate and AttributeName nodes
+    """
+    for n in steps:
+        if isinstance(n, LocationStep):
+            yield from _predicates(n.children)
+        elif isinstance(n, (Predicate, AttributeName)):
+            yield n
+
+
+class XPATHResultIterator:
+    """
+    This class wraps the lazy evaluation of a CompiledXPATH.
+    Results are produced as they are found, so that evaluation stops as soon as the caller stops asking for results.
+    """
+
+    def __init__(self, generator):
+        self._generator = generator
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._generator)
+
+    def first(self, default=None):
+        """
+        This function returns the first result, and stops the evaluation
+        :param default: the value to be returned if there are no results
+        :return:        the first result, or default
+        """
+        for x in self._generator:
+            self.close()
+            return x
+        return default
+
+    def limit(self, n):
+        """
+        This function returns (at most) the first n results, and stops the evaluation
+        :param n:   the maximum number of results
+        :return:    a list of results
+        """
+        out = []
+        if n > 0:
+            for x in self._generator:
+                out.append(x)
+                if len(out) >= n:
+                    break
+        self.close()
+        return out
+
+    def close(self):
+        """
+        This function stops the evaluation, releasing the nodes held by the generator chain
+        :return:    None
+        """
+        self._generator.close()
+
+
+class XPATHCompileCache:
+    """
+    This class implements a bounded, least-recently-used cache of CompiledXPATH objects,
+    keyed on the XPATH expression.
+    """
+
+    def __init__(self, maxsize=256):
+        if maxsize < 0:
+            raise ValueError('maxsize must be a non-negative integer')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, xpath_expression):
+        """
+        This function returns the CompiledXPATH for a given expression, compiling it on a cache miss
+        :param xpath_expression:    the XPATH expression
+        :return:                    a CompiledXPATH object
+        """
+        with self._lock:
+            compiled = self._entries.get(xpath_expression)
+            if compiled is not None:
+                self._entries.move_to_end(xpath_expression)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        # compile outside of the lock, parsing may raise SyntaxError
+        compiled = CompiledXPATH(xpath_expression)
+        self.add(compiled)
+        return compiled
+
+    def add(self, compiled):
+        """
+        This function adds an expression that was compiled elsewhere (e.g. loaded from an XPATHCatalogue) to this cache
+        :param compiled:    a CompiledXPATH object
+        :return:            None
+        """
+        with self._lock:
+            if self.maxsize > 0:
+                self._entries[compiled.expression] = compiled
+                self._entries.move_to_end(compiled.expression)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def resize(self, maxsize):
+        """
+        This function changes the maximum number of expressions held by this cache,
+        evicting the least recently used expressions if needed
+        :param maxsize: the new maximum size
+        :return:        self
+        """
+        if maxsize < 0:
+            raise ValueError('maxsize must be a non-negative integer')
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return self
+
+    def clear(self):
+        """
+        This function removes all expressions from this cache, and resets the hit and miss counters
+        :return:    self
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+        return self
+
+    def info(self):
+        """
+        This function returns the statistics of this cache
+        :return:    a dictionary with keys 'hits', 'misses', 'size' and 'maxsize'
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
@@ -0,0 +1,110 @@
+from xpath_adapter import TreeAdapter
+from xpath_syntax_tree import AttributeName, Equal, Position, Predicate, SelectAll, SelectDescendants, SelectHTMLTag, \
+    SelectStar, StringLiteral
+
+
+class IndexedDocument:
+    """
+    This class wraps a document (BeautifulSoup, ElementTree), and indexes its elements by tag name, attribute name and id.
+    The indexes are built once, in document order, so that a leading '//' step can be answered
+    from the index rather than by walking the entire document for every query.
+    """
+
+    def __init__(self, bs_doc, adapter=None):
+        self.document = bs_doc
+        self.adapter = adapter or TreeAdapter.for_document(bs_doc)
+        self._elements = []
+        self._by_tag = {}
+        self._by_attribute = {}
+        self._by_id = {}
+        for x in self.adapter.descendants(self.adapter.document(bs_doc)):
+            attrs = self.adapter.attributes(x)
+            self._elements.append(x)
+            self._by_tag.setdefault(self.adapter.tag(x), []).append(x)
+            for a in attrs:
+                self._by_attribute.setdefault(a, []).append(x)
+            if 'id' in attrs:
+                self._by_id.setdefault(attrs['id'], []).append(x)
+
+    def __len__(self):
+        return len(self._elements)
+
+    def elements(self):
+        """
+        This function returns all elements of the document
+        :return:    a list of elements, in document order
+        """
+        return self._elements
+
+    def elements_by_tag(self, tag_name):
+        """
+        This function returns all elements with a given tag name
+        :param tag_name:    the tag name
+        :return:            a list of elements, in document order
+        """
+        return self._by_tag.get(tag_name, [])
+
+    def elements_with_attribute(self, attribute_name):
+        """
+        This function returns all elements that have a given attribute
+        :param attribute_name:  the attribute name
+        :return:                a list of elements, in document order
+        """
+        return self._by_attribute.get(attribute_name, [])
+
+    def elements_by_id(self, id_value):
+        """
+        This function returns all elements with a given id
+        :param id_value:    the value of the id attribute
+        :return:            a list of elements, in document order
+        """
+        return self._by_id.get(id_value, [])
+
+    def select(self, nodes):
+        """
+        This function answers the leading '//' step of an XPATH expression from the indexes.
+        Of all the index lists that match the tag and predicates directly following that step,
+        the shortest one is returned. These tag and predicate steps still have to be evaluated on it.
+        A leading SelectDescendants step (a '//' step fused with its tag name and attributes by the planner)
+        is evaluated completely, its tag name and attributes are checked on the shortest list.
+        :param nodes:   the syntax tree nodes of the XPATH expression
+        :return:        a list of elements that replaces the output of the leading '//' step,
+                        or None if the expression does not start with '//'
+        """
+        if len(nodes) == 0 or nodes[0].__class__ not in (SelectAll, SelectDescendants):
+            return None
+
+        candidates = [self._elements]
+        i = 1
+
+        # tag name
+        if isinstance(nodes[0], SelectDescendants):
+            if nodes[0].tag_name is not None:
+                candidates.append(self.elements_by_tag(nodes[0].tag_name))
+            for a in nodes[0].attribute_names:
+                candidates.append(self.elements_with_attribute(a))
+        elif i < len(nodes) and isinstance(nodes[i], SelectStar):
+            i += 1
+        elif i < len(nodes) and isinstance(nodes[i], SelectHTMLTag):
+            candidates.append(self.elements_by_tag(nodes[i].tag_name))
+            i += 1
+
+        # predicates
+        while i < len(nodes) and isinstance(nodes[i], (Predicate, AttributeName)):
+            n = nodes[i]
+
+            # positions are counted among the elements selected so far, later predicates do not narrow them down
+            if isinstance(n, Position):
+                break
+            if isinstance(n, AttributeName):
+                candidates.append(self.elements_with_attribute(n.value))
+            if isinstance(n, Equal) and isinstance(n.children[1], AttributeName) and n.children[1].value == 'id' \
+                    and isinstance(n.children[0], StringLiteral):
+                candidates.append(self.elements_by_id(n.children[0].value))
+            i += 1
+
+        # return
+        out = min(candidates, key=len)
+        if isinstance(nodes[0], SelectDescendants):
+            return list(filter(nodes[0].matches(self.adapter), out))
+        return list(out)
@@ -0,0 +1,192 @@
+import time
+
+from xpath_adapter import TreeAdapter
+
+
+class XPATHLimitError(RuntimeError):
+    """
+    This exception is raised when the evaluation of an XPATH expression exceeds one of its XPATHLimits.
+    """
+
+    def __init__(self, limit, value, maximum):
+        """
+        :param limit:   the name of the limit that was exceeded ('max_nodes', 'max_steps' or 'deadline')
+        :param value:   the value that exceeded the limit
+        :param maximum: the limit
+        """
+        super().__init__('XPATH evaluation exceeded {} ({} > {})'.format(limit, value, maximum))
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+
+
+class XPATHLimits:
+    """
+    This class holds the resource limits of the evaluation of an XPATH expression.
+    A limit that is None is not enforced.
+    """
+
+    def __init__(self, max_nodes=None, max_steps=None, deadline=None):
+        """
+        :param max_nodes:   the maximum number of nodes a single step may select. Nodes are counted as the step reaches
+                            them through the tree (a node reached twice is counted twice), so that evaluation stops
+                            before an oversized node set has been built.
+        :param max_steps:   the maximum number of steps (including predicates) evaluated, as planned
+        :param deadline:    the maximum wall-clock time of the evaluation, in seconds. It is checked between steps, on
+                            every navigation and text access, not while a single navigation (such as one search of
+                            the entire document) runs.
+        """
+        for (name, value) in [('max_nodes', max_nodes), ('max_steps', max_steps), ('deadline', deadline)]:
+            if value is not None and value < 0:
+                raise ValueError('{} must be a non-negative number'.format(name))
+        self.max_nodes = max_nodes
+        self.max_steps = max_steps
+        self.deadline = deadline
+
+    def __repr__(self):
+        return 'XPATHLimits(max_nodes={}, max_steps={}, deadline={})'.format(self.max_nodes, self.max_steps, self.deadline)
+
+    def check_steps(self, steps):
+        """
+        This function checks the number of steps of an expression
+        :param steps:   the steps to be evaluated
+        :return:        None
+        """
+        if self.max_steps is not None and len(steps) > self.max_steps:
+            raise XPATHLimitError('max_steps', len(steps), self.max_steps)
+
+    def start(self, adapter):
+        """
+        This function starts an evaluation under these limits
+        :param adapter: the TreeAdapter through which the document is accessed
+        :return:        a LimitedAdapter, that enforces these limits
+        """
+        return LimitedAdapter(adapter, self)
+
+
+class LimitedAdapter(TreeAdapter):
+    """
+    This class wraps a TreeAdapter, and enforces XPATHLimits while an expression is evaluated through it.
+    Every node returned by a navigation method (other than parent) is counted against max_nodes (the count starts over
+    with each step), the output of every step is checked against max_nodes as well,
+    and the deadline is checked on every navigation, on every access to the text of a node by a step,
+    and on every node tested by a predicate.
+    Predicates are tested with the tests compiled for the wrapped adapter.
+    """
+
+    def __init__(self, adapter, limits):
+        self.adapter = adapter
+        self.limits = limits
+        self.nodes = 0
+        self._deadline = None if limits.deadline is None else time.perf_counter() + limits.deadline
+
+        # per-node accessors are bound once, only the expensive ones check the deadline
+        self.tag = adapter.tag
+        self.attributes = adapter.attributes
+        self.column = adapter.column
+        text = adapter.text
+        text_contains = adapter.text_contains
+        text_startswith = adapter.text_startswith
+        text_endswith = adapter.text_endswith
+        check = self.check_deadline
+        self.text = lambda x: check() or text(x)
+        self.text_contains = lambda x, s: check() or text_contains(x, s)
+        self.text_startswith = lambda x, s: check() or text_startswith(x, s)
+        self.text_endswith = lambda x, s: check() or text_endswith(x, s)
+
+    def begin_step(self):
+        """
+        This function is called before each step, it resets the node count
+        :return:    None
+        """
+        self.check_deadline()
+        self.nodes = 0
+
+    def end_step(self, out):
+        """
+        This function is called after each step, with its output
+        :param out: the output of the step
+        :return:    None
+        """
+        self.check_deadline()
+        size = len(out[0]) if isinstance(out, tuple) else len(out)
+        if self.limits.max_nodes is not None and size > self.limits.max_nodes:
+            raise XPATHLimitError('max_nodes', size, self.limits.max_nodes)
+
+    def check_deadline(self):
+        """
+        This function raises an XPATHLimitError if the deadline has passed
+        :return:    None
+        """
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            raise XPATHLimitError('deadline', round(self.limits.deadline + time.perf_counter() - self._deadline, 6), self.limits.deadline)
+
+    def count(self, nodes):
+        """
+        This function counts nodes against max_nodes
+        :param nodes:   the nodes reached by a navigation method
+        :return:        the nodes
+        """
+        self.check_deadline()
+        self.nodes += len(nodes)
+        if self.limits.max_nodes is not None and self.nodes > self.limits.max_nodes:
+            raise XPATHLimitError('max_nodes', self.nodes, self.limits.max_nodes)
+        return nodes
+
+    def limit(self, generator):
+        """
+        This function enforces the limits on the output of a lazily evaluated step
+        :param generator:   the output of the step
+        :return:            a generator
+        """
+        n = 0
+        for x in generator:
+            n += 1
+            if self.limits.max_nodes is not None and n > self.limits.max_nodes:
+                raise XPATHLimitError('max_nodes', n, self.limits.max_nodes)
+            self.check_deadline()
+            yield x
+
+    def test(self, predicate):
+
+        # the tests compiled for the wrapped adapter are reused rather than compiled for every evaluation,
+        # the deadline is checked on every node tested instead
+        test = self.adapter.test(predicate)
+        if self._deadline is None:
+            return test
+        check = self.check_deadline
+        return lambda x: check() or test(x)
+
+    def document(self, doc):
+        return self.adapter.document(doc)
+
+    def identity(self, node):
+        return self.adapter.identity(node)
+
+    def children(self, node):
+        return self.count(self.adapter.children(node))
+
+    def descendants(self, node):
+        return self.count(self.adapter.descendants(node))
+
+    def iter_descendants(self, node):
+        return self.adapter.iter_descendants(node)
+
+    def find_descendants(self, node, tag_name=None, attribute_names=()):
+        return self.count(self.adapter.find_descendants(node, tag_name, attribute_names))
+
+    def parent(self, node):
+
+        # parents are mostly looked up to check ancestry, the output of the step is checked at its end
+        self.check_deadline()
+        return self.adapter.parent(node)
+
+    def following_siblings(self, node):
+        return self.count(self.adapter.following_siblings(node))
+
+    def preceding_siblings(self, node):
+        return self.count(self.adapter.preceding_siblings(node))
+
+    def sort(self, nodes):
+        self.check_deadline()
+        return self.adapter.sort(nodes)
@@ -0,0 +1,417 @@
+from contextlib import contextmanager
+
+import bs4 as bs
+
+from xpath_adapter import BeautifulSoupAdapter, TreeAdapter
+from xpath_stream import _uses_text
+from xpath_syntax_tree import AttributeName, Position, Predicate, SelectAll, SelectAttribute, SelectChildren, \
+    SelectFromRootNode, SelectHTMLTag, SelectSelf, SelectStar, SelectText
+
+
+class DocumentChange:
+    """
+    This class describes a change of a MutableDocument.
+    The anchor is the deepest element that contains the entire change. The elements in removed leave the document
+    (or are changed, and come back as part of an added subtree), the subtrees rooted at the elements in added
+    (children of the anchor) enter the document.
+    The anchor is None if no element contains the change (an edit of the document node itself, or of an element
+    that has no parent), the entire document must then be considered changed.
+    """
+
+    def __init__(self, anchor, removed=(), added=()):
+        self.anchor = anchor
+        self.removed = list(removed)
+        self.added = list(added)
+
+    def __repr__(self):
+        return 'DocumentChange(anchor={}, {} removed, {} added)'.format(getattr(self.anchor, 'name', None), len(self.removed), len(self.added))
+
+
+class MutableDocument:
+    """
+    This class wraps a BeautifulSoup document that is edited in place. Every edit made through this class is recorded
+    as a DocumentChange, and passed to the subscribers (such as LiveXPATH objects) before and after it is applied.
+    Edits made directly on the BeautifulSoup document must be wrapped in editing(node), otherwise subscribers are
+    not notified.
+    The wrapper can be queried like a document.
+    """
+
+    def __init__(self, bs_doc):
+        self.document = bs_doc
+        self.adapter = _MutableDocumentAdapter(bs_doc)
+        self._subscribers = []
+
+    def subscribe(self, subscriber):
+        """
+        This function registers an object that is notified of every change
+        :param subscriber:  an object with the methods before_change(change) and after_change(change)
+        :return:            None
+        """
+        self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        """
+        This function removes a subscriber
+        :param subscriber:  the subscriber
+        :return:            None
+        """
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+
+    def remove(self, node):
+        """
+        This function removes an element (and everything it contains) from the document
+        :param node:    the element
+        :return:        the element, detached from the document
+        """
+        change = DocumentChange(node.parent, self._subtree(node))
+        with self._change(change):
+            node.extract()
+        return node
+
+    def insert(self, parent, position, node):
+        """
+        This function inserts an element (or a string) into the document
+        :param parent:      the element that receives the new node
+        :param position:    the index of the new node among the contents of parent
+        :param node:        the new element or string
+        :return:            None
+        """
+        with self._change(DocumentChange(parent, (), [node] if isinstance(node, bs.Tag) else [])):
+            parent.insert(position, node)
+
+    def append(self, parent, node):
+        """
+        This function appends an element (or a string) to the contents of an element
+        :param parent:  the element that receives the new node
+        :param node:    the new element or string
+        :return:        None
+        """
+        self.insert(parent, len(parent.contents), node)
+
+    def replace(self, node, new_node):
+        """
+        This function replaces an element by another element (or a string)
+        :param node:        the element to be replaced
+        :param new_node:    the new element or string
+        :return:            the replaced element, detached from the document
+        """
+        change = DocumentChange(node.parent, self._subtree(node), [new_node] if isinstance(new_node, bs.Tag) else [])
+        with self._change(change):
+            node.replace_with(new_node)
+        return node
+
+    def set_attribute(self, node, name, value):
+        """
+        This function sets the value of an attribute
+        :param node:    the element
+        :param name:    the attribute name
+        :param value:   the value
+        :return:        None
+        """
+        with self.editing(node):
+            node[name] = value
+
+    def delete_attribute(self, node, name):
+        """
+        This function removes an attribute
+        :param node:    the element
+        :param name:    the attribute name
+        :return:        None
+        """
+        with self.editing(node):
+            del node[name]
+
+    def set_text(self, node, text):
+        """
+        This function replaces the contents of an element by a string
+        :param node:    the element
+        :param text:    the string
+        :return:        None
+        """
+        with self._change(DocumentChange(node, self._subtree(node)[1:])):
+            node.string = text
+
+    @contextmanager
+    def editing(self, node):
+        """
+        This function wraps edits made directly on an element (and anything it contains), e.g.
+            with doc.editing(node):
+                node['href'] = rewrite(node['href'])
+        The element itself must stay in the document. Edits of the document node itself are allowed as well,
+        subscribers then evaluate their expressions on the entire document again.
+        :param node:    the element
+        :return:        a context manager
+        """
+        with self._change(DocumentChange(node.parent, self._subtree(node), [node])):
+            yield node
+
+    @contextmanager
+    def _change(self, change):
+        for s in list(self._subscribers):
+            s.before_change(change)
+        try:
+            yield change
+        finally:
+            for s in list(self._subscribers):
+                s.after_change(change)
+
+    def _subtree(self, node):
+        return [node] + self.adapter.descendants(node) if isinstance(node, bs.Tag) else []
+
+
+class _MutableDocumentAdapter(BeautifulSoupAdapter):
+    """
+    This class implements the TreeAdapter for a MutableDocument, evaluation starts at the wrapped document.
+    """
+
+    def __init__(self, bs_doc):
+        self.bs_doc = bs_doc
+
+    def document(self, doc):
+        return self.bs_doc
+
+
+class _RegionAdapter(TreeAdapter):
+    """
+    This class restricts a TreeAdapter to a region of the document: the path from the document node to an anchor
+    element, and the subtrees rooted at some of the children of the anchor.
+    """
+
+    def __init__(self, adapter, document, anchor, roots):
+        self.adapter = adapter
+        self.tag = adapter.tag
+        self.attributes = adapter.attributes
+        self.text = adapter.text
+        self.text_contains = adapter.text_contains
+        self.text_startswith = adapter.text_startswith
+        self.text_endswith = adapter.text_endswith
+        self.chain = []
+        p = anchor
+        while p is not None:
+            self.chain.append(p)
+            p = adapter.parent(p)
+        self.chain.reverse()
+        self._positions = {adapter.identity(x): i for i, x in enumerate(self.chain)}
+        self.roots = adapter.sort(roots) if len(roots) > 1 else list(roots)
+
+    def document(self, doc):
+        return self.chain[0]
+
+    def identity(self, node):
+        return self.adapter.identity(node)
+
+    def children(self, node):
+        i = self._positions.get(self.adapter.identity(node))
+        if i is None:
+            return self.adapter.children(node)
+        return [self.chain[i + 1]] if i + 1 < len(self.chain) else list(self.roots)
+
+    def descendants(self, node):
+        i = self._positions.get(self.adapter.identity(node))
+        if i is None:
+            return self.adapter.descendants(node)
+        out = self.chain[i + 1:]
+        for r in self.roots:
+            out.append(r)
+            out.extend(self.adapter.descendants(r))
+        return out
+
+    def iter_descendants(self, node):
+        return iter(self.descendants(node))
+
+    def parent(self, node):
+        return self.adapter.parent(node)
+
+    def sort(self, nodes):
+        return self.adapter.sort(nodes)
+
+
+class LiveXPATH:
+    """
+    This class holds the result of an XPATH expression on a MutableDocument, and keeps it up to date
+    as the document is edited.
+    If whether a node is selected only depends on the node, its ancestors and (for its text) its descendants,
+    only the region of each change is evaluated again: the path from the document node to the anchor of the change,
+    and the subtrees that were added. The result is updated in place, in document order.
+    Other expressions (with positional predicates, parent, ancestor or sibling axes, or text predicates followed by
+    further steps) are evaluated again entirely after each change, as are all expressions after a change that has
+    no anchor.
+    """
+
+    def __init__(self, compiled, document):
+        """
+        :param compiled:    a CompiledXPATH object
+        :param document:    a MutableDocument
+        """
+        self.compiled = compiled
+        self.document = document
+        self.incremental = LiveXPATH._is_local(compiled.steps)
+        self.updates = 0
+        self.full_updates = 0
+
+        # the steps that select nodes, and the step (text() or an attribute) that maps each node to its value
+        steps = list(compiled.steps)
+        self._leaf = steps.pop(-1) if len(steps) > 0 and isinstance(steps[-1], (SelectText, SelectAttribute)) else None
+        while len(steps) > 0 and isinstance(steps[-1], SelectFromRootNode) and self._leaf is not None:
+            steps.pop(-1)
+        self._steps = steps
+        self._nodes = []
+        self._values = []
+        self._members = set()
+        self._keys = {}
+        self.refresh()
+        document.subscribe(self)
+
+    @property
+    def result(self):
+        """
+        This property returns the current result of the expression
+        :return:    a list of nodes, or a list of strings if the expression ends in text() or an attribute
+        """
+        return list(self._values if self._leaf is not None else self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def close(self):
+        """
+        This function stops following the changes of the document
+        :return:    None
+        """
+        self.document.unsubscribe(self)
+
+    def refresh(self):
+        """
+        This function evaluates the expression again, on the entire document
+        :return:    the result
+        """
+        adapter = self.document.adapter
+        if self.incremental:
+            self._nodes = list(self._select(adapter, adapter.document(self.document)))
+            self._values = [self._value(x) for x in self._nodes]
+            self._members = set(adapter.identity(x) for x in self._nodes)
+        else:
+            self._values = self._nodes = list(self.compiled.evaluate(self.document))
+        return self.result
+
+    def before_change(self, change):
+        """
+        This function removes the nodes that a change may affect from the result, before the change is applied
+        :param change:  a DocumentChange
+        :return:        None
+        """
+        if not self.incremental or change.anchor is None:
+            return
+        adapter = self.document.adapter
+        self._keys = {}
+        stale = list(change.removed)
+        p = change.anchor
+        while p is not None:
+            stale.append(p)
+            p = adapter.parent(p)
+        for x in stale:
+            if adapter.identity(x) in self._members:
+                i = self._position(x)
+                del self._nodes[i]
+                del self._values[i]
+                self._members.discard(adapter.identity(x))
+
+    def after_change(self, change):
+        """
+        This function evaluates the expression on the region of a change, once it has been applied,
+        and merges the selected nodes into the result
+        :param change:  a DocumentChange
+        :return:        None
+        """
+        self.updates += 1
+
+        # a change without an anchor may affect any node
+        if not self.incremental or change.anchor is None:
+            self.full_updates += 1
+            self.refresh()
+            return
+        adapter = self.document.adapter
+        self._keys = {}
+        region = _RegionAdapter(adapter, adapter.document(self.document), change.anchor, change.added)
+        for x in self._select(region, region.document(None)):
+            k = adapter.identity(x)
+            if k in self._members:
+                continue
+            i = self._position(x)
+            self._nodes.insert(i, x)
+            self._values.insert(i, self._value(x))
+            self._members.add(k)
+
+    def _select(self, adapter, document):
+        inp = ([document], [])
+        for n in self._steps:
+            inp = n.evaluate(inp[0], inp[1], adapter)
+        return inp[0] if isinstance(inp, tuple) else inp
+
+    def _value(self, node):
+        return node if self._leaf is None else self._leaf.evaluate([node], [], self.document.adapter)[0]
+
+    def _key(self, node):
+        """
+        This function returns the position of a node in the document, as the path of child indices from the document node
+        :param node:    the node
+        :return:        a tuple of integers
+        """
+        adapter = self.document.adapter
+        k = adapter.identity(node)
+        if k not in self._keys:
+            p = adapter.parent(node)
+            if p is None:
+                self._keys[k] = ()
+            else:
+                siblings = adapter.children(p)
+                i = 0
+                while adapter.identity(siblings[i]) != k:
+                    i += 1
+                self._keys[k] = self._key(p) + (i,)
+        return self._keys[k]
+
+    def _position(self, node):
+        """
+        This function finds the position of a node in the (document-ordered) result, by bisection
+        :param node:    the node
+        :return:        the index of the node in the result, or the index at which it should be inserted
+        """
+        key = self._key(node)
+        lo = 0
+        hi = len(self._nodes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(self._nodes[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    @staticmethod
+    def _is_local(steps):
+        """
+        This function checks whether the selection of a node only depends on the node, its ancestors,
+        and (through its text) its descendants
+        :param steps:   the steps of the expression
+        :return:        True if the expression can be evaluated on the region of a change, False otherwise
+        """
+        navigation = False
+        for i in range(len(steps) - 1, -1, -1):
+            n = steps[i]
+            if isinstance(n, (SelectText, SelectAttribute)):
+                if i != len(steps) - 1:
+                    return False
+            elif isinstance(n, (SelectAll, SelectChildren)):
+                navigation = True
+            elif isinstance(n, (SelectSelf, SelectHTMLTag, SelectStar, SelectFromRootNode)):
+                continue
+            elif isinstance(n, (Predicate, AttributeName)) and not isinstance(n, Position):
+
+                # the text of an ancestor depends on nodes outside of the region
+                if navigation and _uses_text(n):
+                    return False
+            else:
+                return False
+        return navigation
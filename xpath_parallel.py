@@ -0,0 +1,116 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import bs4 as bs
+
+
+class XPATHDocumentResult:
+    """
+    This class holds the outcome of evaluating an XPATH expression against a single document in a worker process.
+    Nodes are returned as their markup, attribute values and text as plain strings.
+    """
+
+    __slots__ = ('index', 'value', 'error')
+
+    def __init__(self, index, value=None, error=None):
+        self.index = index
+        self.value = value
+        self.error = error
+
+    def __getstate__(self):
+        return (self.index, self.value, self.error)
+
+    def __setstate__(self, state):
+        (self.index, self.value, self.error) = state
+
+    def __repr__(self):
+        if self.error is not None:
+            return 'XPATHDocumentResult({}, error={!r})'.format(self.index, self.error.splitlines()[-1])
+        return 'XPATHDocumentResult({}, {!r})'.format(self.index, self.value)
+
+    @property
+    def ok(self):
+        """
+        This property indicates whether the document was parsed and queried without errors
+        :return:    True if there was no error, False otherwise
+        """
+        return self.error is None
+
+
+def _to_plain(value):
+    """
+    This function converts a single result of an XPATH expression into plain (picklable) Python data
+    :param value:   a node, string or (multi-valued) attribute value
+    :return:        a string, or a list of strings
+    """
+    if isinstance(value, bs.Tag):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [str(x) for x in value]
+    return str(value)
+
+
+def _evaluate_chunk(xpath_expression, parser, chunk):
+    """
+    This function parses and queries a chunk of documents, it runs inside a worker process
+    :param xpath_expression:    the XPATH expression
+    :param parser:              the name of the BeautifulSoup parser
+    :param chunk:               a list of tuples (index, HTML string)
+    :return:                    a list of XPATHDocumentResult objects
+    """
+
+    # imported here, so that the compile cache of the worker process is used
+    from xpath_bs import XPATH
+
+    out = []
+    for (i, html) in chunk:
+        try:
+            doc = bs.BeautifulSoup(html, parser)
+            out.append(XPATHDocumentResult(i, [_to_plain(x) for x in XPATH.xpath(xpath_expression, doc)]))
+        except Exception:
+            out.append(XPATHDocumentResult(i, error=traceback.format_exc()))
+    return out
+
+
+def xpath_parallel(xpath_expression, documents, workers=None, chunk_size=16, parser='html.parser'):
+    """
+    This function parses a sequence of HTML documents and applies an XPATH expression to each of them,
+    in a pool of worker processes. BeautifulSoup trees never leave the worker that built them.
+    :param xpath_expression:    the XPATH expression to be applied
+    :param documents:           an iterable of HTML strings (or bytes)
+    :param workers:             the number of worker processes (at least 1), defaults to the number of CPUs,
+                                and never more than the number of chunks
+    :param chunk_size:          the number of documents sent to a worker at once
+    :param parser:              the name of the BeautifulSoup parser to be used
+    :return:                    a list of XPATHDocumentResult objects, in the order of the input documents
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be a positive integer')
+    if workers is not None and workers < 1:
+        raise ValueError('workers must be a positive integer')
+
+    # check the expression before starting any worker
+    from xpath_bs import XPATH
+    XPATH.compile(xpath_expression)
+
+    # split the input into chunks
+    chunks = []
+    chunk = []
+    for i, html in enumerate(documents):
+        chunk.append((i, html))
+        if len(chunk) == chunk_size:
+            chunks.append(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        chunks.append(chunk)
+    if len(chunks) == 0:
+        return []
+
+    # evaluate, map preserves the order of the chunks
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    out = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for results in executor.map(_evaluate_chunk, [xpath_expression] * len(chunks), [parser] * len(chunks), chunks):
+            out.extend(results)
+    return out
@@ -0,0 +1,196 @@
+from xpath_profile import describe
+from xpath_syntax_tree import AttributeName, BooleanConstant, Comparison, LogicalAnd, LogicalNot, LogicalOr, NumberLiteral, \
+    Position, Predicate, SelectAll, SelectDescendants, SelectHTMLTag, SelectStar, StringLiteral
+
+
+class XPATHPlan:
+    """
+    This class holds the plan of an XPATH expression: the steps as parsed, the (cheaper, equivalent) steps that are
+    evaluated instead, and a description of every rewrite that turned the former into the latter.
+    """
+
+    def __init__(self, expression, original, steps, rewrites):
+        self.expression = expression
+        self.original = tuple(original)
+        self.steps = tuple(steps)
+        self.rewrites = list(rewrites)
+
+    def __repr__(self):
+        return 'XPATHPlan({!r}, {} steps, {} rewrites)'.format(self.expression, len(self.steps), len(self.rewrites))
+
+    def to_dict(self):
+        """
+        This function converts this plan into plain Python data
+        :return:    a dictionary
+        """
+        return {'expression': self.expression,
+                'original': [describe(n) for n in self.original],
+                'steps': [describe(n) for n in self.steps],
+                'rewrites': list(self.rewrites)}
+
+    def explain(self):
+        """
+        This function renders this plan as human-readable text
+        :return:    a string
+        """
+        lines = [self.expression]
+        for i, n in enumerate(self.steps):
+            lines.append('{:>4}  {}'.format(i, describe(n)))
+        for r in self.rewrites:
+            lines.append('      rewrite: {}'.format(r))
+        return '\n'.join(lines)
+
+
+class XPATHPlanner:
+    """
+    This class rewrites the steps of a parsed XPATH expression into cheaper, equivalent steps.
+    The rules are applied one after the other, each rule takes a list of steps and returns a new list of steps,
+    the syntax tree nodes of the parsed expression are never modified.
+    """
+
+    # the rules applied by default, in order
+    RULES = ('fold_constants', 'fuse_descendants', 'drop_stars')
+
+    def __init__(self, rules=None):
+        """
+        :param rules:   the names of the rules to be applied, in order (defaults to RULES)
+        """
+        self.rules = tuple(XPATHPlanner.RULES if rules is None else rules)
+        for r in self.rules:
+            if r not in XPATHPlanner.RULES:
+                raise ValueError('Unknown planner rule {}'.format(r))
+
+    def plan(self, expression, steps):
+        """
+        This function plans the evaluation of an XPATH expression
+        :param expression:  the XPATH expression
+        :param steps:       the syntax tree nodes of the expression, as parsed
+        :return:            an XPATHPlan
+        """
+        rewrites = []
+        out = list(steps)
+        for r in self.rules:
+            out = getattr(self, r)(out, rewrites)
+        return XPATHPlan(expression, steps, out, rewrites)
+
+    def fold_constants(self, steps, rewrites):
+        """
+        This rule evaluates predicates that do not depend on the node (such as '[1 = 1]') once, at compile time.
+        A predicate that is always true is removed, a predicate that is always false is replaced by a BooleanConstant.
+        :param steps:       the steps
+        :param rewrites:    the list to which a description of each rewrite is appended
+        :return:            the rewritten steps
+        """
+        out = []
+        for n in steps:
+            if not isinstance(n, Predicate) or isinstance(n, Position):
+                out.append(n)
+                continue
+            folded = XPATHPlanner._fold(n)
+            if folded is n:
+                out.append(n)
+                continue
+            if isinstance(folded, BooleanConstant) and folded.value:
+                rewrites.append('removed {}, which is always true'.format(describe(n)))
+                continue
+            rewrites.append('folded {} into {}'.format(describe(n), describe(folded)))
+            out.append(folded)
+        return out
+
+    @staticmethod
+    def _fold(n):
+        """
+        This function folds the constant sub-trees of a predicate
+        :param n:   the syntax tree node of the predicate
+        :return:    the node itself if nothing was folded, otherwise a new node
+        """
+
+        # comparisons of two literals (mismatched literals are still reported as a syntax error)
+        if isinstance(n, Comparison):
+            (r, l) = (n.children[0], n.children[1])
+            if isinstance(l, (NumberLiteral, StringLiteral)) and isinstance(r, (NumberLiteral, StringLiteral)):
+                n._check_arguments()
+                return BooleanConstant(bool(n.comparator(l.value, r.value)))
+            return n
+
+        # logical operators, an operand that is always true (or always false) decides or disappears
+        if isinstance(n, LogicalNot):
+            c = XPATHPlanner._fold(n.children[0])
+            if isinstance(c, BooleanConstant):
+                return BooleanConstant(not c.value)
+            return n if c is n.children[0] else LogicalNot().add_child(c)
+        if isinstance(n, (LogicalAnd, LogicalOr)):
+            conjunction = isinstance(n, LogicalAnd)
+            children = [XPATHPlanner._fold(c) for c in n.children]
+            for c in children:
+                if isinstance(c, BooleanConstant) and c.value != conjunction:
+                    return BooleanConstant(not conjunction)
+            remaining = [c for c in children if not isinstance(c, BooleanConstant)]
+            if len(remaining) == 0:
+                return BooleanConstant(conjunction)
+            if len(remaining) == 1:
+                return remaining[0]
+            if all(a is b for a, b in zip(children, n.children)):
+                return n
+            out = n.__class__()
+            for c in children:
+                out.add_child(c)
+            return out
+        return n
+
+    def fuse_descendants(self, steps, rewrites):
+        """
+        This rule fuses '//' with the tag name (or '*') that follows it, and with the attribute existence tests
+        ('[@attr]', '[@a and @b]') that directly follow the tag name, into a single SelectDescendants step,
+        so that the matching elements are searched for directly (e.g. with find_all(name, attrs=...)).
+        :param steps:       the steps
+        :param rewrites:    the list to which a description of each rewrite is appended
+        :return:            the rewritten steps
+        """
+        out = []
+        i = 0
+        while i < len(steps):
+            n = steps[i]
+            if n.__class__ != SelectAll or i + 1 >= len(steps) or not isinstance(steps[i + 1], (SelectHTMLTag, SelectStar)):
+                out.append(n)
+                i += 1
+                continue
+            tag_name = steps[i + 1].tag_name if isinstance(steps[i + 1], SelectHTMLTag) else None
+            j = i + 2
+            attribute_names = []
+            while j < len(steps) and XPATHPlanner._attribute_names(steps[j]) is not None:
+                attribute_names.extend(a for a in XPATHPlanner._attribute_names(steps[j]) if a not in attribute_names)
+                j += 1
+            fused = SelectDescendants(tag_name, attribute_names)
+            rewrites.append('fused {} into {}'.format(', '.join(describe(x) for x in steps[i:j]), describe(fused)))
+            out.append(fused)
+            i = j
+        return out
+
+    @staticmethod
+    def _attribute_names(n):
+        """
+        This function returns the attributes whose existence a predicate tests, if that is all it tests
+        :param n:   the syntax tree node of the predicate
+        :return:    a list of attribute names, or None
+        """
+        if isinstance(n, AttributeName):
+            return [n.value]
+        if isinstance(n, LogicalAnd) and all(isinstance(c, AttributeName) for c in n._operands()):
+            return [c.value for c in n._operands()]
+        return None
+
+    def drop_stars(self, steps, rewrites):
+        """
+        This rule removes '*' steps, which keep the node set as it is
+        :param steps:       the steps
+        :param rewrites:    the list to which a description of each rewrite is appended
+        :return:            the rewritten steps
+        """
+        out = []
+        for n in steps:
+            if isinstance(n, SelectStar):
+                rewrites.append('removed {}, which selects every element of its input'.format(describe(n)))
+                continue
+            out.append(n)
+        return out
@@ -0,0 +1,205 @@
+import time
+
+from xpath_adapter import BEAUTIFUL_SOUP
+from xpath_limits import LimitedAdapter
+from xpath_syntax_tree import LogicalAnd, LogicalNot, LogicalOr
+
+
+class XPATHStepRecord:
+    """
+    This class records the evaluation of a single step (or predicate sub-tree) of an XPATH expression.
+    """
+
+    def __init__(self, index, step, seconds, input_size, output_size, children=None):
+        self.index = index
+        self.step = step
+        self.description = describe(step)
+        self.seconds = seconds
+        self.input_size = input_size
+        self.output_size = output_size
+        self.children = children or []
+
+    def __repr__(self):
+        return 'XPATHStepRecord({}, {!r}, {:.6f}s, {} -> {})'.format(self.index, self.description, self.seconds, self.input_size, self.output_size)
+
+    def to_dict(self):
+        """
+        This function converts this record into plain Python data
+        :return:    a dictionary
+        """
+        return {
+            'index': self.index,
+            'step': self.description,
+            'seconds': self.seconds,
+            'input_size': self.input_size,
+            'output_size': self.output_size,
+            'children': [c.to_dict() for c in self.children],
+        }
+
+
+class XPATHTrace:
+    """
+    This class holds the step records of the evaluation of an XPATH expression.
+    """
+
+    def __init__(self, xpath_expression):
+        self.expression = xpath_expression
+        self.records = []
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def seconds(self):
+        """
+        This property returns the total evaluation time
+        :return:    the sum of the wall time of all steps, in seconds
+        """
+        return sum(r.seconds for r in self.records)
+
+    def slowest(self):
+        """
+        This function returns the record of the step that took the most time
+        :return:    an XPATHStepRecord, or None if no steps were recorded
+        """
+        return max(self.records, key=lambda r: r.seconds) if len(self.records) > 0 else None
+
+    def to_dict(self):
+        """
+        This function converts this trace into plain Python data (e.g. to be written as JSON)
+        :return:    a dictionary
+        """
+        return {'expression': self.expression, 'seconds': self.seconds, 'steps': [r.to_dict() for r in self.records]}
+
+    def explain(self):
+        """
+        This function renders this trace as a human-readable table
+        :return:    a string
+        """
+        lines = [self.expression, '{:>4}  {:<60} {:>12} {:>10} {:>10}'.format('step', 'expression', 'ms', 'in', 'out')]
+
+        def add(r, level):
+            lines.append('{:>4}  {:<60} {:>12.3f} {:>10} {:>10}'.format(r.index if level == 0 else '', '  ' * level + r.description, r.seconds * 1000, r.input_size, r.output_size))
+            for c in r.children:
+                add(c, level + 1)
+
+        for r in self.records:
+            add(r, 0)
+        lines.append('{:>4}  {:<60} {:>12.3f}'.format('', 'total', self.seconds * 1000))
+        return '\n'.join(lines)
+
+
+def describe(expression):
+    """
+    This function returns a short, human-readable description of an Expression
+    :param expression:  the Expression
+    :return:            a string
+    """
+    (name, attributes, _) = expression.signature()
+    arguments = ['{}={!r}'.format(k, v) for (k, v) in attributes] + [describe(c) for c in expression.children]
+    return '{}({})'.format(name, ', '.join(arguments))
+
+
+def _size(out):
+    """
+    This function returns the number of nodes (or strings) in the output of a step
+    :param out: the output of a step
+    :return:    the number of selected nodes
+    """
+    return len(out[0]) if isinstance(out, tuple) else len(out)
+
+
+def _tests_nodes(expression, adapter):
+    """
+    This function determines whether a predicate step is evaluated by testing each node of its input with the compiled
+    test, rather than (partly) from the attribute columns of the adapter
+    :param expression:  the predicate
+    :param adapter:     the TreeAdapter through which the nodes are accessed
+    :return:            True or False
+    """
+    operands = expression._operands() if isinstance(expression, LogicalAnd) else [expression]
+    return all(c.lookup(adapter) is None for c in operands)
+
+
+def _instrument(expression, index, adapter):
+    """
+    This function builds the test function of a predicate sub-tree, recording the time spent testing nodes,
+    and the number of nodes tested and selected. The operands of 'and', 'or' and 'not' are instrumented as well,
+    and tried in the same (short-circuiting) order as in the compiled test, so that each of them is only timed
+    on the nodes it is actually tested on.
+    :param expression:  the predicate sub-tree
+    :param index:       the index of the sub-tree among the operands of its parent
+    :param adapter:     the TreeAdapter through which the nodes are accessed
+    :return:            a tuple (test function, XPATHStepRecord)
+    """
+    record = XPATHStepRecord(index, expression, 0.0, 0, 0)
+    if isinstance(expression, (LogicalAnd, LogicalOr)):
+        operands = expression._operands()
+        instrumented = {id(c): _instrument(c, i, adapter) for i, c in enumerate(operands)}
+        record.children.extend(instrumented[id(c)][1] for c in operands)
+        tests = [instrumented[id(c)][0] for c in expression._ordered_operands()]
+        if isinstance(expression, LogicalAnd):
+            test = lambda x: all(t(x) for t in tests)
+        else:
+            test = lambda x: any(t(x) for t in tests)
+    elif isinstance(expression, LogicalNot):
+        (t, r) = _instrument(expression.children[0], 0, adapter)
+        record.children.append(r)
+        test = lambda x: not t(x)
+    else:
+        test = expression.test(adapter)
+
+    def timed(x):
+        start = time.perf_counter()
+        selected = test(x)
+        record.seconds += time.perf_counter() - start
+        record.input_size += 1
+        if selected:
+            record.output_size += 1
+        return selected
+
+    return (timed, record)
+
+
+def profile(steps, inp, trace, hook=None, offset=0, adapter=BEAUTIFUL_SOUP):
+    """
+    This function evaluates a chain of XPATH steps, recording wall time, input size and output size of each step.
+    The operands of an 'and', 'or' or 'not' step are recorded as its children, with the number of nodes each of them
+    was tested on, and the time spent testing them (which adds to the time of the step).
+    :param steps:   the syntax tree nodes to be evaluated
+    :param inp:     the input of the first step, a tuple (selected, rejected) nodes
+    :param trace:   the XPATHTrace to which the records are added
+    :param hook:    a function, called with each XPATHStepRecord as soon as its step has been evaluated
+    :param offset:  the index of the first step in the XPATH expression
+    :param adapter: the TreeAdapter through which the nodes are accessed, a LimitedAdapter enforces its limits
+                    on every step
+    :return:        the output of the last step
+    """
+    limited = isinstance(adapter, LimitedAdapter)
+    for i, n in enumerate(steps):
+        if limited:
+            adapter.begin_step()
+
+        # the operands of 'and', 'or' and 'not' are timed within the evaluation of the step,
+        # unless the step is answered from the attribute columns of the adapter
+        children = []
+        if isinstance(n, (LogicalAnd, LogicalOr, LogicalNot)) and _tests_nodes(n, adapter):
+            (test, record) = _instrument(n, offset + i, adapter)
+            children = record.children
+            start = time.perf_counter()
+            out = n._partition(inp[0], test)
+        else:
+            start = time.perf_counter()
+            out = n.evaluate(inp[0], inp[1], adapter)
+        seconds = time.perf_counter() - start
+        if limited:
+            adapter.end_step(out)
+        record = XPATHStepRecord(offset + i, n, seconds, len(inp[0]), _size(out), children)
+        trace.records.append(record)
+        if hook is not None:
+            hook(record)
+        inp = out
+    return inp
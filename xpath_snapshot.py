@@ -0,0 +1,320 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from types import MappingProxyType
+
+import bs4 as bs
+
+from xpath_adapter import TreeAdapter
+from xpath_text import TextIndex
+
+
+class AttributeColumn:
+    """
+    This class holds the values of a single attribute, for all nodes of a DocumentSnapshot that have it.
+    Equality is answered from a hash table, ranges and prefixes from a sorted index, both built on first use.
+    All methods return node numbers in ascending (document) order.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.nodes = array('i')
+        self.values = []
+        self._by_value = None
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def equal(self, value):
+        """
+        This function returns the nodes whose value is equal to a given value
+        :param value:   the value
+        :return:        a list of node numbers
+        """
+        if self._by_value is None:
+            by_value = {}
+            for n, v in zip(self.nodes, self.values):
+                by_value.setdefault(v, []).append(n)
+            self._by_value = by_value
+        return self._by_value.get(value, [])
+
+    def range(self, lower=None, upper=None, include_lower=True, include_upper=True, key=None):
+        """
+        This function returns the nodes whose value lies in a range
+        :param lower:           the lower bound, None if there is no lower bound
+        :param upper:           the upper bound, None if there is no upper bound
+        :param include_lower:   True if the lower bound is part of the range
+        :param include_upper:   True if the upper bound is part of the range
+        :param key:             a function that converts values before they are compared (e.g. to numbers),
+                                values that convert to NaN are never part of a range
+        :return:                a list of node numbers, or None if the values can not be ordered
+        """
+        index = self._index(key)
+        if index is None:
+            return None
+        (keys, nodes) = index
+        i = 0 if lower is None else (bisect_left if include_lower else bisect_right)(keys, lower)
+        j = len(keys) if upper is None else (bisect_right if include_upper else bisect_left)(keys, upper)
+        return sorted(nodes[i:j])
+
+    def prefix(self, prefix):
+        """
+        This function returns the nodes whose value starts with a given prefix
+        :param prefix:  the prefix
+        :return:        a list of node numbers, or None if not all values are strings
+        """
+        index = self._index(None)
+        if index is None:
+            return None
+        (keys, nodes) = index
+        i = bisect_left(keys, prefix)
+        j = i
+        while j < len(keys) and keys[j].startswith(prefix):
+            j += 1
+        return sorted(nodes[i:j])
+
+    def scan(self, test):
+        """
+        This function returns the nodes whose value passes a test, checking every value of this column
+        :param test:    a function that takes a value and returns True or False
+        :return:        a list of node numbers
+        """
+        return [n for n, v in zip(self.nodes, self.values) if test(v)]
+
+    def is_text(self):
+        """
+        This function checks whether all values of this column are strings (multi-valued attributes are not)
+        :return:    True if all values are strings, False otherwise
+        """
+        return self._index(None) is not None
+
+    def _index(self, key):
+        if key not in self._indexes:
+            if key is None:
+                pairs = sorted(zip(self.values, self.nodes)) if all(isinstance(v, str) for v in self.values) else None
+            else:
+                pairs = sorted((k, n) for k, n in zip(map(key, self.values), self.nodes) if k == k)
+            self._indexes[key] = None if pairs is None else ([k for k, _ in pairs], array('i', (n for _, n in pairs)))
+        return self._indexes[key]
+
+
+class DocumentSnapshot:
+    """
+    This class holds an immutable, compact copy of a (BeautifulSoup) document, for repeated querying.
+    Every element is numbered in document (pre-)order, the document node itself is number 0.
+    The tree is stored in array-backed columns (tag id, parent, first child, next sibling, and the number of the last
+    descendant), so that the descendants of node i are exactly the nodes i+1 up to ends[i].
+    Tag names, attribute names and attribute values are interned, the text of every node is held by a TextIndex.
+    Attribute values are also available per attribute, as columns, so that predicates can be answered without
+    testing every node.
+    """
+
+    def __init__(self, bs_doc):
+        self.tag_names = []
+        self.tags = array('i')
+        self.parents = array('i')
+        self.first_children = array('i')
+        self.next_siblings = array('i')
+        self.ends = array('i')
+        self._attributes = []
+        self._columns = None
+        self._by_tag = None
+
+        interned = {}
+        tag_ids = {}
+        empty = MappingProxyType({})
+
+        def intern(s):
+            if isinstance(s, list):
+                return tuple(interned.setdefault(x, x) for x in s)
+            return interned.setdefault(s, s)
+
+        def add(x, parent):
+            i = len(self.tags)
+            if x.name not in tag_ids:
+                tag_ids[x.name] = len(self.tag_names)
+                self.tag_names.append(x.name)
+            self.tags.append(tag_ids[x.name])
+            self.parents.append(parent)
+            self.first_children.append(-1)
+            self.next_siblings.append(-1)
+            self.ends.append(i)
+            self._attributes.append(MappingProxyType({intern(k): intern(v) for k, v in x.attrs.items()}) if len(x.attrs) > 0 else empty)
+            return i
+
+        def close(stack):
+            (_, i, _) = stack.pop(-1)
+            self.ends[i] = len(self.tags) - 1
+
+        # the document node
+        stack = [[bs_doc, add(bs_doc, -1), -1]]
+
+        # elements, in document order
+        for x in bs_doc.descendants:
+            if not isinstance(x, bs.Tag):
+                continue
+            while stack[-1][0] is not x.parent:
+                close(stack)
+            i = add(x, stack[-1][1])
+            if stack[-1][2] == -1:
+                self.first_children[stack[-1][1]] = i
+            else:
+                self.next_siblings[stack[-1][2]] = i
+            stack[-1][2] = i
+            stack.append([x, i, -1])
+        while len(stack) > 0:
+            close(stack)
+
+        self.text_index = TextIndex(bs_doc, by_node=False)
+        self.adapter = SnapshotAdapter(self)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def tag(self, i):
+        """
+        This function returns the tag name of a node
+        :param i:   the node number
+        :return:    the tag name ('[document]' for the document node)
+        """
+        return self.tag_names[self.tags[i]]
+
+    def attributes(self, i):
+        """
+        This function returns the attributes of a node
+        :param i:   the node number
+        :return:    a read-only mapping of attribute names to values (multi-valued attributes are tuples)
+        """
+        return self._attributes[i]
+
+    def text(self, i):
+        """
+        This function returns the text of a node, the way BeautifulSoup does
+        :param i:   the node number
+        :return:    a string
+        """
+        return self.text_index.text(i)
+
+    def column(self, name):
+        """
+        This function returns the values of an attribute, as a column
+        :param name:    the attribute name
+        :return:        an AttributeColumn (empty if no node has the attribute)
+        """
+        if self._columns is None:
+            columns = {}
+            for i, attrs in enumerate(self._attributes):
+                for k, v in attrs.items():
+                    if k not in columns:
+                        columns[k] = AttributeColumn(k)
+                    columns[k].nodes.append(i)
+                    columns[k].values.append(v)
+            self._columns = columns
+        return self._columns.get(name) or AttributeColumn(name)
+
+    def elements_by_tag(self, tag_name):
+        """
+        This function returns the nodes with a given tag name
+        :param tag_name:    the tag name
+        :return:            an array of node numbers, in ascending (document) order
+        """
+        if self._by_tag is None:
+            by_tag = [array('i') for _ in self.tag_names]
+            for i, t in enumerate(self.tags):
+                by_tag[t].append(i)
+            self._by_tag = dict(zip(self.tag_names, by_tag))
+        return self._by_tag.get(tag_name) or array('i')
+
+    def is_descendant(self, i, j):
+        """
+        This function checks whether a node is a descendant of another node
+        :param i:   the number of the descendant
+        :param j:   the number of the ancestor
+        :return:    True if node i is a descendant of node j, False otherwise
+        """
+        return j < i <= self.ends[j]
+
+
+class SnapshotAdapter(TreeAdapter):
+    """
+    This class implements the TreeAdapter for a DocumentSnapshot. Nodes are node numbers (int),
+    so node sets are lists of integers, and the descendants of a node are a range of integers.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+        # bound once, so that the per-node accessors skip the method lookup
+        self.attributes = snapshot._attributes.__getitem__
+        self.text = snapshot.text_index.text
+        self.text_contains = snapshot.text_index.contains
+        self.text_startswith = snapshot.text_index.startswith
+        self.text_endswith = snapshot.text_index.endswith
+        self.column = snapshot.column
+        names = snapshot.tag_names
+        tags = snapshot.tags
+        self.tag = lambda i: names[tags[i]]
+
+    def document(self, doc):
+        return 0
+
+    def identity(self, node):
+        return node
+
+    def children(self, node):
+        out = []
+        c = self.snapshot.first_children[node]
+        while c != -1:
+            out.append(c)
+            c = self.snapshot.next_siblings[c]
+        return out
+
+    def descendants(self, node):
+        return range(node + 1, self.snapshot.ends[node] + 1)
+
+    def iter_descendants(self, node):
+        return iter(range(node + 1, self.snapshot.ends[node] + 1))
+
+    def find_descendants(self, node, tag_name=None, attribute_names=()):
+
+        # the nodes with the tag name (or the first attribute) that lie in the range of descendants
+        if tag_name is not None:
+            candidates = self.snapshot.elements_by_tag(tag_name)
+        elif len(attribute_names) > 0:
+            candidates = self.snapshot.column(attribute_names[0]).nodes
+            attribute_names = attribute_names[1:]
+        else:
+            return self.descendants(node)
+        i = bisect_right(candidates, node)
+        j = bisect_right(candidates, self.snapshot.ends[node], i)
+        out = list(candidates[i:j])
+        attrs = self.attributes
+        for a in attribute_names:
+            out = [x for x in out if a in attrs(x)]
+        return out
+
+    def parent(self, node):
+        p = self.snapshot.parents[node]
+        return None if p == -1 else p
+
+    def following_siblings(self, node):
+        out = []
+        c = self.snapshot.next_siblings[node]
+        while c != -1:
+            out.append(c)
+            c = self.snapshot.next_siblings[c]
+        return out
+
+    def preceding_siblings(self, node):
+        p = self.snapshot.parents[node]
+        if p == -1:
+            return []
+        out = []
+        c = self.snapshot.first_children[p]
+        while c != node:
+            out.append(c)
+            c = self.snapshot.next_siblings[c]
+        return out
+
+    def sort(self, nodes):
+        return sorted(set(nodes))
@@ -0,0 +1,321 @@
+import codecs
+import mmap
+import xml.sax
+from collections import deque
+from html.parser import HTMLParser
+
+from bs4.builder import HTMLTreeBuilder
+
+from xpath_syntax_tree import AttributeName, Position, Predicate, SelectAll, SelectAttribute, SelectDescendants, \
+    SelectFromRootNode, SelectHTMLTag, SelectStar, SelectText, TextValue
+
+
+class StreamElement:
+    """
+    This class represents an element that was matched while streaming a document.
+    It only holds the tag name and attributes, the way BeautifulSoup does (name, attrs).
+    With the HTML parser, multi-valued attributes (such as class or rel) are split into lists of values, the way
+    BeautifulSoup splits them, so that predicates and attribute results match XPATH.xpath on a parsed document.
+    With the XML parser, attribute values are the raw strings.
+    """
+
+    __slots__ = ('name', 'attrs')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __repr__(self):
+        return 'StreamElement({!r}, {!r})'.format(self.name, self.attrs)
+
+
+class XPATHStreamMatcher:
+    """
+    This class evaluates the streamable subset of XPATH expressions against a sequence of start tag, end tag and
+    text events. Only the ancestor stack of the current element is kept in memory.
+    The streamable expressions are chains of '//tag[predicate]...' steps (predicates may only test the attributes
+    of the element itself), optionally followed by '/@attr' or '/text()'.
+    """
+
+    # elements that never have an end tag in HTML
+    VOID_ELEMENTS = {'area', 'base', 'basefont', 'br', 'col', 'command', 'embed', 'frame', 'hr', 'img', 'input',
+                     'isindex', 'keygen', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+    # elements whose content is not part of the text of their ancestors
+    RAW_TEXT_ELEMENTS = {'script', 'style', 'template'}
+
+    # elements in which whitespace-only text is kept as it is
+    PRESERVE_WHITESPACE_ELEMENTS = {'pre', 'textarea'}
+
+    def __init__(self, nodes):
+        """
+        :param nodes:   the syntax tree nodes of the XPATH expression
+        """
+        (self.groups, self.leaf) = XPATHStreamMatcher.analyze(nodes)
+        self.results = deque()
+        self._stack = []
+        self._text = []
+        self._collecting = 0
+
+    @staticmethod
+    def analyze(nodes):
+        """
+        This function checks whether an XPATH expression can be evaluated in streaming mode, and raises a ValueError if not
+        :param nodes:   the syntax tree nodes of the XPATH expression
+        :return:        a tuple (list of (tag name or None, list of tests), leaf) where leaf is None,
+                        ('attribute', name) or ('text', None)
+        """
+        groups = []
+        leaf = None
+        i = 0
+        while i < len(nodes):
+            n = nodes[i]
+            if isinstance(n, SelectDescendants) or \
+                    (n.__class__ == SelectAll and i + 1 < len(nodes) and isinstance(nodes[i + 1], (SelectHTMLTag, SelectStar))):
+                if isinstance(n, SelectDescendants):
+                    tag = n.tag_name
+                    tests = [n.matches()] if len(n.attribute_names) > 0 else []
+                    i += 1
+                else:
+                    tag = nodes[i + 1].tag_name if isinstance(nodes[i + 1], SelectHTMLTag) else None
+                    tests = []
+                    i += 2
+                while i < len(nodes) and isinstance(nodes[i], (Predicate, AttributeName)) and not isinstance(nodes[i], Position):
+
+                    # elements are tested on their start tag, before their text is known
+                    if _uses_text(nodes[i]):
+                        raise ValueError('Predicates on text() can not be evaluated in streaming mode')
+                    tests.append(nodes[i].test())
+                    i += 1
+                groups.append((tag, tests))
+                continue
+            if len(groups) > 0 and isinstance(n, SelectFromRootNode) and i + 2 == len(nodes):
+                if isinstance(nodes[i + 1], SelectAttribute):
+                    leaf = ('attribute', nodes[i + 1].attribute_name)
+                    break
+                if isinstance(nodes[i + 1], SelectText):
+                    leaf = ('text', None)
+                    break
+            raise ValueError('This XPATH expression can not be evaluated in streaming mode')
+        if len(groups) == 0:
+            raise ValueError('This XPATH expression can not be evaluated in streaming mode')
+        return (groups, leaf)
+
+    def _matches(self, group, element):
+        (tag, tests) = group
+        if tag is not None and element.name != tag:
+            return False
+        for t in tests:
+            if not t(element):
+                return False
+        return True
+
+    def start(self, name, attrs):
+        """
+        This function handles a start tag
+        :param name:    the tag name
+        :param attrs:   a dictionary of attributes
+        :return:        None
+        """
+        element = StreamElement(name, attrs)
+        level = self._stack[-1][1] if len(self._stack) > 0 else 0
+        n = len(self.groups)
+
+        # is this element a result
+        slot = None
+        if level >= n - 1 and self._matches(self.groups[n - 1], element):
+            if self.leaf is None:
+                self.results.append([element, True])
+            elif self.leaf[0] == 'attribute':
+                self.results.append([attrs.get(self.leaf[1], ''), True])
+            else:
+                slot = [None, False, len(self._text), []]
+                self.results.append(slot)
+                self._collecting += 1
+
+        # how many steps have been matched on the path to this element
+        if level < n and self._matches(self.groups[level], element):
+            level += 1
+        self._stack.append((name, level, slot))
+
+    def end(self, name):
+        """
+        This function handles an end tag, closing every element that was left open inside it
+        :param name:    the tag name
+        :return:        None
+        """
+        if not any(e[0] == name for e in self._stack):
+            return
+        while True:
+            (n, _, slot) = self._stack.pop(-1)
+            if slot is not None:
+                slot[0] = ''.join(self._text[slot[2]:]) + ''.join(slot[3])
+                slot[1] = True
+                self._collecting -= 1
+                if self._collecting == 0:
+                    self._text = []
+            if n == name:
+                return
+
+    def data(self, text):
+        """
+        This function handles text
+        :param text:    the text
+        :return:        None
+        """
+        if self._collecting == 0:
+            return
+
+        # like BeautifulSoup, collapse whitespace-only text to a single newline or space
+        if text.strip(' \t\n\r\f') == '' and not any(e[0] in XPATHStreamMatcher.PRESERVE_WHITESPACE_ELEMENTS for e in self._stack):
+            text = '\n' if '\n' in text else ' '
+        if len(self._stack) > 0 and self._stack[-1][0] in XPATHStreamMatcher.RAW_TEXT_ELEMENTS:
+            if self._stack[-1][2] is not None:
+                self._stack[-1][2][3].append(text)
+            return
+        self._text.append(text)
+
+    def close(self):
+        """
+        This function closes all elements that are still open at the end of the document
+        :return:        None
+        """
+        while len(self._stack) > 0:
+            self.end(self._stack[-1][0])
+
+    def ready(self):
+        """
+        This function returns the results that are complete, in document order
+        :return:    a generator of results
+        """
+        while len(self.results) > 0 and self.results[0][1]:
+            yield self.results.popleft()[0]
+
+
+class _HTMLEventParser(HTMLParser):
+
+    # the attributes BeautifulSoup splits into lists of values, per tag ('*' for every tag)
+    LIST_ATTRIBUTES = HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+
+    def __init__(self, matcher):
+        super().__init__(convert_charrefs=True)
+        self.matcher = matcher
+
+    def attributes(self, tag, attrs):
+        """
+        This function converts the attributes of a start tag the way BeautifulSoup does
+        :param tag:     the tag name
+        :param attrs:   a list of (name, value) tuples, the value is None for attributes without a value
+        :return:        a dictionary of attributes, multi-valued attributes are lists of values
+        """
+        result = {k: ('' if v is None else v) for (k, v) in attrs}
+        (every_tag, this_tag) = (self.LIST_ATTRIBUTES.get('*', ()), self.LIST_ATTRIBUTES.get(tag, ()))
+        for k in result:
+            if k in every_tag or k in this_tag:
+                result[k] = result[k].split()
+        return result
+
+    def handle_starttag(self, tag, attrs):
+        self.matcher.start(tag, self.attributes(tag, attrs))
+        if tag in XPATHStreamMatcher.VOID_ELEMENTS:
+            self.matcher.end(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.matcher.start(tag, self.attributes(tag, attrs))
+        self.matcher.end(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in XPATHStreamMatcher.VOID_ELEMENTS:
+            self.matcher.end(tag)
+
+    def handle_data(self, data):
+        self.matcher.data(data)
+
+
+class _XMLEventHandler(xml.sax.handler.ContentHandler):
+
+    def __init__(self, matcher):
+        super().__init__()
+        self.matcher = matcher
+
+    def startElement(self, name, attrs):
+        self.matcher.start(name, {k: attrs.getValue(k) for k in attrs.getNames()})
+
+    def endElement(self, name):
+        self.matcher.end(name)
+
+    def characters(self, content):
+        self.matcher.data(content)
+
+
+def _uses_text(node):
+    """
+    This function checks whether a predicate refers to the text of the node being tested
+    :param node:    the syntax tree node of the predicate
+    :return:        True if the predicate contains text(), False otherwise
+    """
+    return isinstance(node, TextValue) or any(_uses_text(c) for c in node.children)
+
+
+def _chunks(source, chunk_size):
+    """
+    This function reads a source in chunks
+    :param source:      a str, bytes, a memory-mapped file, or a file object (text or binary)
+    :param chunk_size:  the size of each chunk
+    :return:            a generator of str or bytes chunks
+    """
+    if isinstance(source, (str, bytes, bytearray, memoryview, mmap.mmap)):
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size]
+        return
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream(nodes, source, parser='html', encoding='utf-8', chunk_size=65536):
+    """
+    This function evaluates an XPATH expression while parsing a document, without building a tree.
+    The expression and the parser are checked before the generator is returned, a ValueError is raised
+    if the expression can not be streamed.
+    :param nodes:       the syntax tree nodes of the XPATH expression
+    :param source:      a str, bytes, a memory-mapped file, or a file object (text or binary)
+    :param parser:      'html' (html.parser) or 'xml' (xml.sax)
+    :param encoding:    the encoding of byte input (HTML only, XML documents declare their own encoding)
+    :param chunk_size:  the number of characters (or bytes) parsed at once
+    :return:            a generator of results (StreamElement objects, attribute values or text), in document order
+    """
+    if parser not in ('html', 'xml'):
+        raise ValueError('Unknown parser {}, expected \'html\' or \'xml\''.format(parser))
+    return _stream(XPATHStreamMatcher(nodes), source, parser, encoding, chunk_size)
+
+
+def _stream(matcher, source, parser, encoding, chunk_size):
+    """
+    This function feeds a document to a matcher, chunk by chunk
+    :param matcher:     an XPATHStreamMatcher
+    :param source:      a str, bytes, a memory-mapped file, or a file object (text or binary)
+    :param parser:      'html' (html.parser) or 'xml' (xml.sax)
+    :param encoding:    the encoding of byte input (HTML only)
+    :param chunk_size:  the number of characters (or bytes) parsed at once
+    :return:            a generator of results, in document order
+    """
+    if parser == 'html':
+        p = _HTMLEventParser(matcher)
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        for chunk in _chunks(source, chunk_size):
+            p.feed(chunk if isinstance(chunk, str) else decoder.decode(bytes(chunk)))
+            yield from matcher.ready()
+        p.feed(decoder.decode(b'', final=True))
+        p.close()
+    else:
+        p = xml.sax.make_parser()
+        p.setContentHandler(_XMLEventHandler(matcher))
+        for chunk in _chunks(source, chunk_size):
+            p.feed(chunk.encode('utf-8') if isinstance(chunk, str) else bytes(chunk))
+            yield from matcher.ready()
+        p.close()
+    matcher.close()
+    yield from matcher.ready()
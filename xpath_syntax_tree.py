@@ -1,5 +1,9 @@
+import heapq
+import operator
 import re
+from bisect import bisect_left
 
+from xpath_adapter import BEAUTIFUL_SOUP
 from xpath_tokenizer import XPATHTokenizer
 
 
@@ -23,15 +27,147 @@ class Expression:
         self.children.append(n)
         return self
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
         """
         This method evaluates the current Expression
         :param node_set_pos:    the nodes that were previously selected (the operating set of this Expression)
         :param node_set_neg:    the nodes that were previously rejected (useful for negation operator)
+        :param adapter:         the TreeAdapter through which the nodes are accessed
         :return:                a tuple (selected, rejected) nodes
         """
         pass
 
+    def signature(self):
+        """
+        This method returns a hashable description of this Expression and its children.
+        Two expressions with the same signature select the same nodes.
+        :return:    a tuple (class name, attributes, signatures of the children)
+        """
+        attributes = tuple(sorted((k, v) for k, v in vars(self).items() if k not in ('token', 'children', 'parent') and not k.startswith('_')))
+        return (self.__class__.__name__, attributes, tuple(c.signature() for c in self.children))
+
+    def test(self, adapter=BEAUTIFUL_SOUP):
+        """
+        This method returns a function that tests whether a single node is selected by this Expression,
+        when it is used as a predicate
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        a function that takes a node and returns True or False
+        """
+        raise SyntaxError('{} can not be used as a predicate in XPATH'.format(self.__class__.__name__))
+
+    def cost(self):
+        """
+        This method estimates the relative cost of testing a single node with this Expression, used as a predicate
+        :return:    a positive number
+        """
+        return 1.0
+
+    def selectivity(self):
+        """
+        This method estimates the fraction of nodes selected by this Expression, used as a predicate
+        :return:    a number between 0 and 1
+        """
+        return 0.5
+
+    def lookup(self, adapter=BEAUTIFUL_SOUP):
+        """
+        This method answers this Expression, used as a predicate, from the attribute columns of the adapter
+        rather than by testing every node
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        the node numbers of all nodes of the document selected by this Expression, in ascending order,
+                        or None if the adapter does not hold the columns needed
+        """
+        return None
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        """
+        This method evaluates the current Expression lazily
+        :param node_set:    an iterable of the nodes that were previously selected
+        :param adapter:     the TreeAdapter through which the nodes are accessed
+        :return:            a generator of the selected nodes (or strings, for leaf expressions)
+        """
+        out = self.evaluate(list(node_set), [], adapter)
+        if isinstance(out, tuple):
+            out = out[0]
+        for x in out:
+            yield x
+
+    def _filter(self, node_set, adapter):
+        """
+        This function splits a node set according to this Expression, used as a predicate
+        :param node_set:    the nodes to be split
+        :param adapter:     the TreeAdapter through which the nodes are accessed
+        :return:            a tuple (selected, rejected) nodes
+        """
+        selected = self.lookup(adapter)
+        if selected is not None:
+            return self._partition_sorted(node_set, selected)
+        return self._partition(node_set, self.test(adapter))
+
+    def _filter_lazy(self, node_set, adapter):
+        """
+        This function filters a node set lazily according to this Expression, used as a predicate
+        :param node_set:    an iterable of nodes
+        :param adapter:     the TreeAdapter through which the nodes are accessed
+        :return:            a generator of the selected nodes
+        """
+        selected = self.lookup(adapter)
+        if selected is not None:
+            selected = set(selected)
+            return (x for x in node_set if x in selected)
+        test = self.test(adapter)
+        return (x for x in node_set if test(x))
+
+    def _partition_sorted(self, node_set, selected):
+        """
+        This function splits a node set of node numbers, given the (ascending) node numbers to be selected.
+        A range of node numbers (such as the descendants of a node) is split by bisecting the selected nodes,
+        otherwise, if only a few nodes are selected, they are looked up in the node set by bisection.
+        In both cases the rejected nodes are copied slice by slice.
+        :param node_set:    the nodes to be split, a list or range of node numbers in ascending order
+        :param selected:    the node numbers to be selected, in ascending order
+        :return:            a tuple (selected, rejected) nodes, both in the order of the input node set
+        """
+        if isinstance(node_set, range) and node_set.step == 1:
+            pos = list(selected[bisect_left(selected, node_set.start):bisect_left(selected, node_set.stop)])
+            neg = []
+            prev = node_set.start
+            for x in pos:
+                neg.extend(range(prev, x))
+                prev = x + 1
+            neg.extend(range(prev, node_set.stop))
+            return (pos, neg)
+        if len(selected) * max(len(node_set), 2).bit_length() > len(node_set):
+            s = set(selected)
+            return self._partition(node_set, s.__contains__)
+        pos = []
+        neg = []
+        prev = 0
+        for x in selected:
+            i = bisect_left(node_set, x, prev)
+            if i < len(node_set) and node_set[i] == x:
+                neg.extend(node_set[prev:i])
+                pos.append(x)
+                prev = i + 1
+        neg.extend(node_set[prev:])
+        return (pos, neg)
+
+    def _partition(self, node_set, test):
+        """
+        This function splits a node set in a single pass
+        :param node_set:    the nodes to be split
+        :param test:        a function that returns True for every node that should be selected
+        :return:            a tuple (selected, rejected) nodes, both in the order of the input node set
+        """
+        pos = []
+        neg = []
+        for x in node_set:
+            if test(x):
+                pos.append(x)
+            else:
+                neg.append(x)
+        return (pos, neg)
+
 #
 # literals
 #
@@ -45,6 +181,23 @@ class AttributeName(Expression):
         super().__init__()
         self.value = txt[1:]
 
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+
+        # as a predicate on its own, an attribute name tests whether the attribute exists
+        return self._filter(node_set_pos, adapter)
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        return self._filter_lazy(node_set, adapter)
+
+    def test(self, adapter=BEAUTIFUL_SOUP):
+        a = self.value
+        attrs = adapter.attributes
+        return lambda x: a in attrs(x)
+
+    def lookup(self, adapter=BEAUTIFUL_SOUP):
+        column = adapter.column(self.value)
+        return None if column is None else column.nodes
+
 class StringLiteral(Expression):
     """
     This class represents a string literal. These are encased by single quotation marks.
@@ -63,6 +216,30 @@ class NumberLiteral(Expression):
         super().__init__()
         self.value = int(txt)
 
+class TextValue(Expression):
+    """
+    This class represents the function text() inside a predicate, i.e. the text of the node being tested
+    """
+
+    def __init__(self):
+        super().__init__()
+
+class FunctionPosition(Expression):
+    """
+    This class represents the 'position()' function. It only occurs inside positional predicates.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+class FunctionLast(Expression):
+    """
+    This class represents the 'last()' function. It only occurs inside positional predicates.
+    """
+
+    def __init__(self):
+        super().__init__()
+
 #
 # XPath uses path expressions to select nodes in an XML document.
 # The node is selected by following a path or steps.
@@ -77,9 +254,12 @@ class SelectFromRootNode(Expression):
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
         return (node_set_pos, node_set_neg)
 
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        return iter(node_set)
+
 class SelectAll(Expression):
     """
     This class handles the '//' token of an XPATH expression
@@ -88,23 +268,314 @@ class SelectAll(Expression):
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        if len(node_set_pos) == 1:
+            return (adapter.descendants(node_set_pos[0]), [])
         o = []
-        for x in node_set_pos:
-            for y in x.find_all():
-                o.append(y)
+        for x in self._independent_nodes(node_set_pos, adapter):
+            o.extend(adapter.descendants(x))
+        return (o, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+
+        # in document order, an ancestor is always seen before its descendants
+        identity = adapter.identity
+        seen = set()
+        for x in node_set:
+            k = identity(x)
+            skip = k in seen or SelectAll._has_ancestor_in(x, seen, adapter)
+            seen.add(k)
+            if not skip:
+                yield from adapter.iter_descendants(x)
+
+    def _independent_nodes(self, node_set, adapter):
+        """
+        This function skips every node that is a duplicate, or a descendant of another node in the node set.
+        The remaining nodes have disjoint subtrees, so their descendants are selected exactly once, in document order.
+        :param node_set:    the nodes that were previously selected, in document order
+        :param adapter:     the TreeAdapter through which the nodes are accessed
+        :return:            a generator of nodes
+        """
+        identity = adapter.identity
+        selected = set(identity(x) for x in node_set)
+        done = set()
+        for x in node_set:
+            k = identity(x)
+            if k in done or SelectAll._has_ancestor_in(x, selected, adapter):
+                continue
+            done.add(k)
+            yield x
+
+    @staticmethod
+    def _has_ancestor_in(node, keys, adapter):
+        """
+        This function checks whether any ancestor of a node is in a set of nodes
+        :param node:    the node
+        :param keys:    a set of node identities
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        True if an ancestor of the node is in the set, False otherwise
+        """
+        p = adapter.parent(node)
+        while p is not None:
+            if adapter.identity(p) in keys:
+                return True
+            p = adapter.parent(p)
+        return False
+
+class SelectDescendants(SelectAll):
+    """
+    This class selects the descendant elements of each node that have a given tag name and given attributes.
+    It is not produced by the parser, the planner fuses '//tag[@attr]' into it (see xpath_planner),
+    so that the matching descendants are searched for directly, rather than selecting all descendants first.
+    """
+
+    def __init__(self, tag_name=None, attribute_names=()):
+        """
+        :param tag_name:        the tag name, or None to select descendants with any tag name
+        :param attribute_names: the names of the attributes the descendants must have
+        """
+        super().__init__()
+        self.tag_name = tag_name
+        self.attribute_names = tuple(attribute_names)
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        if len(node_set_pos) == 1:
+            return (adapter.find_descendants(node_set_pos[0], self.tag_name, self.attribute_names), [])
+        o = []
+        for x in self._independent_nodes(node_set_pos, adapter):
+            o.extend(adapter.find_descendants(x, self.tag_name, self.attribute_names))
         return (o, [])
 
-class SelectStar(SelectAll):
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        match = self.matches(adapter)
+        return (x for x in super().iterate(node_set, adapter) if match(x))
+
+    def matches(self, adapter=BEAUTIFUL_SOUP):
+        """
+        This method returns a function that tests whether a single node has the tag name and attributes of this step
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        a function that takes a node and returns True or False
+        """
+        (t, names) = (self.tag_name, self.attribute_names)
+        (tag, attrs) = (adapter.tag, adapter.attributes)
+        return lambda x: (t is None or tag(x) == t) and all(a in attrs(x) for a in names)
+
+class SelectChildren(Expression):
+    """
+    This class handles the '/' token of an XPATH expression when it is followed by a tag name or '*',
+    and the 'child::' axis. It selects the child elements of each node.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        out = []
+        for x in node_set_pos:
+            out.extend(adapter.children(x))
+
+        # if one node is a descendant of another, their children are interleaved in document order
+        if len(node_set_pos) > 1 and SelectChildren._is_nested(node_set_pos, adapter):
+            out = adapter.sort(out)
+        return (out, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        return _scoped_children(node_set, adapter, lambda x: (x, None), adapter.children)
+
+    @staticmethod
+    def _is_nested(node_set, adapter):
+        """
+        This function checks whether any node of a node set is a descendant of another node of the node set
+        :param node_set:    the nodes
+        :param adapter:     the TreeAdapter through which the nodes are accessed
+        :return:            True if the node set contains nested nodes, False otherwise
+        """
+        keys = set(adapter.identity(x) for x in node_set)
+        return any(SelectAll._has_ancestor_in(x, keys, adapter) for x in node_set)
+
+def _scoped_children(node_set, adapter, scope, nodes):
+    """
+    This function lazily selects, in document order and without duplicates, nodes that are children of a 'scope' node
+    of each node of a node set: the children of each node ('/'), or the siblings that follow it (the children of its
+    parent). The scopes that are open form a chain of ancestors: before a node is reached, the scopes that do not
+    contain it are closed (their remaining children are selected), and the children of the innermost scope that
+    contains it are selected up to the child that contains it.
+    :param node_set:    an iterable of nodes, in document order
+    :param adapter:     the TreeAdapter through which the nodes are accessed
+    :param scope:       a function that takes a node, and returns a tuple (scope node, the child of the scope node
+                        up to which its children have been selected, or None), or None if the node has no scope
+    :param nodes:       a function that takes a node, and returns the children of its scope that are selected
+    :return:            a generator of nodes
+    """
+    identity = adapter.identity
+    parent = adapter.parent
+    stack = []
+    open_scopes = {}
+    for x in node_set:
+        s = scope(x)
+        if s is None:
+            continue
+
+        # the innermost open scope that contains x, and its child that contains x
+        enclosing = None
+        if len(stack) > 0:
+            c = x
+            p = parent(x)
+            while p is not None and identity(p) not in open_scopes:
+                c = p
+                p = parent(p)
+            if p is not None:
+                enclosing = open_scopes[identity(p)]
+        while len(stack) > 0 and stack[-1] is not enclosing:
+            entry = stack.pop()
+            del open_scopes[entry[0]]
+            yield from entry[1]
+        if enclosing is not None and enclosing[2] != identity(c):
+            k = identity(c)
+            for y in enclosing[1]:
+                yield y
+                if identity(y) == k:
+                    break
+            enclosing[2] = k
+
+        # the scope of x, unless it is already open
+        k = identity(s[0])
+        if k not in open_scopes:
+            entry = [k, iter(nodes(x)), None if s[1] is None else identity(s[1])]
+            stack.append(entry)
+            open_scopes[k] = entry
+    while len(stack) > 0:
+        yield from stack.pop()[1]
+
+class SelectParent(Expression):
+    """
+    This class handles the '..' token of an XPATH expression, and the 'parent::' axis
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        out = [p for p in (adapter.parent(x) for x in node_set_pos) if p is not None]
+        return (adapter.sort(out) if len(out) > 1 else out, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+
+        # a node that comes later may have a parent that comes earlier (an ancestor of the parents seen so far),
+        # so the parents are only put in order once the node set has been read
+        out = [p for p in (adapter.parent(x) for x in node_set) if p is not None]
+        yield from (adapter.sort(out) if len(out) > 1 else out)
+
+class SelectSelf(Expression):
+    """
+    This class handles the '.' token of an XPATH expression, and the 'self::' axis
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        return (node_set_pos, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        return iter(node_set)
+
+class SelectAncestors(Expression):
+    """
+    This class handles the 'ancestor::' axis of an XPATH expression. It selects the ancestor elements of each node,
+    (the document node itself is not selected), in document order.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        out = []
+        for x in node_set_pos:
+            p = adapter.parent(x)
+            while p is not None and adapter.parent(p) is not None:
+                out.append(p)
+                p = adapter.parent(p)
+        if len(node_set_pos) > 1:
+            return (adapter.sort(out), [])
+        out.reverse()
+        return (out, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+
+        # the ancestors of a node that were not selected for an earlier node all come after the nodes selected so far
+        identity = adapter.identity
+        selected = set()
+        for x in node_set:
+            out = []
+            p = adapter.parent(x)
+            while p is not None and adapter.parent(p) is not None and identity(p) not in selected:
+                out.append(p)
+                p = adapter.parent(p)
+            out.reverse()
+            selected.update(identity(p) for p in out)
+            yield from out
+
+class SelectFollowingSiblings(Expression):
+    """
+    This class handles the 'following-sibling::' axis of an XPATH expression
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        out = []
+        for x in node_set_pos:
+            out.extend(adapter.following_siblings(x))
+        return (adapter.sort(out) if len(node_set_pos) > 1 else out, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        parent = adapter.parent
+
+        def scope(x):
+            p = parent(x)
+            return None if p is None else (p, x)
+
+        return _scoped_children(node_set, adapter, scope, adapter.following_siblings)
+
+class SelectPrecedingSiblings(Expression):
+    """
+    This class handles the 'preceding-sibling::' axis of an XPATH expression
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        out = []
+        for x in node_set_pos:
+            out.extend(adapter.preceding_siblings(x))
+        return (adapter.sort(out) if len(node_set_pos) > 1 else out, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+
+        # the siblings that precede a node may come before the nodes selected for earlier nodes,
+        # so they are only put in order once the node set has been read
+        out = []
+        for x in node_set:
+            out.extend(adapter.preceding_siblings(x))
+        yield from (adapter.sort(out) if len(out) > 1 else out)
+
+class SelectStar(Expression):
     """
-    This class handles the '*' token of an XPATH expression
+    This class handles the '*' token of an XPATH expression.
+    It matches any element, so it keeps the node set as it is.
     """
 
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
-        return super().evaluate(node_set_pos, node_set_neg)
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        return (node_set_pos, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        return iter(node_set)
 
 class SelectHTMLTag(Expression):
     """
@@ -115,8 +586,13 @@ class SelectHTMLTag(Expression):
         super().__init__()
         self.tag_name = tag_name
 
-    def evaluate(self, node_set_pos, node_set_neg):
-        return ([x for x in node_set_pos if x.name == self.tag_name], [])
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        tag = adapter.tag
+        return ([x for x in node_set_pos if tag(x) == self.tag_name], [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        tag = adapter.tag
+        return (x for x in node_set if tag(x) == self.tag_name)
 
 class SelectText(Expression):
     """
@@ -126,8 +602,11 @@ class SelectText(Expression):
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
-        return [x.text for x in node_set_pos]
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        return [adapter.text(x) for x in node_set_pos]
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        return (adapter.text(x) for x in node_set)
 
 class SelectAttribute(Expression):
     """
@@ -138,8 +617,76 @@ class SelectAttribute(Expression):
         super().__init__()
         self.attribute_name =  attribute_name[1:]
 
-    def evaluate(self, node_set_pos, node_set_neg):
-        return [(x.attrs[self.attribute_name] if self.attribute_name in x.attrs else '') for x in node_set_pos]
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        return list(self.iterate(node_set_pos, adapter))
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        a = self.attribute_name
+        attrs = adapter.attributes
+
+        # multi-valued attributes are lists, as in BeautifulSoup (a DocumentSnapshot holds them as tuples)
+        return (list(v) if isinstance(v, tuple) else v for v in (attrs(x).get(a, '') for x in node_set))
+
+class LocationStep(Expression):
+    """
+    This class groups a step along an axis other than '/', '//' and 'child::' (its first child) with the node test and
+    predicates that follow it (its other children), when one of these predicates is positional.
+    The node test and predicates are evaluated on the nodes selected for each context node separately, so that
+    positions are counted per context node, in proximity order (reverse document order for the reverse axes
+    'ancestor::' and 'preceding-sibling::'). The union of the selected nodes is returned in document order.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    @property
+    def reverse(self):
+        return isinstance(self.children[0], (SelectAncestors, SelectPrecedingSiblings))
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        if len(node_set_pos) == 1:
+            return (self._select(node_set_pos[0], adapter), [])
+        identity = adapter.identity
+        out = []
+        seen = set()
+        for x in node_set_pos:
+            for y in self._select(x, adapter):
+                k = identity(y)
+                if k not in seen:
+                    seen.add(k)
+                    out.append(y)
+        return (adapter.sort(out) if len(out) > 1 else out, [])
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        node_set = list(node_set)
+        if len(node_set) != 1:
+            yield from self.evaluate(node_set, [], adapter)[0]
+            return
+
+        # a single context node, its node test and predicates are chained lazily (positions stop early)
+        group = self.children[0].evaluate(node_set, [], adapter)[0]
+        out = iter(list(reversed(group)) if self.reverse else group)
+        for n in self.children[1:]:
+            out = n.iterate(out, adapter)
+        if self.reverse:
+            out = reversed(list(out))
+        yield from out
+
+    def _select(self, node, adapter):
+        """
+        This function evaluates this step for a single context node
+        :param node:    the context node
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        the selected nodes, in document order
+        """
+        group = self.children[0].evaluate([node], [], adapter)[0]
+        inp = (list(reversed(group)) if self.reverse else list(group), [])
+        for n in self.children[1:]:
+            inp = n.evaluate(inp[0], inp[1], adapter)
+        out = list(inp[0])
+        if self.reverse:
+            out.reverse()
+        return out
 
 #
 # Predicates are used to find a specific node or a node that contains a specific value.
@@ -151,11 +698,81 @@ class Predicate(Expression):
     def __init__(self):
         super().__init__()
 
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        return self._filter(node_set_pos, adapter)
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        return self._filter_lazy(node_set, adapter)
+
+    # the number of adapters for which compiled tests are kept
+    CACHED_TESTS = 8
+
+    def test(self, adapter=BEAUTIFUL_SOUP):
+        """
+        This method returns the per-node test function of this predicate, as provided by the adapter
+        (see TreeAdapter.test and compiled_test)
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        a function that takes a node and returns True if the node is selected by this predicate
+        """
+        return adapter.test(self)
+
+    def compiled_test(self, adapter):
+        """
+        This method returns the per-node test function of this predicate, compiled for an adapter.
+        The test is compiled (and its arguments are checked) on first use with an adapter, and kept for the
+        most recently used adapters, so that evaluations through different adapters (e.g. in different threads)
+        do not evict each other's tests.
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        a function that takes a node and returns True if the node is selected by this predicate
+        """
+        tests = self.__dict__.get('_tests')
+        if tests is None:
+            tests = self._tests = {}
+        t = tests.get(id(adapter))
+        if t is None or t[0] is not adapter:
+            t = (adapter, self._compile(adapter))
+            tests[id(adapter)] = t
+            if len(tests) > Predicate.CACHED_TESTS:
+                for k in list(tests)[:len(tests) - Predicate.CACHED_TESTS]:
+                    tests.pop(k, None)
+        return t[1]
+
+    def _compile(self, adapter):
+        """
+        This method builds the per-node test function of this predicate
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        a function that takes a node and returns True if the node is selected by this predicate
+        """
+        raise NotImplementedError()
+
+def _to_number(value):
+    """
+    This function converts an attribute value to a number, the way XPATH does
+    :param value:   the attribute value
+    :return:        a float, NaN if the value is not a number
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def _is_literal(node):
+    return isinstance(node, (NumberLiteral, StringLiteral))
+
 class Comparison(Predicate):
     """
     This is a common base class for comparison operators in the XPATH language
     """
 
+    # the Python operator implementing this comparison, and the fraction of nodes it typically selects,
+    # set by each subclass
+    comparator = None
+    estimated_selectivity = 0.5
+
+    # the operator to be used when the arguments are swapped
+    mirrored = {operator.gt: operator.lt, operator.ge: operator.le, operator.lt: operator.gt, operator.le: operator.ge,
+                operator.eq: operator.eq, operator.ne: operator.ne}
+
     def __init__(self):
         super().__init__()
 
@@ -165,90 +782,132 @@ class Comparison(Predicate):
         l = self.children[1]
 
         # exceptions
-        if l.__class__.__name__ not in ['AttributeName', 'NumberLiteral', 'StringLiteral']:
+        if not isinstance(l, (AttributeName, NumberLiteral, StringLiteral, TextValue)):
             raise SyntaxError('Invalid arguments for comparison operator in XPATH')
-        if r.__class__.__name__ not in ['AttributeName', 'NumberLiteral', 'StringLiteral']:
+        if not isinstance(r, (AttributeName, NumberLiteral, StringLiteral, TextValue)):
             raise SyntaxError('Invalid arguments for comparison operator in XPATH')
-        if l.__class__.__name__  == 'NumberLiteral' and r.__class__.__name__  == 'StringLiteral':
+        if (isinstance(l, TextValue) or isinstance(r, TextValue)) and not (_is_literal(l) or _is_literal(r)):
+            raise SyntaxError('Invalid arguments for comparison operator in XPATH. text() can only be compared to a string or a number.')
+        if isinstance(l, NumberLiteral) and isinstance(r, StringLiteral):
             raise SyntaxError('Mismatched operands for comparison in XPATH. Can not compare str and float.')
-        if l.__class__.__name__  == 'StringLiteral' and r.__class__.__name__  == 'NumberLiteral':
+        if isinstance(l, StringLiteral) and isinstance(r, NumberLiteral):
             raise SyntaxError('Mismatched operands for comparison in XPATH. Can not compare str and float.')
 
+    def _compile(self, adapter):
 
-class GreaterThan(Comparison):
-    """
-    This class implements the 'greater than' operator
-    """
-
-    def __init__(self):
-        super().__init__()
-
-    def evaluate(self, node_set_pos, node_set_neg):
-
-        super()._check_arguments()
+        self._check_arguments()
+        op = self.comparator
+        attrs = adapter.attributes
 
         # literal arguments only
         r = self.children[0]
         l = self.children[1]
-        if l.__class__.__name__ != 'AttributeName' and l.__class__.__name__ != 'AttributeName':
-            if l.value > r.value:
-                return (node_set_pos, node_set_neg)
-            else:
-                return ([], node_set_pos)
+        if _is_literal(l) and _is_literal(r):
+            out = op(l.value, r.value)
+            return lambda x: out
+
+        # one of the arguments is text(), numbers are compared as numbers
+        if isinstance(l, TextValue) or isinstance(r, TextValue):
+            text = adapter.text
+            if isinstance(l, TextValue):
+                v = r.value
+                if isinstance(r, NumberLiteral):
+                    return lambda x: op(_to_number(text(x)), v)
+                return lambda x: op(text(x), v)
+            v = l.value
+            if isinstance(l, NumberLiteral):
+                return lambda x: op(v, _to_number(text(x)))
+            return lambda x: op(v, text(x))
 
         # both arguments are an attribute name
-        if l.__class__.__name__ == r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and r.value in x.attrs and x.attrs[l.value] > x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
-        # one of the arguments is an attribute name
-        if l.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and x.attrs[l.value] > r.value)]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-        if r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (r.value in x.attrs and l.value > x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
+        if isinstance(l, AttributeName) and isinstance(r, AttributeName):
+            a = l.value
+            b = r.value
+            return lambda x: a in attrs(x) and b in attrs(x) and op(attrs(x)[a], attrs(x)[b])
+
+        # one of the arguments is an attribute name, numbers are compared as numbers
+        if isinstance(l, AttributeName):
+            a = l.value
+            v = r.value
+            if isinstance(r, NumberLiteral):
+                return lambda x: a in attrs(x) and op(_to_number(attrs(x)[a]), v)
+            return lambda x: a in attrs(x) and op(attrs(x)[a], v)
+        a = r.value
+        v = l.value
+        if isinstance(l, NumberLiteral):
+            return lambda x: a in attrs(x) and op(v, _to_number(attrs(x)[a]))
+        return lambda x: a in attrs(x) and op(v, attrs(x)[a])
+
+    def lookup(self, adapter=BEAUTIFUL_SOUP):
+
+        self._check_arguments()
+        op = self.comparator
+
+        # exactly one of the arguments must be an attribute name, 'v < @a' is looked up as '@a > v'
+        r = self.children[0]
+        l = self.children[1]
+        if isinstance(l, AttributeName) == isinstance(r, AttributeName):
+            return None
+        if isinstance(l, AttributeName):
+            (a, v) = (l.value, r)
+        else:
+            (a, v, op) = (r.value, l, Comparison.mirrored[op])
+        column = adapter.column(a)
+        if column is None:
+            return None
+
+        # numbers are compared as numbers
+        key = _to_number if isinstance(v, NumberLiteral) else None
+        v = v.value
+        if op is operator.eq or op is operator.ne:
+            equal = column.equal(v) if key is None else column.range(v, v, key=key)
+            if op is operator.eq or equal is None:
+                return equal
+            equal = set(equal)
+            return [x for x in column.nodes if x not in equal]
+        if op is operator.gt or op is operator.ge:
+            return column.range(lower=v, include_lower=op is operator.ge, key=key)
+        return column.range(upper=v, include_upper=op is operator.le, key=key)
+
+    def cost(self):
+        (r, l) = (self.children[0], self.children[1])
+        if _is_literal(l) and _is_literal(r):
+            return 0.0
+        if isinstance(l, TextValue) or isinstance(r, TextValue):
+            return 5.0
+        if isinstance(l, NumberLiteral) or isinstance(r, NumberLiteral):
+            return 2.0
+        return 2.0 if isinstance(l, AttributeName) and isinstance(r, AttributeName) else 1.0
+
+    def selectivity(self):
+        (r, l) = (self.children[0], self.children[1])
+        if _is_literal(l) and _is_literal(r):
+            return 1.0 if self.comparator(l.value, r.value) else 0.0
+        return self.estimated_selectivity
 
 
-class GreaterThanOrEqual(Comparison):
+class GreaterThan(Comparison):
     """
-    This class implements the 'greater than or equal' operator
+    This class implements the 'greater than' operator
     """
 
+    comparator = operator.gt
+    estimated_selectivity = 1 / 3
+
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
-
-        super()._check_arguments()
 
-        # literal arguments only
-        r = self.children[0]
-        l = self.children[1]
-        if l.__class__.__name__ != 'AttributeName' and l.__class__.__name__ != 'AttributeName':
-            if l.value >= r.value:
-                return (node_set_pos, node_set_neg)
-            else:
-                return ([], node_set_pos)
+class GreaterThanOrEqual(Comparison):
+    """
+    This class implements the 'greater than or equal' operator
+    """
 
-        # both arguments are an attribute name
-        if l.__class__.__name__ == r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and r.value in x.attrs and x.attrs[l.value] >= x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
+    comparator = operator.ge
+    estimated_selectivity = 1 / 3
 
-        # one of the arguments is an attribute name
-        if l.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and x.attrs[l.value] >= r.value)]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-        if r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (r.value in x.attrs and l.value >= x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
+    def __init__(self):
+        super().__init__()
 
 
 class SmallerThan(Comparison):
@@ -256,156 +915,67 @@ class SmallerThan(Comparison):
     This class implements the 'smaller than' operator
     """
 
+    comparator = operator.lt
+    estimated_selectivity = 1 / 3
+
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
-
-        super()._check_arguments()
-
-        # literal arguments only
-        r = self.children[0]
-        l = self.children[1]
-        if l.__class__.__name__ != 'AttributeName' and l.__class__.__name__ != 'AttributeName':
-            if l.value < r.value:
-                return (node_set_pos, node_set_neg)
-            else:
-                return ([], node_set_pos)
-
-        # both arguments are an attribute name
-        if l.__class__.__name__ == r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and r.value in x.attrs and x.attrs[l.value] < x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
-        # one of the arguments is an attribute name
-        if l.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and x.attrs[l.value] < r.value)]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-        if r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (r.value in x.attrs and l.value < x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
 
 class SmallerThanOrEqual(Comparison):
     """
     This class implements the 'smaller than or equal' operator
     """
 
+    comparator = operator.le
+    estimated_selectivity = 1 / 3
+
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
-
-        super()._check_arguments()
-
-        # literal arguments only
-        r = self.children[0]
-        l = self.children[1]
-        if l.__class__.__name__ != 'AttributeName' and l.__class__.__name__ != 'AttributeName':
-            if l.value <= r.value:
-                return (node_set_pos, node_set_neg)
-            else:
-                return ([], node_set_pos)
-
-        # both arguments are an attribute name
-        if l.__class__.__name__ == r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and r.value in x.attrs and x.attrs[l.value] <= x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
-        # one of the arguments is an attribute name
-        if l.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and x.attrs[l.value] <= r.value)]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-        if r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (r.value in x.attrs and l.value <= x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
 
 class Equal(Comparison):
     """
     This class implements the equality operator
     """
 
+    comparator = operator.eq
+    estimated_selectivity = 0.1
+
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
-
-        super()._check_arguments()
-
-        # literal arguments only
-        r = self.children[0]
-        l = self.children[1]
-        if l.__class__.__name__ != 'AttributeName' and l.__class__.__name__ != 'AttributeName':
-            if l.value == r.value:
-                return (node_set_pos, node_set_neg)
-            else:
-                return ([], node_set_pos)
-
-        # both arguments are an attribute name
-        if l.__class__.__name__ == r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and r.value in x.attrs and x.attrs[l.value] == x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
-        # one of the arguments is an attribute name
-        if l.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and x.attrs[l.value] == r.value)]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-        if r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (r.value in x.attrs and l.value == x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
 
 class NotEqual(Comparison):
     """
     This class implements the inequality operator
     """
 
+    comparator = operator.ne
+    estimated_selectivity = 0.9
+
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
-
-        super()._check_arguments()
-
-        # literal arguments only
-        r = self.children[0]
-        l = self.children[1]
-        if l.__class__.__name__ != 'AttributeName' and l.__class__.__name__ != 'AttributeName':
-            if l.value != r.value:
-                return (node_set_pos, node_set_neg)
-            else:
-                return ([], node_set_pos)
-
-        # both arguments are an attribute name
-        if l.__class__.__name__ == r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and r.value in x.attrs and x.attrs[l.value] != x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
-        # one of the arguments is an attribute name
-        if l.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (l.value in x.attrs and x.attrs[l.value] != r.value)]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-        if r.__class__.__name__ == 'AttributeName':
-            pos = [x for x in node_set_pos if (r.value in x.attrs and l.value != x.attrs[r.value])]
-            neg = [x for x in node_set_pos if x not in pos]
-            return (pos, neg)
-
 #
 # logic predicates
 #
 
+def _chain(tests, conjunction):
+    """
+    This function combines test functions into a single, short-circuiting test function
+    :param tests:       the test functions, in the order in which they should be tried
+    :param conjunction: True to combine the tests with 'and', False to combine them with 'or'
+    :return:            a function that takes a node and returns True or False
+    """
+    out = tests[-1]
+    for t in reversed(tests[:-1]):
+        if conjunction:
+            out = (lambda t, u: lambda x: t(x) and u(x))(t, out)
+        else:
+            out = (lambda t, u: lambda x: t(x) or u(x))(t, out)
+    return out
+
 class LogicalAnd(Predicate):
     """
     This class implements the 'AND' operator
@@ -414,15 +984,94 @@ class LogicalAnd(Predicate):
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def _compile(self, adapter):
+        return _chain([c.test(adapter) for c in self._ordered_operands()], True)
+
+    def lookup(self, adapter=BEAUTIFUL_SOUP):
+
+        # all operands must be looked up, otherwise the others are tested on the input node set only (see _filter)
+        (selected, tests) = self._lookups(adapter)
+        if len(selected) == 0 or len(tests) > 0:
+            return None
+        out = set(selected[0])
+        for x in selected[1:]:
+            out.intersection_update(x)
+        return sorted(out)
+
+    def _filter(self, node_set, adapter):
+
+        # narrow the input node set down with the operands that can be looked up, shortest column first,
+        # and test the other operands on the nodes that remain
+        (selected, tests) = self._lookups(adapter)
+        if len(selected) == 0:
+            return self._partition(node_set, self.test(adapter))
+        pos = node_set
+        neg = []
+        for x in selected:
+            (pos, rejected) = self._partition_sorted(pos, x)
+            neg.append(rejected)
+        if len(tests) > 0:
+            (pos, rejected) = self._partition(pos, _chain(tests, True))
+            neg.append(rejected)
+        return (pos, neg[0] if len(neg) == 1 else list(heapq.merge(*neg)))
+
+    def _filter_lazy(self, node_set, adapter):
+        (selected, tests) = self._lookups(adapter)
+        if len(selected) == 0:
+            test = self.test(adapter)
+        else:
+            test = _chain([set(x).__contains__ for x in selected] + tests, True)
+        return (x for x in node_set if test(x))
+
+    def _lookups(self, adapter):
+        """
+        This method looks up the operands of this chain of 'AND' operators that can be answered from the attribute
+        columns of the adapter
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        a tuple (node numbers selected by each operand that can be looked up, shortest first,
+                        test functions of the other operands, cheapest and most selective first)
+        """
+        selected = []
+        tests = []
+        for c in self._ordered_operands():
+            x = c.lookup(adapter)
+            if x is None:
+                tests.append(c.test(adapter))
+            else:
+                selected.append(x)
+        return (sorted(selected, key=len), tests)
 
-        (a,b) = self.children[0].evaluate(node_set_pos, node_set_neg)
-        (c,d) = self.children[0].evaluate(node_set_pos, node_set_neg)
+    def _operands(self):
+        """
+        This method returns the operands of a chain of 'AND' operators
+        :return:    a list of Expressions, from left to right
+        """
+        out = []
+        for c in (self.children[1], self.children[0]):
+            out.extend(c._operands() if isinstance(c, LogicalAnd) else [c])
+        return out
 
-        # return
-        pos = [x for x in a if x in c]
-        neg = list(set([x for x in (a+b+c+d) if x not in pos]))
-        return (pos, neg)
+    def _ordered_operands(self):
+        """
+        This method returns the operands of a chain of 'AND' operators, in the order in which they are tested:
+        cheap and selective operands first, so that the others are tested on as few nodes as possible
+        :return:    a list of Expressions
+        """
+        return sorted(self._operands(), key=lambda c: c.cost() / max(1.0 - c.selectivity(), 1e-6))
+
+    def cost(self):
+        out = 0.0
+        fraction = 1.0
+        for c in self._operands():
+            out += fraction * c.cost()
+            fraction *= c.selectivity()
+        return out
+
+    def selectivity(self):
+        out = 1.0
+        for c in self._operands():
+            out *= c.selectivity()
+        return out
 
 class LogicalOr(Predicate):
     """
@@ -432,15 +1081,51 @@ class LogicalOr(Predicate):
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def _compile(self, adapter):
+        return _chain([c.test(adapter) for c in self._ordered_operands()], False)
 
-        (a, b) = self.children[0].evaluate(node_set_pos, node_set_neg)
-        (c, d) = self.children[0].evaluate(node_set_pos, node_set_neg)
+    def lookup(self, adapter=BEAUTIFUL_SOUP):
 
-        # return
-        pos = list(set(c) | set(a))
-        neg = list(set([x for x in (a+b+c+d) if x not in pos]))
-        return (pos, neg)
+        # all operands must be looked up, otherwise every node has to be tested anyway
+        out = set()
+        for c in self._operands():
+            x = c.lookup(adapter)
+            if x is None:
+                return None
+            out.update(x)
+        return sorted(out)
+
+    def _operands(self):
+        """
+        This method returns the operands of a chain of 'OR' operators
+        :return:    a list of Expressions, from left to right
+        """
+        out = []
+        for c in (self.children[1], self.children[0]):
+            out.extend(c._operands() if isinstance(c, LogicalOr) else [c])
+        return out
+
+    def _ordered_operands(self):
+        """
+        This method returns the operands of a chain of 'OR' operators, in the order in which they are tested:
+        cheap operands that are likely to be true first, so that the others are tested on as few nodes as possible
+        :return:    a list of Expressions
+        """
+        return sorted(self._operands(), key=lambda c: c.cost() / max(c.selectivity(), 1e-6))
+
+    def cost(self):
+        out = 0.0
+        fraction = 1.0
+        for c in self._operands():
+            out += fraction * c.cost()
+            fraction *= 1.0 - c.selectivity()
+        return out
+
+    def selectivity(self):
+        out = 1.0
+        for c in self._operands():
+            out *= 1.0 - c.selectivity()
+        return 1.0 - out
 
 class LogicalNot(Predicate):
     """
@@ -450,114 +1135,351 @@ class LogicalNot(Predicate):
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
-        return (node_set_neg, node_set_pos)
+    def _compile(self, adapter):
+        t = self.children[0].test(adapter)
+        return lambda x: not t(x)
+
+    def cost(self):
+        return self.children[0].cost()
+
+    def selectivity(self):
+        return 1.0 - self.children[0].selectivity()
+
+#
+# constant predicates
+#
+
+class BooleanConstant(Predicate):
+    """
+    This class implements a predicate whose value does not depend on the node, such as a comparison of two literals.
+    It is not produced by the parser, the planner folds constant predicates into it (see xpath_planner).
+    """
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        return (list(node_set_pos), []) if self.value else ([], list(node_set_pos))
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+        return iter(node_set) if self.value else iter(())
+
+    def _compile(self, adapter):
+        v = self.value
+        return lambda x: v
+
+    def cost(self):
+        return 0.0
+
+    def selectivity(self):
+        return 1.0 if self.value else 0.0
+
+#
+# positional predicates
+#
+
+class Position(Predicate):
+    """
+    This class implements positional predicates, such as '[1]', '[last()]' and '[position() < 3]'.
+    Positions are counted (starting at 1) in document order, for each context node of the step the predicate belongs to.
+    For '/', '//' and 'child::' steps the context node of an element is its parent, so positions are counted among the
+    elements of the node set that share a parent (per_parent). Steps along other axes are grouped by a LocationStep,
+    which evaluates this predicate on the node set of each context node separately.
+    Lazily evaluated, a LocationStep stops walking the nodes of a context node once the last position needed
+    (see stop) is reached. Positions counted per parent can not end a walk: once a parent has its first '//table[1]',
+    the subtrees of its later tables may still hold tables that are the first of their own parent, so only the
+    consumer of the results (e.g. XPATHResultIterator.first) can end it.
+    """
+
+    comparators = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+    def __init__(self, comparator, value, per_parent=False):
+        """
+        :param comparator:  the comparison between position() and value, one of '=', '!=', '<', '<=', '>', '>='
+        :param value:       a position (int), or 'last'
+        :param per_parent:  True if positions are counted separately among the nodes that share a parent,
+                            False if they are counted in the entire node set
+        """
+        super().__init__()
+        self.comparator = comparator
+        self.value = value
+        self.per_parent = per_parent
+
+    def evaluate(self, node_set_pos, node_set_neg, adapter=BEAUTIFUL_SOUP):
+        op = Position.comparators[self.comparator]
+        pos = []
+        neg = []
+        if not self.per_parent:
+            v = len(node_set_pos) if self.value == 'last' else self.value
+            for i, x in enumerate(node_set_pos, 1):
+                if op(i, v):
+                    pos.append(x)
+                else:
+                    neg.append(x)
+            return (pos, neg)
+
+        # the size of each group is only needed for last()
+        group = self._group(adapter)
+        sizes = None
+        if self.value == 'last':
+            sizes = {}
+            for x in node_set_pos:
+                k = group(x)
+                sizes[k] = sizes.get(k, 0) + 1
+        counts = {}
+        for x in node_set_pos:
+            k = group(x)
+            i = counts.get(k, 0) + 1
+            counts[k] = i
+            if op(i, self.value if sizes is None else sizes[k]):
+                pos.append(x)
+            else:
+                neg.append(x)
+        return (pos, neg)
+
+    def iterate(self, node_set, adapter=BEAUTIFUL_SOUP):
+
+        # last() is only known once the entire node set has been seen
+        if self.value == 'last':
+            for x in self.evaluate(list(node_set), [], adapter)[0]:
+                yield x
+            return
+
+        # otherwise, stop as soon as no further position can match
+        # (per parent, a group that is complete only rejects its remaining nodes, other groups may follow)
+        op = Position.comparators[self.comparator]
+        stop = self.stop()
+        if not self.per_parent:
+            for i, x in enumerate(node_set, 1):
+                if op(i, self.value):
+                    yield x
+                if stop is not None and i >= stop:
+                    return
+            return
+        group = self._group(adapter)
+        counts = {}
+        for x in node_set:
+            k = group(x)
+            i = counts.get(k, 0) + 1
+            counts[k] = i
+            if (stop is None or i <= stop) and op(i, self.value):
+                yield x
+
+    def _group(self, adapter):
+        """
+        This function returns the function that maps a node to the group in which its position is counted
+        :param adapter: the TreeAdapter through which the nodes are accessed
+        :return:        a function that takes a node and returns the identity of its parent
+        """
+        (parent, identity) = (adapter.parent, adapter.identity)
+
+        def group(x):
+            p = parent(x)
+            return None if p is None else identity(p)
+        return group
+
+    def stop(self):
+        """
+        This method returns the last position that can be selected by this predicate
+        :return:    a position, or None if there is no such position
+        """
+        if self.value == 'last' or self.comparator in ['!=', '>', '>=']:
+            return None
+        return self.value - 1 if self.comparator == '<' else self.value
+
+    def test(self, adapter=BEAUTIFUL_SOUP):
+        raise SyntaxError('Positional predicates can not be combined with other predicates in XPATH')
+
+    def cost(self):
+        return 0.0
 
 #
 # text-related predicates
 #
 
-class TextContains(Predicate):
+class TextPredicate(Predicate):
+    """
+    This is a common base class for the text-related predicates, that compare an attribute (or text()) to a string
+    """
 
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def _arguments(self):
+        """
+        This method checks the arguments of this predicate
+        :return:    a tuple (attribute name, string), the attribute name is None for text()
+        """
+        for (a, b) in [(self.children[0], self.children[1]), (self.children[1], self.children[0])]:
+            if isinstance(a, AttributeName) and isinstance(b, StringLiteral):
+                return (a.value, b.value)
+            if isinstance(a, TextValue) and isinstance(b, StringLiteral):
+                return (None, b.value)
+        raise SyntaxError('Invalid arguments for text function in XPATH. Expected an attribute (or text()) and a string.')
+
+    def cost(self):
 
-        # nodes where an attribute is equal to a given value
-        atr = None
-        val = None
-        if self.children[0].__class__.__name__ == 'AttributeName' and self.children[1].__class__.__name__ == 'StringLiteral':
-            atr = self.children[0].value
-            val = self.children[1].value
-        if self.children[1].__class__.__name__ == 'AttributeName' and self.children[0].__class__.__name__ == 'StringLiteral':
-            atr = self.children[1].value
-            val = self.children[0].value
+        # the text of a node is more expensive to get than an attribute
+        if any(isinstance(c, TextValue) for c in self.children):
+            return 3 * self.attribute_cost
+        return self.attribute_cost
 
-        # return
-        pos = [x for x in node_set_pos if (atr in x.attrs and val in x.attrs[atr])]
-        neg = [x for x in node_set_pos if (atr not in x.attrs or val not in x.attrs[atr])]
-        return (pos, neg)
+class TextContains(TextPredicate):
 
-class TextStartsWith(Predicate):
+    attribute_cost = 3.0
 
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def selectivity(self):
+        return 0.25
 
-        # nodes where an attribute is equal to a given value
-        atr = None
-        val = None
-        if self.children[0].__class__.__name__ == 'AttributeName' and self.children[1].__class__.__name__ == 'StringLiteral':
-            atr = self.children[0].value
-            val = self.children[1].value
-        if self.children[1].__class__.__name__ == 'AttributeName' and self.children[0].__class__.__name__ == 'StringLiteral':
-            atr = self.children[1].value
-            val = self.children[0].value
+    def _compile(self, adapter):
+        (atr, val) = self._arguments()
+        if atr is None:
+            test = adapter.text_contains
+            return lambda x: test(x, val)
+        attrs = adapter.attributes
+        return lambda x: atr in attrs(x) and val in attrs(x)[atr]
 
-        # return
-        pos = [x for x in node_set_pos if (atr in x.attrs and x.attrs[atr].startswith(val))]
-        neg = [x for x in node_set_pos if (atr not in x.attrs or not x.attrs[atr].startswith(val))]
-        return (pos, neg)
+    def lookup(self, adapter=BEAUTIFUL_SOUP):
+        (atr, val) = self._arguments()
+        if atr is None:
+            return None
+        column = adapter.column(atr)
+        return None if column is None else column.scan(lambda v: val in v)
+
+class TextStartsWith(TextPredicate):
 
-class TextEndsWith(Predicate):
+    attribute_cost = 1.5
 
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def selectivity(self):
+        return 0.2
 
-        # nodes where an attribute is equal to a given value
-        atr = None
-        val = None
-        if self.children[0].__class__.__name__ == 'AttributeName' and self.children[1].__class__.__name__ == 'StringLiteral':
-            atr = self.children[0].value
-            val = self.children[1].value
-        if self.children[1].__class__.__name__ == 'AttributeName' and self.children[0].__class__.__name__ == 'StringLiteral':
-            atr = self.children[1].value
-            val = self.children[0].value
+    def _compile(self, adapter):
+        (atr, val) = self._arguments()
+        if atr is None:
+            test = adapter.text_startswith
+            return lambda x: test(x, val)
+        attrs = adapter.attributes
+        return lambda x: atr in attrs(x) and attrs(x)[atr].startswith(val)
 
-        # return
-        pos = [x for x in node_set_pos if (atr in x.attrs and x.attrs[atr].endswith(val))]
-        neg = [x for x in node_set_pos if (atr not in x.attrs or not x.attrs[atr].endswith(val))]
-        return (pos, neg)
+    def lookup(self, adapter=BEAUTIFUL_SOUP):
+        (atr, val) = self._arguments()
+        if atr is None:
+            return None
+        column = adapter.column(atr)
+        return None if column is None else column.prefix(val)
+
+class TextEndsWith(TextPredicate):
+
+    attribute_cost = 1.5
+
+    def __init__(self):
+        super().__init__()
+
+    def selectivity(self):
+        return 0.2
+
+    def _compile(self, adapter):
+        (atr, val) = self._arguments()
+        if atr is None:
+            test = adapter.text_endswith
+            return lambda x: test(x, val)
+        attrs = adapter.attributes
+        return lambda x: atr in attrs(x) and attrs(x)[atr].endswith(val)
+
+    def lookup(self, adapter=BEAUTIFUL_SOUP):
+        (atr, val) = self._arguments()
+        if atr is None:
+            return None
+        column = adapter.column(atr)
+        if column is None or not column.is_text():
+            return None
+        return column.scan(lambda v: v.endswith(val))
 
 class TextLength(Predicate):
 
     def __init__(self):
         super().__init__()
 
-    def evaluate(self, node_set_pos, node_set_neg):
+    def _compile(self, adapter):
         raise NotImplementedError()
 
 class XPATHSyntaxTree:
 
+    # the step that implements each axis
+    AXES = {'ancestor': SelectAncestors, 'child': SelectChildren, 'descendant': SelectAll,
+            'following-sibling': SelectFollowingSiblings, 'parent': SelectParent,
+            'preceding-sibling': SelectPrecedingSiblings, 'self': SelectSelf}
+
     def xpath_to_syntax_tree(self, xpath_expression):
 
         # tokenize
-        tokens = XPATHTokenizer().tokenize_expression(xpath_expression)
+        tokens = XPATHTokenizer().tokenize(xpath_expression)
+        kinds = [t.kind for t in tokens]
+        tokens = [t.text for t in tokens]
 
         # replace each part by its matching syntax tree
+        # positions are counted per parent after '/', '//' and 'child::', per context node after any other axis
+        # (the steps whose positions are counted per context node are grouped into a LocationStep at the end)
         nodes = []
+        grouping = None
+        step = None
+        grouped = []
         i = 0
         while i < len(tokens):
 
             # predicate
             if tokens[i] == '[':
                 j = tokens.index(']', i)
-                nodes.append(self._predicate_postfix_to_tree(self._predicate_to_postfix(tokens[i:j+1])))
+                n = self._positional_predicate(self._predicate_postfix_to_tree(self._predicate_to_postfix(tokens[i:j+1])), grouping == 'parent')
+                if isinstance(n, Position) and grouping == 'context' and step not in grouped:
+                    grouped.append(step)
+                nodes.append(n)
                 i = j + 1
                 continue
 
-            # select from root node
+            # select children, if '/' is followed by a tag name or '*'
+            # otherwise (e.g. '/@attr', '/text()', '/..' or '/axis::') the next step navigates by itself
             if tokens[i] == '/':
-                nodes.append(SelectFromRootNode())
+                if i + 1 < len(tokens) and (tokens[i + 1] == '*' or kinds[i + 1] == XPATHTokenizer.HTML_TAG):
+                    (grouping, step) = ('parent', len(nodes))
+                    nodes.append(SelectChildren())
+                else:
+                    (grouping, step) = (None, None)
+                    nodes.append(SelectFromRootNode())
                 i += 1
                 continue
 
+            # select parent, select self
+            if tokens[i] == '..':
+                (grouping, step) = ('context', len(nodes))
+                nodes.append(SelectParent())
+                i += 1
+                continue
+            if tokens[i] == '.':
+                (grouping, step) = ('context', len(nodes))
+                nodes.append(SelectSelf())
+                i += 1
+                continue
+
+            # axis
+            if kinds[i] == XPATHTokenizer.AXIS:
+                if i + 1 >= len(tokens) or tokens[i + 1] != '::':
+                    raise SyntaxError('Expected \'::\' after axis {} in XPATH'.format(tokens[i]))
+                (grouping, step) = ('parent' if tokens[i] == 'child' else 'context', len(nodes))
+                nodes.append(XPATHSyntaxTree.AXES[tokens[i]]())
+                i += 2
+                continue
+
             # select all
             if tokens[i] == '//':
+                (grouping, step) = ('parent', len(nodes))
                 nodes.append(SelectAll())
                 i += 1
                 continue
@@ -577,13 +1499,15 @@ class XPATHSyntaxTree:
             # select text
             if tokens[i] == 'text':
                 nodes.append(SelectText())
-                if tokens[i+1] == '(' and tokens[i+2] == ')':
+                if tokens[i+1:i+3] == ['(', ')']:
                     i += 2
                 i += 1
                 continue
 
-            # select HTML tag
-            if re.compile('^[a-zA-Z]+$').match(tokens[i]):
+            # select HTML tag (or any other element name)
+            if kinds[i] == XPATHTokenizer.HTML_TAG:
+                if i + 1 < len(tokens) and tokens[i + 1] == '::':
+                    raise SyntaxError('Unknown axis {} in XPATH'.format(tokens[i]))
                 nodes.append(SelectHTMLTag(tokens[i]))
                 i += 1
                 continue
@@ -592,7 +1516,30 @@ class XPATHSyntaxTree:
             i += 1
 
         # return
-        return nodes
+        return self._location_steps(nodes, grouped)
+
+    def _location_steps(self, nodes, grouped):
+        """
+        This function groups each of the given steps with the node test and predicates that follow it
+        into a LocationStep
+        :param nodes:   the syntax tree nodes of the XPATH expression
+        :param grouped: the indices of the steps (axis nodes) to be grouped
+        :return:        the syntax tree nodes, with a LocationStep in place of each grouped step
+        """
+        out = []
+        i = 0
+        while i < len(nodes):
+            if i not in grouped:
+                out.append(nodes[i])
+                i += 1
+                continue
+            step = LocationStep().add_child(nodes[i])
+            i += 1
+            while i < len(nodes) and isinstance(nodes[i], (SelectHTMLTag, SelectStar, Predicate, AttributeName)):
+                step.add_child(nodes[i])
+                i += 1
+            out.append(step)
+        return out
 
     def _predicate_postfix_to_tree(self, xpath_postfix_predicate_expression):
 
@@ -609,6 +1556,15 @@ class XPATHSyntaxTree:
             if re.compile('^[0-9]+').match(t):
                 tree.append(NumberLiteral(t))
                 continue
+            if t == 'position':
+                tree.append(FunctionPosition())
+                continue
+            if t == 'last':
+                tree.append(FunctionLast())
+                continue
+            if t == 'text':
+                tree.append(TextValue())
+                continue
 
             # relationship operators
             if t == '>':
@@ -645,12 +1601,49 @@ class XPATHSyntaxTree:
         # return
         return tree[0]
 
+    def _positional_predicate(self, tree, per_parent=False):
+        """
+        This function converts the syntax tree of a positional predicate ('[2]', '[last()]', '[position() < 3]')
+        into a Position node
+        :param tree:        the syntax tree of a predicate
+        :param per_parent:  True if positions are counted among the nodes that share a parent (see Position)
+        :return:            a Position node, or the syntax tree itself if it is not a positional predicate
+        """
+
+        # [n] and [last()]
+        if isinstance(tree, NumberLiteral):
+            return Position('=', tree.value, per_parent)
+        if isinstance(tree, FunctionLast):
+            return Position('=', 'last', per_parent)
+
+        # position() compared to a number or last()
+        if isinstance(tree, Comparison):
+            r = tree.children[0]
+            l = tree.children[1]
+            flipped = {'=': '=', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+            comparator = {Equal: '=', NotEqual: '!=', SmallerThan: '<', SmallerThanOrEqual: '<=', GreaterThan: '>', GreaterThanOrEqual: '>='}[tree.__class__]
+            if isinstance(l, FunctionPosition) and isinstance(r, (NumberLiteral, FunctionLast)):
+                return Position(comparator, 'last' if isinstance(r, FunctionLast) else r.value, per_parent)
+            if isinstance(r, FunctionPosition) and isinstance(l, (NumberLiteral, FunctionLast)):
+                return Position(flipped[comparator], 'last' if isinstance(l, FunctionLast) else l.value, per_parent)
+
+        # position() and last() can not be used anywhere else
+        stk = [tree]
+        while len(stk) > 0:
+            n = stk.pop(-1)
+            if isinstance(n, (FunctionPosition, FunctionLast)):
+                raise SyntaxError('Positional predicates can not be combined with other predicates in XPATH')
+            stk.extend(n.children)
+
+        # return
+        return tree
+
     def _precedence(self, xpath_operator):
-        if xpath_operator == '=':
-            return 1
         if xpath_operator == 'or':
-            return 2
+            return 1
         if xpath_operator == 'and':
+            return 2
+        if xpath_operator in ['=', '!=']:
             return 3
         if xpath_operator in ['>','>=','<','<=']:
             return 4
@@ -711,7 +1704,8 @@ class XPATHSyntaxTree:
                 continue
 
             # if the token is an operand then push it to the output queue
-            is_operand = t.startswith('@') or t.startswith('\'')
+            # (position(), last() and text() take no arguments, so they are treated as operands)
+            is_operand = t.startswith('@') or t.startswith('\'') or t.isdigit() or t in ['position', 'last', 'text']
             is_operator = not is_operand
             if is_operand:
                 out.append(t)
@@ -0,0 +1,167 @@
+from array import array
+
+import bs4 as bs
+
+from xpath_adapter import BeautifulSoupAdapter
+
+
+class TextIndex:
+    """
+    This class precomputes the text of every element of a (BeautifulSoup) document, once.
+    All strings that BeautifulSoup includes in the text of an ordinary element are concatenated into a single buffer,
+    every element is numbered in document (pre-)order (the document node is number 0), and its text is the slice of
+    the buffer between its start and end offset. Text predicates (contains, starts-with, ends-with) are answered on
+    the buffer itself, without copying the text.
+    Strings of other types (such as the content of script and style elements, or comments) are kept aside, with their
+    offset in the buffer, for the few elements whose text is made up of them.
+    The index can be queried like a document, it evaluates XPATH expressions on the BeautifulSoup document it was
+    built from.
+    """
+
+    def __init__(self, bs_doc, by_node=True):
+        """
+        :param bs_doc:  the BeautifulSoup document
+        :param by_node: False if elements are only looked up by number (the index then holds no adapter)
+        """
+        self.document = bs_doc
+        self.starts = array('i')
+        self.ends = array('i')
+        self._types = array('b')
+        self._type_sets = []
+        self._special = []
+        self._special_starts = array('i')
+        self._special_ends = array('i')
+        self._numbers = {}
+
+        # the types of string held in the buffer
+        types = bs_doc.interesting_string_types
+        self._buffer_types = frozenset([types] if isinstance(types, type) else types)
+
+        parts = []
+        length = 0
+
+        def add(x):
+            i = len(self.starts)
+            if by_node:
+                self._numbers[id(x)] = i
+            self.starts.append(length)
+            self.ends.append(length)
+            self._special_starts.append(len(self._special))
+            self._special_ends.append(len(self._special))
+            types = x.interesting_string_types
+            types = frozenset([types] if isinstance(types, type) else (types or []))
+            if types not in self._type_sets:
+                self._type_sets.append(types)
+            self._types.append(self._type_sets.index(types))
+            return i
+
+        def close(stack):
+            (_, i) = stack.pop(-1)
+            self.ends[i] = length
+            self._special_ends[i] = len(self._special)
+
+        # elements and strings, in document order
+        stack = [(bs_doc, add(bs_doc))]
+        for x in bs_doc.descendants:
+            while stack[-1][0] is not x.parent:
+                close(stack)
+            if isinstance(x, bs.Tag):
+                stack.append((x, add(x)))
+            elif type(x) in self._buffer_types:
+                parts.append(x)
+                length += len(x)
+            else:
+                self._special.append((length, type(x), str(x)))
+        while len(stack) > 0:
+            close(stack)
+
+        self.buffer = ''.join(parts)
+        self._buffer_type_set = self._type_sets.index(self._buffer_types) if self._buffer_types in self._type_sets else -1
+        if by_node:
+            self.adapter = TextIndexAdapter(self)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def number(self, node):
+        """
+        This function returns the number of an element of the document
+        :param node:    the element
+        :return:        its number, in document order
+        """
+        return self._numbers[id(node)]
+
+    def text(self, i):
+        """
+        This function returns the text of an element, the way BeautifulSoup does
+        :param i:   the number of the element
+        :return:    a string
+        """
+        if self._types[i] == self._buffer_type_set:
+            return self.buffer[self.starts[i]:self.ends[i]]
+
+        # merge the buffer and the strings kept aside, keeping the types included in the text of this element
+        types = self._type_sets[self._types[i]]
+        include_buffer = len(types & self._buffer_types) > 0
+        out = []
+        start = self.starts[i]
+        for (offset, t, s) in self._special[self._special_starts[i]:self._special_ends[i]]:
+            if include_buffer:
+                out.append(self.buffer[start:offset])
+                start = offset
+            if t in types:
+                out.append(s)
+        if include_buffer:
+            out.append(self.buffer[start:self.ends[i]])
+        return ''.join(out)
+
+    def contains(self, i, s):
+        """
+        This function checks whether the text of an element contains a string
+        :param i:   the number of the element
+        :param s:   the string
+        :return:    True if the text of the element contains the string, False otherwise
+        """
+        if self._types[i] == self._buffer_type_set:
+            return self.buffer.find(s, self.starts[i], self.ends[i]) != -1
+        return s in self.text(i)
+
+    def startswith(self, i, s):
+        """
+        This function checks whether the text of an element starts with a string
+        :param i:   the number of the element
+        :param s:   the string
+        :return:    True if the text of the element starts with the string, False otherwise
+        """
+        if self._types[i] == self._buffer_type_set:
+            return self.buffer.startswith(s, self.starts[i], self.ends[i])
+        return self.text(i).startswith(s)
+
+    def endswith(self, i, s):
+        """
+        This function checks whether the text of an element ends with a string
+        :param i:   the number of the element
+        :param s:   the string
+        :return:    True if the text of the element ends with the string, False otherwise
+        """
+        if self._types[i] == self._buffer_type_set:
+            return self.buffer.endswith(s, self.starts[i], self.ends[i])
+        return self.text(i).endswith(s)
+
+
+class TextIndexAdapter(BeautifulSoupAdapter):
+    """
+    This class implements the TreeAdapter for a BeautifulSoup document with a TextIndex.
+    Nodes are BeautifulSoup elements, their text is served from the index.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        number = index._numbers.__getitem__
+        self.text = lambda x: index.text(number(id(x)))
+        self.text_contains = lambda x, s: index.contains(number(id(x)), s)
+        self.text_startswith = lambda x, s: index.startswith(number(id(x)), s)
+        self.text_endswith = lambda x, s: index.endswith(number(id(x)), s)
+
+    def document(self, doc):
+        return self.index.document
@@ -1,15 +1,41 @@
 import re
 
+
+class XPATHToken:
+    """
+    This class represents a single token of an XPATH expression, along with its position in the source expression.
+    """
+
+    __slots__ = ('text', 'kind', 'start', 'end')
+
+    def __init__(self, text, kind, start, end):
+        self.text = text
+        self.kind = kind
+        self.start = start
+        self.end = end
+
+    def __eq__(self, other):
+        if isinstance(other, XPATHToken):
+            return (self.text, self.kind, self.start, self.end) == (other.text, other.kind, other.start, other.end)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.text, self.kind, self.start, self.end))
+
+    def __repr__(self):
+        return 'XPATHToken({!r}, {!r}, {}, {})'.format(self.text, self.kind, self.start, self.end)
+
+
 class XPATHTokenizer:
     """
     This class implements a (greedy) tokenizer for XPATH expressions.
     """
 
-    def __init__(self):
-        self.left_brackets = ['(','{','[']
-        self.right_brackets = [')','}',']']
-        self.operators = ['contains', 'ends-with', 'length', 'not', 'starts-with', 'text', '=', '!=', '<=', '<', '>=', '>', 'or', 'and', '//', '/', '*']
-        self.html_tags = ['a', 'abbr', 'acronym', 'address', 'applet', 'area', 'article', 'aside', 'audio',
+    LEFT_BRACKETS = ['(','{','[']
+    RIGHT_BRACKETS = [')','}',']']
+    OPERATORS = ['contains', 'ends-with', 'last', 'length', 'not', 'position', 'starts-with', 'text', '=', '!=', '<=', '<', '>=', '>', 'or', 'and', '//', '/', '*', '::', '..', '.']
+    AXES = ['ancestor', 'child', 'descendant', 'following-sibling', 'parent', 'preceding-sibling', 'self']
+    HTML_TAGS = ['a', 'abbr', 'acronym', 'address', 'applet', 'area', 'article', 'aside', 'audio',
                  'b', 'base', 'basefont', 'bb', 'bdo', 'big', 'blockquote', 'body', 'br', 'button',
                  'canvas', 'caption', 'center', 'cite', 'code', 'col', 'colgroup', 'command',
                  'datagrid', 'datalist', 'dd', 'del', 'details', 'dfn', 'dialog', 'dir', 'div', 'dl', 'dt',
@@ -32,6 +58,60 @@ class XPATHTokenizer:
                  'var', 'video',
                  'wbr']
 
+    # token kinds
+    # (names that are not operators or axes are element names, of kind HTML_TAG whether or not they are HTML tag names,
+    # so that XML documents can be queried as well)
+    COMMA = 'comma'
+    BRACKET = 'bracket'
+    OPERATOR = 'operator'
+    HTML_TAG = 'html-tag'
+    AXIS = 'axis'
+    ATTRIBUTE = 'attribute'
+    STRING = 'string'
+    NUMBER = 'number'
+    WHITESPACE = 'whitespace'
+
+    def __init__(self):
+        self.left_brackets = list(XPATHTokenizer.LEFT_BRACKETS)
+        self.right_brackets = list(XPATHTokenizer.RIGHT_BRACKETS)
+        self.operators = list(XPATHTokenizer.OPERATORS)
+        self.html_tags = list(XPATHTokenizer.HTML_TAGS)
+        self.axes = list(XPATHTokenizer.AXES)
+
+    @staticmethod
+    def _build_master_pattern():
+        """
+        This function builds the single regular expression that drives the tokenizer.
+        Names (letters, digits, '_', '-' and '.', starting with a letter or '_') are matched as a whole, and looked up
+        among the fixed tokens (operators such as 'and' or 'contains', HTML tags and axes), any other name is an
+        element name. The remaining fixed tokens (brackets and symbols) are tried longest first,
+        so that the first alternative that matches is also the longest one.
+        :return:    a tuple (compiled pattern, dictionary mapping each fixed token to its kind)
+        """
+        kinds = {}
+        for t in XPATHTokenizer.LEFT_BRACKETS + XPATHTokenizer.RIGHT_BRACKETS:
+            kinds.setdefault(t, XPATHTokenizer.BRACKET)
+        for t in XPATHTokenizer.OPERATORS:
+            kinds.setdefault(t, XPATHTokenizer.OPERATOR)
+        for t in XPATHTokenizer.HTML_TAGS:
+            kinds.setdefault(t, XPATHTokenizer.HTML_TAG)
+        for t in XPATHTokenizer.AXES:
+            kinds.setdefault(t, XPATHTokenizer.AXIS)
+        fixed = '|'.join(re.escape(t) for t in sorted(kinds, key=len, reverse=True))
+        pattern = re.compile('(?P<{}>@[a-zA-Z0-9-]+)'
+                             '|(?P<{}>\'[^\']+\')'
+                             '|(?P<{}>[0-9]+)'
+                             '|(?P<{}> )'
+                             '|(?P<{}>,)'
+                             '|(?P<name>[a-zA-Z_][a-zA-Z0-9_.-]*)'
+                             '|(?P<fixed>{})'.format(XPATHTokenizer.ATTRIBUTE,
+                                                     XPATHTokenizer.STRING,
+                                                     XPATHTokenizer.NUMBER,
+                                                     XPATHTokenizer.WHITESPACE,
+                                                     XPATHTokenizer.COMMA,
+                                                     fixed))
+        return pattern, kinds
+
     def _check_brackets(self, xpath_expression):
         """
         This function checks whether brackets match in an XPATH expression
@@ -62,36 +142,45 @@ class XPATHTokenizer:
                 # pop bracket
                 stk.pop(-1)
 
-
-    def tokenize_expression(self, xpath_expression):
+    def tokenize(self, xpath_expression):
         """
-        This function tokenizes an XPATH expression
+        This function tokenizes an XPATH expression in a single pass
         :param xpath_expression:    the XPATH expression to be tokenized
-        :return:                    a list of strings representing the tokens
+        :return:                    a list of XPATHToken objects
         """
 
         # check brackets
         self._check_brackets(xpath_expression)
 
-        # greedy tokenization strategy
+        # single pass over the expression, driven by the master pattern
+        match = XPATHTokenizer._MASTER_PATTERN.match
+        kinds = XPATHTokenizer._FIXED_TOKEN_KINDS
         tokens = []
-
-        while xpath_expression != '':
-            token_candidates = [
-                ',' if xpath_expression.startswith(',') else '',
-                max([x for x in (self.right_brackets + self.left_brackets) if xpath_expression.startswith(x)] + [''], key=len),
-                max([x for x in self.operators if xpath_expression.startswith(x)] + [''], key=len),
-                max([x for x in self.html_tags if xpath_expression.startswith(x)] + [''], key=len),
-                re.compile('^@[a-zA-Z0-9-]+').match(xpath_expression).group(0) if re.compile('^@[a-zA-Z0-9-]+').match(xpath_expression) else '',
-                re.compile('^\'[^\']+\'').match(xpath_expression).group(0) if re.compile('^\'[^\']+\'').match(xpath_expression) else '',
-                re.compile('^[0-9]+').match(xpath_expression).group(0) if re.compile('^[0-9]+').match(xpath_expression) else '',
-                ' ' if re.compile('^ +').match(xpath_expression) else '',
-            ]
-            token = max(token_candidates, key=len)
-            if token == '':
-                raise SyntaxError('Unable to process XPATH expression. Invalid/unknown token for sub-string {}'.format(xpath_expression))
-            tokens.append(token)
-            xpath_expression = xpath_expression[len(token):]
+        i = 0
+        n = len(xpath_expression)
+        while i < n:
+            m = match(xpath_expression, i)
+            if m is None:
+                raise SyntaxError('Unable to process XPATH expression. Invalid/unknown token for sub-string {}'.format(xpath_expression[i:]))
+            text = m.group(0)
+            kind = m.lastgroup
+            if kind == 'fixed':
+                kind = kinds[text]
+            elif kind == 'name':
+                kind = kinds.get(text, XPATHTokenizer.HTML_TAG)
+            tokens.append(XPATHToken(text, kind, i, m.end()))
+            i = m.end()
 
         # output
-        return tokens
\ No newline at end of file
+        return tokens
+
+    def tokenize_expression(self, xpath_expression):
+        """
+        This function tokenizes an XPATH expression
+        :param xpath_expression:    the XPATH expression to be tokenized
+        :return:                    a list of strings representing the tokens
+        """
+        return [t.text for t in self.tokenize(xpath_expression)]
+
+
+XPATHTokenizer._MASTER_PATTERN, XPATHTokenizer._FIXED_TOKEN_KINDS = XPATHTokenizer._build_master_pattern()